@@ -0,0 +1,150 @@
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, List
+
+from .config import get_float_env
+from .metrics import observe_stage
+
+# Admission control for the slow pipeline stages. Each gate caps how many calls run at once and how
+# many may wait. A request carries a deadline (X-Request-Timeout, capped by REQUEST_TIMEOUT_SECONDS)
+# and is turned away up front when its expected queue wait plus service time would miss it. Under
+# overload, excess requests get a fast 429/503 with Retry-After, and admitted requests keep normal latency.
+REQUEST_TIMEOUT_SECONDS_ENV = "REQUEST_TIMEOUT_SECONDS"
+DEFAULT_REQUEST_TIMEOUT_SECONDS = 30.0
+TIMEOUT_HEADER = b"x-request-timeout"
+QUEUE_FULL = "queue_full"
+DEADLINE = "deadline"
+# Weight of the newest call in the service-time average.
+SERVICE_TIME_ALPHA = 0.2
+
+# time.monotonic() by which the current request must be answered; None outside a request.
+_deadline: ContextVar[float | None] = ContextVar("deadline", default=None)
+
+
+class Overloaded(Exception):
+    def __init__(self, stage: str, reason: str, retry_after: float) -> None:
+        # 429 when the queue is full (back off), 503 when the wait would outlast the deadline.
+        self.status_code = 429 if reason == QUEUE_FULL else 503
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(f"{stage} is overloaded; retry in {self.retry_after}s")
+
+
+def remaining_seconds() -> float | None:
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def budget(seconds: float) -> float:
+    # A stage's own timeout, shortened to whatever is left of the request's deadline.
+    remaining = remaining_seconds()
+    return seconds if remaining is None else max(min(seconds, remaining), 0.0)
+
+
+class DeadlineMiddleware:
+    # Sets the deadline for /api/* requests. Clients may ask for less time than the default, never more.
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http" or not scope["path"].startswith("/api/"):
+            await self.app(scope, receive, send)
+            return
+        seconds = get_float_env(REQUEST_TIMEOUT_SECONDS_ENV, DEFAULT_REQUEST_TIMEOUT_SECONDS)
+        for name, value in scope.get("headers", ()):
+            if name == TIMEOUT_HEADER:
+                try:
+                    requested = float(value)
+                except ValueError:
+                    break
+                if requested > 0:
+                    seconds = min(seconds, requested)
+                break
+        token = _deadline.set(time.monotonic() + seconds)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _deadline.reset(token)
+
+
+_gates: List["AdmissionGate"] = []
+
+
+class AdmissionGate:
+    def __init__(self, stage: str, limit: int, max_queue: int) -> None:
+        if limit < 1:
+            raise ValueError(f"{stage} concurrency limit must be at least 1")
+        self.stage = stage
+        self.limit = limit
+        self.max_queue = max(max_queue, 0)
+        self._semaphore = asyncio.Semaphore(limit)
+        self.active = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = {QUEUE_FULL: 0, DEADLINE: 0}
+        self.service_seconds = 0.0
+        _gates.append(self)
+
+    def expected_wait(self) -> float:
+        # Waiters ahead of us drain `limit` at a time, each taking about one average service time.
+        if self.active < self.limit and not self.queued:
+            return 0.0
+        return (self.queued // self.limit + 1) * self.service_seconds
+
+    def _reject(self, reason: str, retry_after: float) -> Overloaded:
+        self.rejected[reason] += 1
+        return Overloaded(self.stage, reason, retry_after)
+
+    async def _acquire(self) -> None:
+        wait = self.expected_wait()
+        if (self.active >= self.limit or self.queued) and self.queued >= self.max_queue:
+            raise self._reject(QUEUE_FULL, wait)
+        remaining = remaining_seconds()
+        # Not worth starting what cannot finish in time: it would only hold a slot and then time out.
+        if remaining is not None and wait + self.service_seconds > remaining:
+            raise self._reject(DEADLINE, wait)
+        started = time.perf_counter()
+        self.queued += 1
+        try:
+            async with asyncio.timeout(remaining_seconds()):
+                await self._semaphore.acquire()
+        except TimeoutError:
+            raise self._reject(DEADLINE, self.expected_wait()) from None
+        finally:
+            self.queued -= 1
+        observe_stage(f"{self.stage}_queue", (time.perf_counter() - started) * 1000)
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        await self._acquire()
+        self.admitted += 1
+        self.active += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+            elapsed = time.perf_counter() - started
+            if self.service_seconds:
+                self.service_seconds += SERVICE_TIME_ALPHA * (elapsed - self.service_seconds)
+            else:
+                self.service_seconds = elapsed
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "service_ms": round(self.service_seconds * 1000, 3),
+            "expected_wait_ms": round(self.expected_wait() * 1000, 3),
+        }
+
+
+def admission_stats() -> Dict[str, Dict[str, Any]]:
+    return {gate.stage: gate.stats() for gate in _gates}
@@ -0,0 +1,241 @@
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Dict
+
+import numpy as np
+
+from .config import get_env
+from .local_engine import (
+    Dataset,
+    LocalResult,
+    category_selection,
+    check_grouping,
+    empty_aggregate_result,
+    get_dataset,
+    order_and_project,
+)
+from .schema import NON_NUMERIC_COLUMNS, NUMERIC_COLUMNS
+from .sql_plan import Comparison, Statement
+
+logger = logging.getLogger(__name__)
+
+# Precomputed count/sum/min/max for every numeric column over every combination of the
+# non-numeric columns and age buckets. Queries that only touch those dimensions are answered
+# from the cells instead of scanning rows.
+CUBE_MODE_ENV = "AGGREGATE_CUBE"
+CUBE_AGE_BUCKETS_ENV = "CUBE_AGE_BUCKETS"
+CUBE_MODES = ("lazy", "startup", "off")
+DEFAULT_CUBE_MODE = "lazy"
+AGE_COLUMN = "age"
+
+
+@dataclass(eq=False)
+class AggregateCube:
+    dimensions: tuple[str, ...]
+    # Per dimension: the cell's code and the labels those codes map to.
+    cell_codes: Dict[str, np.ndarray]
+    labels: Dict[str, np.ndarray]
+    # Actual smallest/largest age in each cell, used to decide whether an age predicate splits a cell.
+    age_min: np.ndarray
+    age_max: np.ndarray
+    row_counts: np.ndarray
+    counts: Dict[str, np.ndarray] = field(default_factory=dict)
+    sums: Dict[str, np.ndarray] = field(default_factory=dict)
+    minimums: Dict[str, np.ndarray] = field(default_factory=dict)
+    maximums: Dict[str, np.ndarray] = field(default_factory=dict)
+
+    @property
+    def single_age_cells(self) -> bool:
+        present = self.row_counts > 0
+        return bool(np.all(self.age_min[present] == self.age_max[present]))
+
+
+def cube_mode() -> str:
+    mode = (get_env(CUBE_MODE_ENV, DEFAULT_CUBE_MODE) or DEFAULT_CUBE_MODE).strip().lower()
+    if mode not in CUBE_MODES:
+        raise ValueError(f"{CUBE_MODE_ENV} must be one of {', '.join(CUBE_MODES)}, got {mode!r}")
+    return mode
+
+
+def _age_bucket_edges(ages: np.ndarray) -> np.ndarray:
+    # Default: one bucket per distinct age, so any integer age threshold lines up with a bucket edge.
+    configured = get_env(CUBE_AGE_BUCKETS_ENV)
+    if configured:
+        return np.array(sorted(float(edge) for edge in configured.split(",") if edge.strip()))
+    return np.unique(ages[~np.isnan(ages)])
+
+
+def _reduce_cells(reducer: np.ufunc, cells: np.ndarray, values: np.ndarray, size: int) -> np.ndarray:
+    result = np.full(size, np.nan)
+    reducer.at(result, cells, values)
+    return result
+
+
+def build_cube(dataset: Dataset) -> AggregateCube:
+    ages = dataset.columns[AGE_COLUMN]
+    edges = _age_bucket_edges(ages)
+    buckets = np.clip(np.searchsorted(edges, ages, side="right") - 1, 0, None)
+    bucket_count = max(len(edges), 1)
+    dimensions = tuple(NON_NUMERIC_COLUMNS) + (AGE_COLUMN,)
+    cardinalities = [len(dataset.categories[name]) for name in NON_NUMERIC_COLUMNS] + [bucket_count]
+    cells = np.zeros(dataset.row_count, dtype=np.int64)
+    for name, cardinality in zip(dimensions, cardinalities):
+        codes = buckets if name == AGE_COLUMN else dataset.codes[name]
+        cells = cells * cardinality + codes
+    size = int(np.prod(cardinalities))
+
+    cell_codes: Dict[str, np.ndarray] = {}
+    remainder = np.arange(size)
+    for name, cardinality in reversed(list(zip(dimensions, cardinalities))):
+        cell_codes[name] = remainder % cardinality
+        remainder = remainder // cardinality
+    labels = {name: dataset.categories[name] for name in NON_NUMERIC_COLUMNS}
+    labels[AGE_COLUMN] = edges
+
+    cube = AggregateCube(
+        dimensions=dimensions,
+        cell_codes=cell_codes,
+        labels=labels,
+        age_min=_reduce_cells(np.fmin, cells, ages, size),
+        age_max=_reduce_cells(np.fmax, cells, ages, size),
+        row_counts=np.bincount(cells, minlength=size),
+    )
+    for name in NUMERIC_COLUMNS:
+        values = dataset.columns[name]
+        present = ~np.isnan(values)
+        cube.counts[name] = np.bincount(cells, weights=present, minlength=size).astype(np.int64)
+        cube.sums[name] = np.bincount(cells, weights=np.where(present, values, 0.0), minlength=size)
+        cube.minimums[name] = _reduce_cells(np.fmin, cells, values, size)
+        cube.maximums[name] = _reduce_cells(np.fmax, cells, values, size)
+    logger.info("Built aggregate cube", extra={"cells": size, "populated": int((cube.row_counts > 0).sum())})
+    return cube
+
+
+_cube: AggregateCube | None = None
+# Guards the lazy build, which may also be reached from worker threads (see LRUCache).
+_cube_lock = threading.Lock()
+
+
+def get_cube() -> AggregateCube:
+    global _cube
+    if _cube is None:
+        with _cube_lock:
+            if _cube is None:
+                _cube = build_cube(get_dataset())
+    return _cube
+
+
+def reset_cube() -> None:
+    # Call when the dataset is reloaded; the next query rebuilds the cube.
+    global _cube
+    with _cube_lock:
+        _cube = None
+
+
+def _age_selection(cube: AggregateCube, comparison: Comparison) -> np.ndarray | None:
+    if any(not isinstance(value, float) for value in comparison.values):
+        return None
+    low, high = cube.age_min, cube.age_max
+    if comparison.operator in ("=", "IN"):
+        values = np.array(comparison.values)
+        inside = (values[None, :] >= low[:, None]) & (values[None, :] <= high[:, None])
+        whole = (low == high) & inside.any(axis=1)
+        none = ~inside.any(axis=1)
+    else:
+        probe = Comparison(column=AGE_COLUMN, operator=comparison.operator, values=comparison.values)
+        at_low = category_selection(low, probe)
+        at_high = category_selection(high, probe)
+        # Range predicates are monotone, so agreement at both ends covers the whole cell.
+        whole = at_low & at_high
+        none = ~at_low & ~at_high
+    empty = np.isnan(low)
+    if not np.all(whole | none | empty):
+        return None
+    return whole
+
+
+def _cell_mask(cube: AggregateCube, statement: Statement) -> np.ndarray | None:
+    mask = cube.row_counts > 0
+    for comparison in statement.conditions:
+        if comparison.column in NON_NUMERIC_COLUMNS:
+            if any(not isinstance(value, str) for value in comparison.values):
+                return None
+            selected = category_selection(cube.labels[comparison.column], comparison)
+            mask &= selected[cube.cell_codes[comparison.column]]
+        elif comparison.column == AGE_COLUMN:
+            selected = _age_selection(cube, comparison)
+            if selected is None:
+                return None
+            mask &= selected
+        else:
+            return None
+    return mask
+
+
+def _covers(cube: AggregateCube, statement: Statement) -> bool:
+    for column in statement.group_by:
+        if column == AGE_COLUMN and not cube.single_age_cells:
+            return False
+        if column not in cube.dimensions:
+            return False
+    return True
+
+
+def _group_value(cube: AggregateCube, column: str, cells: np.ndarray) -> np.ndarray:
+    if column == AGE_COLUMN:
+        return cube.age_min[cells]
+    return cube.labels[column][cube.cell_codes[column][cells]]
+
+
+def _aggregate(cube: AggregateCube, function: str, column: str, cells: np.ndarray, group_ids: np.ndarray, groups: int):
+    if column in NON_NUMERIC_COLUMNS:
+        return np.bincount(group_ids, weights=cube.row_counts[cells], minlength=groups).astype(np.int64)
+    counts = np.bincount(group_ids, weights=cube.counts[column][cells], minlength=groups)
+    if function == "COUNT":
+        return counts.astype(np.int64)
+    if function in ("SUM", "AVG"):
+        sums = np.bincount(group_ids, weights=cube.sums[column][cells], minlength=groups)
+        if function == "SUM":
+            return sums
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return sums / counts
+    source = cube.minimums if function == "MIN" else cube.maximums
+    return _reduce_cells(np.fmin if function == "MIN" else np.fmax, group_ids, source[column][cells], groups)
+
+
+def answer_from_cube(statement: Statement, cube: AggregateCube | None = None) -> LocalResult | None:
+    # Returns None when the statement needs row-level data, so the caller falls through to execution.
+    if not statement.has_aggregates and not statement.group_by:
+        return None
+    cube = cube or get_cube()
+    if not _covers(cube, statement):
+        return None
+    mask = _cell_mask(cube, statement)
+    if mask is None:
+        return None
+    check_grouping(statement)
+    cells = np.flatnonzero(mask)
+    if not statement.group_by:
+        if len(cells) == 0:
+            return empty_aggregate_result(statement)
+        group_ids = np.zeros(len(cells), dtype=np.int64)
+        groups = 1
+    else:
+        keys = np.zeros(len(cells), dtype=np.int64)
+        for column in statement.group_by:
+            codes = cube.cell_codes[column][cells]
+            keys = keys * len(cube.labels[column]) + codes
+        _, first, group_ids = np.unique(keys, return_index=True, return_inverse=True)
+        group_ids = group_ids.reshape(-1)
+        groups = len(first)
+    fallback: Dict[str, np.ndarray] = {}
+    outputs: Dict[str, np.ndarray] = {}
+    for column in statement.group_by:
+        fallback[column] = _group_value(cube, column, cells[first])
+    for item, label in zip(statement.items, statement.labels):
+        if item.function is None:
+            outputs[label] = fallback[item.column]
+        else:
+            outputs[label] = _aggregate(cube, item.function, item.column, cells, group_ids, groups)
+    return order_and_project(statement, outputs, fallback, groups)
@@ -1,16 +1,25 @@
+import asyncio
+import inspect
 import logging
+import math
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from functools import lru_cache
-from typing import Any, Dict, List
+from typing import TYPE_CHECKING, Any, AsyncIterator, Awaitable, Callable, Dict, List, TypeVar
 
-import clickhouse_connect
-from clickhouse_connect.driver.client import Client
-
-from .config import require_env
+from .admission import AdmissionGate, budget
+from .config import get_float_env, get_int_env, require_env
 from .schema import DATABASE, TABLE
-from .sql_grammar import validate_sql
+
+if TYPE_CHECKING:
+    from clickhouse_connect.driver.asyncclient import AsyncClient
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 HOST = "zdni402lap.us-east1.gcp.clickhouse.cloud"
 USER = "default"
 PORT = 8443
@@ -18,6 +27,18 @@ SECURE = True
 PASSWORD_ENV = "CLICKHOUSE_PASSWORD"
 MAX_EXECUTION_TIME_SECONDS = 20
 MAX_RESULT_ROWS = 1000
+TIMEOUT_SECONDS_ENV = "CLICKHOUSE_TIMEOUT_SECONDS"
+# A little above max_execution_time so the server-side limit normally fires first.
+DEFAULT_TIMEOUT_SECONDS = MAX_EXECUTION_TIME_SECONDS + 5
+
+POOL_SIZE_ENV = "CLICKHOUSE_POOL_SIZE"
+POOL_HEALTH_CHECK_SECONDS_ENV = "CLICKHOUSE_POOL_HEALTH_CHECK_SECONDS"
+POOL_MAX_AGE_SECONDS_ENV = "CLICKHOUSE_POOL_MAX_AGE_SECONDS"
+DEFAULT_POOL_SIZE = 8
+DEFAULT_POOL_HEALTH_CHECK_SECONDS = 30.0
+DEFAULT_POOL_MAX_AGE_SECONDS = 600.0
+MAX_QUEUE_ENV = "CLICKHOUSE_MAX_QUEUE"
+DEFAULT_MAX_QUEUE = 64
 
 
 def _require_password() -> str:
@@ -27,29 +48,229 @@ def _require_password() -> str:
     )
 
 
-@lru_cache(maxsize=1)
-def get_client() -> Client:
-    password = _require_password()
-    try:
-        client = clickhouse_connect.get_client(
-            host=HOST,
-            port=PORT,
-            username=USER,
-            password=password,
-            secure=SECURE,
-            database=DATABASE,
+def connection_settings() -> Dict[str, Any]:
+    # Shared by the pool and offline tools (e.g. evals/scale_dataset.py) that open their own clients.
+    return {
+        "host": HOST,
+        "port": PORT,
+        "username": USER,
+        "password": _require_password(),
+        "secure": SECURE,
+        "database": DATABASE,
+    }
+
+
+def _is_server_error(exc: Exception) -> bool:
+    from clickhouse_connect.driver.exceptions import DatabaseError, OperationalError
+
+    return isinstance(exc, DatabaseError) and not isinstance(exc, OperationalError)
+
+
+class _PooledClient:
+    def __init__(self, client: "AsyncClient", pool_manager: Any) -> None:
+        self.client = client
+        self.pool_manager = pool_manager
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class ClickHousePool:
+    # Each client owns one keep-alive HTTP connection and runs without a session, so concurrent
+    # requests never share a client. The pool size caps how many queries run against ClickHouse at once.
+    def __init__(
+        self,
+        size: int,
+        health_check_seconds: float,
+        max_age_seconds: float,
+    ) -> None:
+        if size < 1:
+            raise ValueError(f"{POOL_SIZE_ENV} must be at least 1")
+        self.size = size
+        self.health_check_seconds = health_check_seconds
+        self.max_age_seconds = max_age_seconds
+        self._semaphore = asyncio.Semaphore(size)
+        self._idle: List[_PooledClient] = []
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="clickhouse")
+        self.open = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.acquisitions = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.recycled = 0
+        self.health_check_failures = 0
+
+    async def _create(self) -> _PooledClient:
+        # clickhouse_connect (and aiohttp under it) takes ~0.4s to import; the local backend never needs it.
+        import clickhouse_connect
+        from clickhouse_connect.driver import httputil
+
+        settings = connection_settings()
+        # pool_mgr and executor belong to the 0.x async client, which wraps the sync one; 1.x replaced it
+        # with an aiohttp client, hence the <0.11 pin in pyproject.toml.
+        pool_manager = httputil.get_pool_manager(maxsize=1)
+        try:
+            client = clickhouse_connect.get_async_client(
+                **settings,
+                pool_mgr=pool_manager,
+                autogenerate_session_id=False,
+                executor=self._executor,
+            )
+            # Older clickhouse-connect releases build the async client in a coroutine.
+            if inspect.isawaitable(client):
+                client = await client
+        except Exception:
+            pool_manager.clear()
+            logger.exception("Failed to create ClickHouse client")
+            raise
+        self.open += 1
+        return _PooledClient(client, pool_manager)
+
+    async def _discard(self, pooled: _PooledClient) -> None:
+        self.open -= 1
+        self.recycled += 1
+        try:
+            await pooled.client.close()
+        except Exception:
+            logger.warning("Failed to close ClickHouse client", exc_info=True)
+        # The client only closes pool managers it created itself.
+        pooled.pool_manager.clear()
+
+    async def _checkout(self) -> _PooledClient:
+        while self._idle:
+            # LIFO keeps the most recently used connections warm and lets idle ones age out.
+            pooled = self._idle.pop()
+            now = time.monotonic()
+            if now - pooled.created_at > self.max_age_seconds:
+                await self._discard(pooled)
+                continue
+            if now - pooled.last_used > self.health_check_seconds:
+                try:
+                    healthy = await pooled.client.ping()
+                except Exception:
+                    healthy = False
+                if not healthy:
+                    self.health_check_failures += 1
+                    await self._discard(pooled)
+                    continue
+            return pooled
+        return await self._create()
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator["AsyncClient"]:
+        started = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        waited = time.perf_counter() - started
+        self.acquisitions += 1
+        self.wait_seconds_total += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        try:
+            pooled = await self._checkout()
+            self.in_use += 1
+            broken = True
+            try:
+                yield pooled.client
+                broken = False
+            except Exception as exc:
+                # Server-side query errors leave the connection usable; transport errors do not.
+                broken = not _is_server_error(exc)
+                raise
+            finally:
+                self.in_use -= 1
+                if broken:
+                    # Also covers cancellation: the executor thread may still be using this client.
+                    await self._discard(pooled)
+                else:
+                    pooled.last_used = time.monotonic()
+                    self._idle.append(pooled)
+        finally:
+            self._semaphore.release()
+
+    async def close(self) -> None:
+        while self._idle:
+            await self._discard(self._idle.pop())
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": self.size,
+            "open": self.open,
+            "idle": len(self._idle),
+            "in_use": self.in_use,
+            "waiting": self.waiting,
+            "acquisitions": self.acquisitions,
+            "wait_seconds_total": round(self.wait_seconds_total, 6),
+            "wait_seconds_max": round(self.wait_seconds_max, 6),
+            "recycled": self.recycled,
+            "health_check_failures": self.health_check_failures,
+        }
+
+
+_pool: ClickHousePool | None = None
+
+
+def get_pool() -> ClickHousePool:
+    global _pool
+    if _pool is None:
+        _pool = ClickHousePool(
+            size=get_int_env(POOL_SIZE_ENV, DEFAULT_POOL_SIZE),
+            health_check_seconds=get_float_env(POOL_HEALTH_CHECK_SECONDS_ENV, DEFAULT_POOL_HEALTH_CHECK_SECONDS),
+            max_age_seconds=get_float_env(POOL_MAX_AGE_SECONDS_ENV, DEFAULT_POOL_MAX_AGE_SECONDS),
         )
-    except Exception:
-        logger.exception("Failed to create ClickHouse client")
-        raise
-    return client
+    return _pool
+
+
+async def close_pool() -> None:
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
 
 
-def clickhouse_ping() -> Dict[str, Any]:
-    client = get_client()
-    select_one = client.query("SELECT 1").result_rows[0][0]
-    count_sql = f"SELECT count() FROM {DATABASE}.{TABLE}"
-    row_count = client.query(count_sql).result_rows[0][0]
+async def warm_pool(connections: int) -> int:
+    # Opens up to `connections` clients at once (TLS handshake included) so they sit idle in the pool.
+    pool = get_pool()
+    count = min(connections, pool.size)
+
+    async def open_one() -> None:
+        async with pool.connection() as client:
+            async with asyncio.timeout(_timeout()):
+                await client.ping()
+
+    await asyncio.gather(*(open_one() for _ in range(count)))
+    return count
+
+
+def pool_stats() -> Dict[str, Any] | None:
+    return _pool.stats() if _pool is not None else None
+
+
+def _timeout() -> float:
+    return budget(get_float_env(TIMEOUT_SECONDS_ENV, DEFAULT_TIMEOUT_SECONDS))
+
+
+@lru_cache(maxsize=1)
+def _gate() -> AdmissionGate:
+    # Admits as many queries as the pool has clients, so admitted queries never wait on the pool.
+    return AdmissionGate(
+        "clickhouse",
+        limit=get_int_env(POOL_SIZE_ENV, DEFAULT_POOL_SIZE),
+        max_queue=get_int_env(MAX_QUEUE_ENV, DEFAULT_MAX_QUEUE),
+    )
+
+
+async def clickhouse_ping(row_count: int | None = None) -> Dict[str, Any]:
+    # Pass a known row count (from the statistics catalog) to skip the count() scan.
+    async with get_pool().connection() as client:
+        async with asyncio.timeout(_timeout()):
+            select_one = (await client.query("SELECT 1")).result_rows[0][0]
+            if row_count is None:
+                count_sql = f"SELECT count() FROM {DATABASE}.{TABLE}"
+                row_count = (await client.query(count_sql)).result_rows[0][0]
     return {
         "ok": True,
         "database": DATABASE,
@@ -59,17 +280,71 @@ def clickhouse_ping() -> Dict[str, Any]:
     }
 
 
-def execute_sql(sql: str) -> Dict[str, Any]:
-    validate_sql(sql)
-    client = get_client()
-    result = client.query(
-        sql,
-        settings={
-            "max_execution_time": MAX_EXECUTION_TIME_SECONDS,
-            "max_result_rows": MAX_RESULT_ROWS,
-            "result_overflow_mode": "throw",
-        },
-    )
-    columns: List[str] = result.column_names
-    rows = [dict(zip(columns, row)) for row in result.result_rows]
-    return {"columns": columns, "rows": rows}
+async def _kill_query(query_id: str) -> None:
+    try:
+        async with get_pool().connection() as client:
+            await client.command(f"KILL QUERY WHERE query_id = '{query_id}' ASYNC")
+    except Exception:
+        logger.warning("Failed to cancel ClickHouse query %s", query_id, exc_info=True)
+
+
+def _query_settings(query_id: str, capped: bool = True) -> Dict[str, Any]:
+    # The server-side limit also shrinks to the request's deadline, so ClickHouse stops work nobody will read.
+    max_execution_time = max(1, math.floor(budget(MAX_EXECUTION_TIME_SECONDS)))
+    settings: Dict[str, Any] = {"max_execution_time": max_execution_time, "query_id": query_id}
+    if capped:
+        # Collected results must fit in memory; streams are forwarded block by block and need no cap.
+        settings.update(max_result_rows=MAX_RESULT_ROWS, result_overflow_mode="throw")
+    return settings
+
+
+async def _run(fetch: Callable[["AsyncClient", Dict[str, Any]], Awaitable[T]]) -> T:
+    query_id = str(uuid.uuid4())
+    try:
+        async with _gate().admit(), get_pool().connection() as client:
+            async with asyncio.timeout(_timeout()):
+                return await fetch(client, _query_settings(query_id))
+    except (asyncio.CancelledError, TimeoutError):
+        # Abandoning the await does not stop the server; kill it so a disconnected caller frees the cluster.
+        asyncio.ensure_future(_kill_query(query_id))
+        raise
+
+
+async def run_query(sql: str) -> tuple[List[str], List[tuple]]:
+    # Callers validate first; see query_executor.execute_sql.
+    result = await _run(lambda client, settings: client.query(sql, settings=settings))
+    return list(result.column_names), [tuple(row) for row in result.result_rows]
+
+
+async def run_query_arrow(sql: str):
+    # Returns a pyarrow.Table decoded by clickhouse-connect straight from ClickHouse's Arrow output.
+    return await _run(lambda client, settings: client.query_arrow(sql, settings=settings, use_strings=True))
+
+
+async def _row_blocks(executor: ThreadPoolExecutor, stream: Any) -> AsyncIterator[List[tuple]]:
+    # Each block read blocks on the socket, so it runs on the pool's executor. The timeout applies
+    # per block: a slow reader must not be charged for the server's time.
+    loop = asyncio.get_running_loop()
+    while True:
+        async with asyncio.timeout(_timeout()):
+            block = await loop.run_in_executor(executor, next, stream, None)
+        if block is None:
+            return
+        yield [tuple(row) for row in block]
+
+
+@asynccontextmanager
+async def stream_query(sql: str) -> AsyncIterator[tuple[List[str], AsyncIterator[List[tuple]]]]:
+    # Yields the column names and an async iterator over row blocks as ClickHouse sends them.
+    # The pooled client stays checked out until the caller leaves the context.
+    query_id = str(uuid.uuid4())
+    pool = get_pool()
+    try:
+        async with _gate().admit(), pool.connection() as client:
+            async with asyncio.timeout(_timeout()):
+                stream = await client.query_row_block_stream(sql, settings=_query_settings(query_id, capped=False))
+            with stream:
+                yield list(stream.source.column_names or ()), _row_blocks(pool._executor, stream)
+    except (asyncio.CancelledError, TimeoutError):
+        asyncio.ensure_future(_kill_query(query_id))
+        raise
@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List
+
+import numpy as np
+
+from .clickhouse_client import run_query
+from .config import get_float_env
+from .local_engine import (
+    Dataset,
+    LocalResult,
+    category_selection,
+    check_grouping,
+    empty_aggregate_result,
+    single_row_result,
+)
+from .schema import COLUMNS, DATASET, NON_NUMERIC_COLUMNS, NUMERIC_COLUMNS
+from .sql_plan import Comparison, Statement
+
+logger = logging.getLogger(__name__)
+
+# In-memory statistics about the table, refreshed on a schedule. The query path uses them to skip
+# execution for provably empty filters and for unfiltered MIN/MAX/COUNT.
+REFRESH_SECONDS_ENV = "STATS_REFRESH_SECONDS"
+DEFAULT_REFRESH_SECONDS = 300.0
+HISTOGRAM_BUCKETS = 10
+CLICKHOUSE_SOURCE = "clickhouse"
+LOCAL_SOURCE = "local"
+
+
+@dataclass(frozen=True)
+class ColumnStats:
+    minimum: Any
+    maximum: Any
+    null_count: int
+    distinct: tuple[str, ...] = ()
+    # Equi-depth bucket boundaries (HISTOGRAM_BUCKETS + 1 values, min to max).
+    histogram: tuple[float, ...] = ()
+
+
+@dataclass(frozen=True)
+class StatsCatalog:
+    source: str
+    row_count: int
+    columns: Dict[str, ColumnStats]
+    refreshed_at: float
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "source": self.source,
+            "row_count": self.row_count,
+            "refreshed_at": self.refreshed_at,
+            "columns": {
+                name: {
+                    "min": stats.minimum,
+                    "max": stats.maximum,
+                    "null_count": stats.null_count,
+                    "distinct": list(stats.distinct),
+                    "histogram": list(stats.histogram),
+                }
+                for name, stats in self.columns.items()
+            },
+        }
+
+
+def _quantile_points() -> List[float]:
+    return [index / HISTOGRAM_BUCKETS for index in range(HISTOGRAM_BUCKETS + 1)]
+
+
+def collect_local(dataset: Dataset) -> StatsCatalog:
+    columns: Dict[str, ColumnStats] = {}
+    for name in NUMERIC_COLUMNS:
+        values = dataset.columns[name]
+        present = values[~np.isnan(values)]
+        if len(present) == 0:
+            columns[name] = ColumnStats(minimum=None, maximum=None, null_count=len(values))
+            continue
+        bounds = np.quantile(present, _quantile_points())
+        columns[name] = ColumnStats(
+            minimum=float(present.min()),
+            maximum=float(present.max()),
+            null_count=int(len(values) - len(present)),
+            histogram=tuple(float(bound) for bound in bounds),
+        )
+    for name in NON_NUMERIC_COLUMNS:
+        distinct = tuple(str(value) for value in dataset.categories[name])
+        columns[name] = ColumnStats(
+            minimum=distinct[0] if distinct else None,
+            maximum=distinct[-1] if distinct else None,
+            null_count=0,
+            distinct=distinct,
+        )
+    return StatsCatalog(LOCAL_SOURCE, dataset.row_count, columns, time.time())
+
+
+async def collect_clickhouse() -> StatsCatalog:
+    # One scan for every column: min, max, null count, plus quantiles or distinct values.
+    points = ", ".join(str(point) for point in _quantile_points())
+    expressions = ["count()"]
+    for name in COLUMNS:
+        expressions += [f"min({name})", f"max({name})", f"countIf(isNull({name}))"]
+        if name in NON_NUMERIC_COLUMNS:
+            expressions.append(f"arraySort(groupUniqArray({name}))")
+        else:
+            expressions.append(f"quantiles({points})({name})")
+    _, rows = await run_query(f"SELECT {', '.join(expressions)} FROM {DATASET}")
+    values = iter(rows[0])
+    row_count = int(next(values))
+    columns: Dict[str, ColumnStats] = {}
+    for name in COLUMNS:
+        minimum, maximum, null_count, extra = next(values), next(values), int(next(values)), next(values)
+        if name in NON_NUMERIC_COLUMNS:
+            columns[name] = ColumnStats(minimum, maximum, null_count, distinct=tuple(extra))
+        else:
+            columns[name] = ColumnStats(float(minimum), float(maximum), null_count, histogram=tuple(extra))
+    return StatsCatalog(CLICKHOUSE_SOURCE, row_count, columns, time.time())
+
+
+_catalog: StatsCatalog | None = None
+_collector: Callable[[], Awaitable[StatsCatalog]] | None = None
+_task: asyncio.Task | None = None
+
+
+def current_catalog() -> StatsCatalog | None:
+    return _catalog
+
+
+def reset_catalog() -> None:
+    global _catalog
+    _catalog = None
+
+
+async def refresh_catalog() -> StatsCatalog | None:
+    global _catalog
+    if _collector is None:
+        return _catalog
+    try:
+        catalog = await _collector()
+    except Exception:
+        # Keep serving the previous catalog; a failed refresh must not take the query path down.
+        logger.exception("Column statistics refresh failed")
+        return _catalog
+    _catalog = catalog
+    logger.info("Column statistics refreshed", extra={"source": catalog.source, "rows": catalog.row_count})
+    return catalog
+
+
+async def _refresh_loop(interval: float) -> None:
+    while True:
+        await refresh_catalog()
+        await asyncio.sleep(interval)
+
+
+def start_refresher(collector: Callable[[], Awaitable[StatsCatalog]]) -> None:
+    global _collector, _task
+    _collector = collector
+    interval = get_float_env(REFRESH_SECONDS_ENV, DEFAULT_REFRESH_SECONDS)
+    _task = asyncio.get_running_loop().create_task(_refresh_loop(interval), name="stats-refresh")
+
+
+async def stop_refresher() -> None:
+    global _task
+    if _task is None:
+        return
+    _task.cancel()
+    try:
+        await _task
+    except asyncio.CancelledError:
+        pass
+    _task = None
+
+
+def _provably_false(comparison: Comparison, stats: ColumnStats) -> bool:
+    if stats.distinct:
+        if any(not isinstance(value, str) for value in comparison.values):
+            return False
+        if comparison.operator in ("=", "IN"):
+            return not set(comparison.values) & set(stats.distinct)
+        candidates = np.array(stats.distinct, dtype=object)
+        return not category_selection(candidates, comparison).any()
+    if stats.minimum is None:
+        # Every value is NULL, and comparisons with NULL never match.
+        return True
+    if any(not isinstance(value, float) for value in comparison.values):
+        return False
+    low, high = stats.minimum, stats.maximum
+    value = comparison.values[0]
+    if comparison.operator in ("=", "IN"):
+        return all(value < low or value > high for value in comparison.values)
+    if comparison.operator == ">":
+        return value >= high
+    if comparison.operator == ">=":
+        return value > high
+    if comparison.operator == "<":
+        return value <= low
+    return value < low
+
+
+def _empty_result(statement: Statement) -> LocalResult:
+    if statement.has_aggregates or statement.group_by:
+        check_grouping(statement)
+    if statement.has_aggregates and not statement.group_by:
+        return empty_aggregate_result(statement)
+    return LocalResult(columns=statement.labels, rows=[])
+
+
+def _scan_free_value(function: str | None, stats: ColumnStats, row_count: int) -> Any:
+    if function == "MIN":
+        return stats.minimum
+    if function == "MAX":
+        return stats.maximum
+    if function == "COUNT":
+        return row_count - stats.null_count
+    return None
+
+
+def answer_from_stats(statement: Statement, catalog: StatsCatalog | None = None) -> LocalResult | None:
+    catalog = catalog or current_catalog()
+    if catalog is None:
+        return None
+    for comparison in statement.conditions:
+        stats = catalog.columns.get(comparison.column)
+        if stats is not None and _provably_false(comparison, stats):
+            return _empty_result(statement)
+    if statement.conditions or statement.group_by:
+        return None
+    if not all(item.function in ("MIN", "MAX", "COUNT") for item in statement.items):
+        return None
+    if catalog.row_count == 0:
+        return empty_aggregate_result(statement)
+    values = tuple(
+        _scan_free_value(item.function, catalog.columns[item.column], catalog.row_count)
+        for item in statement.items
+    )
+    return single_row_result(statement, values)
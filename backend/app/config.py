@@ -26,3 +26,23 @@ def require_env(
     if value is None or value == "":
         raise error_cls(message)
     return value
+
+
+def get_int_env(name: str, default: int) -> int:
+    value = get_env(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return int(value)
+    except ValueError as exc:
+        raise ValueError(f"{name} must be an integer, got {value!r}") from exc
+
+
+def get_float_env(name: str, default: float) -> float:
+    value = get_env(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return float(value)
+    except ValueError as exc:
+        raise ValueError(f"{name} must be a number, got {value!r}") from exc
@@ -0,0 +1,135 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, TypeVar
+
+T = TypeVar("T")
+
+# Tail-latency tools for calls to slow, occasionally degraded upstreams. A hedge is a second call
+# started when the first has run past its usual latency; whichever succeeds first wins and the other
+# is cancelled. A circuit breaker stops sending calls to an upstream that keeps failing.
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class LatencyWindow:
+    # The most recent latencies, so the hedge threshold follows the upstream as it speeds up or slows down.
+    def __init__(self, size: int) -> None:
+        self._samples: Deque[float] = deque(maxlen=size)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def quantile(self, q: float) -> float:
+        ordered = sorted(self._samples)
+        if not ordered:
+            return 0.0
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class CircuitBreaker:
+    # Opens after `failures` consecutive failures. Once `cooldown_seconds` pass, a single trial call is
+    # let through (half-open): success closes the breaker, failure opens it again.
+    def __init__(self, failures: int, cooldown_seconds: float, clock: Callable[[], float] = time.monotonic) -> None:
+        self.failures = max(failures, 1)
+        self.cooldown_seconds = cooldown_seconds
+        self._clock = clock
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.opened = 0
+        self._trial_in_flight = False
+
+    def allow(self) -> bool:
+        # Claims the half-open trial when it returns True for an open breaker; call only before a real call.
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and self._clock() - self.opened_at >= self.cooldown_seconds:
+            self.state = HALF_OPEN
+            self._trial_in_flight = False
+        if self.state == HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        return max(self.cooldown_seconds - (self._clock() - self.opened_at), 0.0)
+
+    def success(self) -> None:
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self._trial_in_flight = False
+
+    def failure(self) -> None:
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failures:
+            if self.state != OPEN:
+                self.opened += 1
+            self.state = OPEN
+            self.opened_at = self._clock()
+            self._trial_in_flight = False
+
+    def release(self) -> None:
+        # A trial call that was cancelled (it lost a race) proves nothing either way.
+        self._trial_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {"state": self.state, "consecutive_failures": self.consecutive_failures, "opened": self.opened}
+
+
+class Hedger:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.hedged = 0
+        self.second_wins = 0
+        self.failovers = 0
+
+    async def race(
+        self,
+        first: Callable[[], Awaitable[T]],
+        second: Callable[[bool], Callable[[], Awaitable[T]] | None],
+        delay: float | None,
+    ) -> T:
+        # Runs first(); after `delay` seconds without a result, or as soon as first() fails, asks
+        # second(failover) for another call to race it. Returns the first success and cancels the rest;
+        # raises the first error only when every call failed.
+        self.calls += 1
+        loop = asyncio.get_running_loop()
+        hedge_at = loop.time() + delay if delay is not None else None
+        primary = asyncio.ensure_future(first())
+        pending = {primary}
+        launched = False
+        errors: List[BaseException] = []
+        try:
+            while pending:
+                timeout = None if launched or hedge_at is None else max(hedge_at - loop.time(), 0.0)
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.second_wins += 1
+                        return task.result()
+                    errors.append(task.exception())
+                if launched or (done and pending):
+                    continue
+                failover = bool(done)
+                if failover or hedge_at is not None:
+                    launched = True
+                    factory = second(failover)
+                    if factory is not None:
+                        if failover:
+                            self.failovers += 1
+                        else:
+                            self.hedged += 1
+                        pending.add(asyncio.ensure_future(factory()))
+            raise errors[0]
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> Dict[str, int]:
+        return {"calls": self.calls, "hedged": self.hedged, "second_wins": self.second_wins, "failovers": self.failovers}
@@ -0,0 +1,466 @@
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from .config import get_float_env
+from .schema import NUMERIC_COLUMNS
+from .sql_grammar import validate_sql
+from .sql_plan import Comparison, OrderItem, SelectItem, Statement, render_sql
+
+logger = logging.getLogger(__name__)
+
+# Rule-based NL-to-SQL for the common question shapes ("average grip force for females over 50",
+# "how many people in class A", "compare body fat between genders"). Every token of the prompt has to be
+# accounted for by the vocabulary below; a prompt with anything it cannot explain, or with a negation it
+# has no way to express, goes to the LLM instead.
+MIN_CONFIDENCE_ENV = "INTENT_MIN_CONFIDENCE"
+DEFAULT_MIN_CONFIDENCE = 0.9
+MAX_PHRASE_TOKENS = 4
+COUNT_COLUMN = "age"
+GENDER = "gender"
+FITNESS_CLASS = "fitness_class"
+AGE = "age"
+
+_TOKEN_RE = re.compile(r"\d+(?:\.\d+)?|[a-z]+|[<>]=?|%")
+
+AGGREGATE_PHRASES = {
+    "average": "AVG",
+    "avg": "AVG",
+    "mean": "AVG",
+    "averages": "AVG",
+    "maximum": "MAX",
+    "max": "MAX",
+    "highest": "MAX",
+    "largest": "MAX",
+    "minimum": "MIN",
+    "min": "MIN",
+    "lowest": "MIN",
+    "smallest": "MIN",
+    "total": "SUM",
+    "sum": "SUM",
+    "sum of": "SUM",
+}
+
+COUNT_PHRASES = ("how many", "number of", "count", "count of")
+
+METRIC_PHRASES = {
+    "age": ("age",),
+    "height": ("height_cm",),
+    "tall": ("height_cm",),
+    "weight": ("weight_kg",),
+    "body fat": ("body_fat_pct",),
+    "body fat percentage": ("body_fat_pct",),
+    "body fat percent": ("body_fat_pct",),
+    "body fat %": ("body_fat_pct",),
+    "fat percentage": ("body_fat_pct",),
+    "diastolic": ("diastolic",),
+    "diastolic pressure": ("diastolic",),
+    "diastolic blood pressure": ("diastolic",),
+    "systolic": ("systolic",),
+    "systolic pressure": ("systolic",),
+    "systolic blood pressure": ("systolic",),
+    "blood pressure": ("systolic", "diastolic"),
+    "grip": ("grip_force",),
+    "grip force": ("grip_force",),
+    "grip strength": ("grip_force",),
+    "sit and bend": ("sit_and_bend_forward_cm",),
+    "sit and bend forward": ("sit_and_bend_forward_cm",),
+    "flexibility": ("sit_and_bend_forward_cm",),
+    "sit ups": ("situps_count",),
+    "situps": ("situps_count",),
+    "sit up": ("situps_count",),
+    "sit up count": ("situps_count",),
+    "sit up counts": ("situps_count",),
+    "sit ups count": ("situps_count",),
+    "broad jump": ("broad_jump_cm",),
+    "broad jump distance": ("broad_jump_cm",),
+    "jump": ("broad_jump_cm",),
+}
+
+GENDER_PHRASES = {
+    "female": "F",
+    "females": "F",
+    "women": "F",
+    "woman": "F",
+    "male": "M",
+    "males": "M",
+    "men": "M",
+    "man": "M",
+}
+
+DIMENSION_PHRASES = {
+    "gender": GENDER,
+    "genders": GENDER,
+    "sex": GENDER,
+    "fitness class": FITNESS_CLASS,
+    "fitness classes": FITNESS_CLASS,
+    "class": FITNESS_CLASS,
+    "classes": FITNESS_CLASS,
+}
+
+GROUP_MARKERS = ("by", "per", "each", "for each", "in each", "across", "between", "compare", "vs", "versus")
+# "compare grip force between genders" asks for averages even without the word.
+COMPARE_MARKERS = ("compare", "vs", "versus")
+
+COMPARATOR_PHRASES = {
+    "over": ">",
+    "above": ">",
+    "more than": ">",
+    "greater than": ">",
+    "older than": ">",
+    "at least": ">=",
+    "under": "<",
+    "below": "<",
+    "less than": "<",
+    "fewer than": "<",
+    "younger than": "<",
+    "at most": "<=",
+    ">": ">",
+    ">=": ">=",
+    "<": "<",
+    "<=": "<=",
+}
+AGE_COMPARATORS = ("older than", "younger than")
+
+# Columns each unit can measure; a threshold's unit picks its column when no metric precedes it.
+UNIT_COLUMNS = {
+    "%": ("body_fat_pct",),
+    "percent": ("body_fat_pct",),
+    "years": (AGE,),
+    "year": (AGE,),
+    "old": (AGE,),
+    "yrs": (AGE,),
+    "cm": ("height_cm", "sit_and_bend_forward_cm", "broad_jump_cm"),
+    "kg": ("weight_kg", "grip_force"),
+    "kgs": ("weight_kg", "grip_force"),
+}
+
+# The parser only builds positive filters, so "excluding class A" must not become class A.
+NEGATION_PHRASES = frozenset(
+    ("not", "no", "non", "nor", "except", "excluding", "exclude", "without", "other than", "besides", "apart from")
+)
+
+FILLER_WORDS = frozenset(
+    (
+        "a", "an", "the", "of", "for", "what", "whats", "is", "are", "was", "were", "in", "with", "who",
+        "whose", "that", "have", "has", "having", "people", "participants", "athletes", "persons",
+        "individuals", "subjects", "records", "there", "do", "does", "me", "show", "give", "tell", "find",
+        "get", "and", "or", "on", "to", "their", "overall", "all", "everyone", "among", "aged", "value",
+        "values", "score", "scores", "result", "results", "level", "levels", "measurement", "measurements",
+        "performance", "forward",
+    )
+)
+
+DIRECTION_PHRASES = {
+    "ascending": "ASC",
+    "asc": "ASC",
+    "increasing": "ASC",
+    "descending": "DESC",
+    "desc": "DESC",
+    "decreasing": "DESC",
+}
+
+CLASS_LETTERS = frozenset("abcd")
+CLASS_JOINERS = frozenset(("and", "or"))
+
+
+@dataclass(frozen=True)
+class Intent:
+    sql: str
+    confidence: float
+    statement: Statement
+
+
+@dataclass
+class _Parse:
+    aggregates: List[str] = field(default_factory=list)
+    metrics: List[str] = field(default_factory=list)
+    counting: bool = False
+    genders: List[str] = field(default_factory=list)
+    classes: List[str] = field(default_factory=list)
+    dimensions: List[str] = field(default_factory=list)
+    grouping: bool = False
+    comparing: bool = False
+    comparisons: List[Comparison] = field(default_factory=list)
+    explained: int = 0
+    unexplained: List[str] = field(default_factory=list)
+    penalty: float = 1.0
+
+
+def min_confidence() -> float:
+    return get_float_env(MIN_CONFIDENCE_ENV, DEFAULT_MIN_CONFIDENCE)
+
+
+def _tokens(prompt: str) -> List[str]:
+    return _TOKEN_RE.findall(prompt.lower().replace("-", " "))
+
+
+def _match(tokens: List[str], start: int, phrases) -> tuple[str, int] | None:
+    # Longest phrase starting at `start`.
+    for length in range(min(MAX_PHRASE_TOKENS, len(tokens) - start), 0, -1):
+        phrase = " ".join(tokens[start:start + length])
+        if phrase in phrases:
+            return phrase, length
+    return None
+
+
+def _number(token: str) -> float | None:
+    try:
+        return float(token)
+    except ValueError:
+        return None
+
+
+def _class_letters(tokens: List[str], start: int) -> tuple[List[str], int]:
+    # "class a", "classes a and b", "class a, b or c"
+    letters: List[str] = []
+    index = start
+    while index < len(tokens):
+        if tokens[index] in CLASS_LETTERS and tokens[index] not in letters:
+            letters.append(tokens[index])
+            index += 1
+        elif letters and tokens[index] in CLASS_JOINERS and index + 1 < len(tokens) and tokens[index + 1] in CLASS_LETTERS:
+            index += 1
+        else:
+            break
+    return [letter.upper() for letter in letters], index - start
+
+
+def _scan(tokens: List[str]) -> _Parse:
+    parse = _Parse()
+    # A metric directly before a comparison is its subject: "body fat under 20".
+    last_metric: tuple[str, ...] | None = None
+    index = 0
+    while index < len(tokens):
+        token = tokens[index]
+        previous_metric, last_metric = last_metric, None
+        matched = _match(tokens, index, COMPARATOR_PHRASES)
+        if matched and index + matched[1] < len(tokens) and _number(tokens[index + matched[1]]) is not None:
+            phrase, length = matched
+            value = _number(tokens[index + length])
+            consumed = length + 1
+            units = []
+            while index + consumed < len(tokens) and tokens[index + consumed] in UNIT_COLUMNS:
+                units.append(tokens[index + consumed])
+                consumed += 1
+            candidates = set(UNIT_COLUMNS[units[0]]) if units else None
+            # A metric right after the number is its subject too: "over 50 situps", "under 30 body fat".
+            following = _match(tokens, index + consumed, METRIC_PHRASES)
+            if following is not None:
+                consumed += following[1]
+                following_columns = METRIC_PHRASES[following[0]]
+                if phrase in AGE_COMPARATORS or previous_metric is not None or len(following_columns) != 1:
+                    column = None
+                else:
+                    (column,) = following_columns
+            elif phrase in AGE_COMPARATORS:
+                column = AGE
+            elif previous_metric is not None and len(previous_metric) == 1:
+                column = previous_metric[0]
+                # The metric named the filter, not an output column.
+                parse.metrics.remove(column)
+            elif candidates is not None and len(candidates) == 1:
+                (column,) = candidates
+            elif candidates is not None:
+                # "over 50 kg" could be weight or grip force; leave it to the LLM.
+                column = None
+            else:
+                column = AGE
+                if not 10 <= value <= 100:
+                    # A bare "over 150" is only an age if it looks like one.
+                    parse.penalty *= 0.5
+            if column is None or (candidates is not None and column not in candidates):
+                parse.unexplained.extend(tokens[index:index + consumed])
+                index += consumed
+                continue
+            parse.comparisons.append(Comparison(column=column, operator=COMPARATOR_PHRASES[phrase], values=(value,)))
+            parse.explained += consumed
+            index += consumed
+            continue
+
+        if token in ("class", "classes") or _match(tokens, index, ("fitness class", "fitness classes")):
+            length = 2 if token == "fitness" else 1
+            letters, letter_count = _class_letters(tokens, index + length)
+            if letters:
+                parse.classes.extend(letter for letter in letters if letter not in parse.classes)
+                parse.explained += length + letter_count
+                index += length + letter_count
+                continue
+
+        for phrases, handler in (
+            (COUNT_PHRASES, "count"),
+            (AGGREGATE_PHRASES, "aggregate"),
+            (METRIC_PHRASES, "metric"),
+            (GENDER_PHRASES, "gender"),
+            (DIMENSION_PHRASES, "dimension"),
+            (GROUP_MARKERS, "group"),
+        ):
+            matched = _match(tokens, index, phrases)
+            if matched is None:
+                continue
+            phrase, length = matched
+            if handler == "count":
+                parse.counting = True
+            elif handler == "aggregate":
+                parse.aggregates.append(AGGREGATE_PHRASES[phrase])
+            elif handler == "metric":
+                columns = METRIC_PHRASES[phrase]
+                if parse.grouping and columns == (AGE,) and not parse.dimensions:
+                    # "by age" groups rather than aggregates.
+                    parse.dimensions.append(AGE)
+                else:
+                    parse.metrics.extend(column for column in columns if column not in parse.metrics)
+                    last_metric = columns
+            elif handler == "gender":
+                if GENDER_PHRASES[phrase] not in parse.genders:
+                    parse.genders.append(GENDER_PHRASES[phrase])
+            elif handler == "dimension":
+                if DIMENSION_PHRASES[phrase] not in parse.dimensions:
+                    parse.dimensions.append(DIMENSION_PHRASES[phrase])
+            else:
+                parse.grouping = True
+                parse.comparing = parse.comparing or phrase in COMPARE_MARKERS
+            parse.explained += length
+            index += length
+            break
+        else:
+            if token in FILLER_WORDS:
+                parse.explained += 1
+            else:
+                parse.unexplained.append(token)
+            index += 1
+    return parse
+
+
+def _statement(parse: _Parse) -> Statement | None:
+    dimensions = list(parse.dimensions)
+    genders = parse.genders
+    if len(genders) > 1:
+        # "males and females" compares the two groups rather than filtering to both.
+        if GENDER not in dimensions:
+            dimensions.append(GENDER)
+        genders = []
+    if dimensions and not parse.grouping:
+        parse.penalty *= 0.8
+    if parse.grouping and not dimensions:
+        return None
+
+    if parse.counting:
+        if parse.aggregates:
+            return None
+        items = [SelectItem(function="COUNT", column=COUNT_COLUMN)]
+    else:
+        aggregates = list(dict.fromkeys(parse.aggregates))
+        if not aggregates and parse.comparing and dimensions:
+            aggregates = ["AVG"]
+        if not aggregates or not parse.metrics:
+            return None
+        metrics = [metric for metric in parse.metrics if metric in NUMERIC_COLUMNS]
+        items = [SelectItem(function=function, column=metric) for function in aggregates for metric in metrics]
+        if len(items) > 6:
+            return None
+
+    conditions: List[Comparison] = []
+    if genders:
+        conditions.append(Comparison(column=GENDER, operator="=", values=(genders[0],)))
+    if parse.classes:
+        operator = "=" if len(parse.classes) == 1 else "IN"
+        conditions.append(Comparison(column=FITNESS_CLASS, operator=operator, values=tuple(parse.classes)))
+    conditions.extend(parse.comparisons)
+
+    group_by = tuple(dimensions)
+    return Statement(
+        items=tuple(SelectItem(function=None, column=name) for name in group_by) + tuple(items),
+        conditions=tuple(conditions),
+        group_by=group_by,
+        order_by=tuple(OrderItem(name=name) for name in group_by),
+    )
+
+
+def schema_terms(prompt: str) -> tuple[str, ...]:
+    # What decides a prompt's SQL: columns, aggregates, filter values, comparators, numbers, grouping and
+    # direction, with synonyms folded together and filler dropped. Words outside the vocabulary are
+    # kept as they are, since they may mean anything ("tallest" vs "shortest").
+    tokens = _tokens(prompt)
+    vocabularies = (
+        ("not", NEGATION_PHRASES),
+        ("comparator", COMPARATOR_PHRASES),
+        ("count", COUNT_PHRASES),
+        ("aggregate", AGGREGATE_PHRASES),
+        ("metric", METRIC_PHRASES),
+        ("gender", GENDER_PHRASES),
+        ("dimension", DIMENSION_PHRASES),
+        ("compare", COMPARE_MARKERS),
+        ("group", GROUP_MARKERS),
+        ("direction", DIRECTION_PHRASES),
+    )
+    terms: List[str] = []
+    index = 0
+    while index < len(tokens):
+        token = tokens[index]
+        if token in ("class", "classes") or _match(tokens, index, ("fitness class", "fitness classes")):
+            length = 2 if token == "fitness" else 1
+            letters, letter_count = _class_letters(tokens, index + length)
+            if letters:
+                terms.append(f"class:{','.join(letters)}")
+                index += length + letter_count
+                continue
+        for kind, phrases in vocabularies:
+            matched = _match(tokens, index, phrases)
+            if matched is not None:
+                phrase, length = matched
+                if isinstance(phrases, dict):
+                    value = phrases[phrase]
+                    terms.append(f"{kind}:{','.join(value) if isinstance(value, tuple) else value}")
+                else:
+                    # Every phrase of these means the same: "by" and "per", "not" and "except".
+                    terms.append(kind)
+                index += length
+                break
+        else:
+            if token not in FILLER_WORDS:
+                terms.append(token)
+            index += 1
+    return tuple(terms)
+
+
+def _negated(tokens: List[str]) -> bool:
+    return any(_match(tokens, index, NEGATION_PHRASES) for index in range(len(tokens)))
+
+
+def parse_intent(prompt: str) -> Intent | None:
+    tokens = _tokens(prompt)
+    if not tokens or _negated(tokens):
+        return None
+    parse = _scan(tokens)
+    if parse.unexplained:
+        # A word the vocabulary does not cover may change the meaning, so no guess is safe.
+        logger.debug("Intent parser could not explain %s in %r", parse.unexplained, prompt)
+        return None
+    statement = _statement(parse)
+    if statement is None:
+        return None
+    confidence = parse.explained / len(tokens) * parse.penalty
+    sql = render_sql(statement)
+    # Rendering from a Statement should always be grammar-valid; check anyway before trusting it.
+    validate_sql(sql)
+    return Intent(sql=sql, confidence=round(confidence, 3), statement=statement)
+
+
+def answer_without_llm(prompt: str) -> Intent | None:
+    intent = parse_intent(prompt)
+    if intent is None or intent.confidence < min_confidence():
+        return None
+    return intent
+
+
+_stats: Dict[str, int] = {"answered": 0, "fell_back": 0}
+
+
+def record(answered: bool) -> None:
+    _stats["answered" if answered else "fell_back"] += 1
+
+
+def intent_stats() -> Dict[str, int]:
+    return dict(_stats)
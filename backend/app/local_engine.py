@@ -0,0 +1,328 @@
+import csv
+import json
+import logging
+import math
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+from .config import get_env
+from .schema import COLUMNS, NON_NUMERIC_COLUMNS, NUMERIC_COLUMNS
+from .sql_plan import Comparison, Statement
+
+logger = logging.getLogger(__name__)
+
+# In-process executor for the whitelisted grammar over a columnar, memory-resident copy of the dataset.
+DATASET_PATH_ENV = "LOCAL_DATASET_PATH"
+DEFAULT_DATASET_PATH = Path(__file__).resolve().parents[2] / "bodyPerformance.csv"
+# Columnar layout written by evals/scale_dataset.py: one raw little-endian file per column plus a manifest.
+# Numeric columns are float64; categorical ones are uint8 codes into the manifest's category list.
+COLUMNAR_MANIFEST = "manifest.json"
+COLUMNAR_VERSION = 1
+
+_NUMERIC_OPERATORS = {
+    "=": np.equal,
+    ">=": np.greater_equal,
+    "<=": np.less_equal,
+    ">": np.greater,
+    "<": np.less,
+}
+
+
+@dataclass(eq=False)
+class Dataset:
+    columns: Dict[str, np.ndarray]
+    row_count: int
+    # Every column is factorized once at load time (sorted distinct values plus int codes),
+    # so filters on categories and GROUP BY never re-sort the data per query.
+    categories: Dict[str, np.ndarray] = field(default_factory=dict)
+    codes: Dict[str, np.ndarray] = field(default_factory=dict)
+    # Per-column cumulative value counts, filled lazily by the query router. Kept here rather than in a
+    # module-level cache so they are freed along with the dataset after a reload.
+    cumulative_counts: Dict[str, np.ndarray] = field(default_factory=dict)
+
+
+@dataclass
+class LocalResult:
+    columns: List[str]
+    rows: List[tuple]
+
+
+def _factorize(values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    uniques, inverse = np.unique(values, return_inverse=True)
+    return uniques, inverse.reshape(-1).astype(np.int64)
+
+
+def _dataset_from_columns(raw: Dict[str, Sequence[Any]]) -> Dataset:
+    columns: Dict[str, np.ndarray] = {}
+    categories: Dict[str, np.ndarray] = {}
+    codes: Dict[str, np.ndarray] = {}
+    for name in NUMERIC_COLUMNS:
+        columns[name] = np.asarray(raw[name], dtype=np.float64)
+        categories[name], codes[name] = _factorize(columns[name])
+    for name in NON_NUMERIC_COLUMNS:
+        columns[name] = np.asarray(raw[name], dtype=object)
+        uniques, inverse = _factorize(columns[name].astype(str))
+        categories[name] = uniques.astype(object)
+        codes[name] = inverse
+    row_count = len(next(iter(columns.values()))) if columns else 0
+    return Dataset(columns=columns, row_count=row_count, categories=categories, codes=codes)
+
+
+def load_csv(path: Path) -> Dataset:
+    raw: Dict[str, List[Any]] = {name: [] for name in COLUMNS}
+    with open(path, newline="", encoding="utf-8") as handle:
+        reader = csv.DictReader(handle)
+        missing = [name for name in COLUMNS if name not in (reader.fieldnames or ())]
+        if missing:
+            raise ValueError(f"{path} is missing columns: {', '.join(missing)}")
+        for record in reader:
+            for name in NUMERIC_COLUMNS:
+                value = record[name]
+                raw[name].append(float(value) if value != "" else np.nan)
+            for name in NON_NUMERIC_COLUMNS:
+                raw[name].append(record[name])
+    return _dataset_from_columns(raw)
+
+
+def load_columnar(directory: Path) -> Dataset:
+    manifest = json.loads((directory / COLUMNAR_MANIFEST).read_text(encoding="utf-8"))
+    if manifest.get("version") != COLUMNAR_VERSION:
+        raise ValueError(f"{directory} has unsupported columnar version {manifest.get('version')!r}")
+    row_count = int(manifest["rows"])
+    raw: Dict[str, Any] = {}
+    for name in COLUMNS:
+        spec = manifest["columns"].get(name)
+        if spec is None:
+            raise ValueError(f"{directory} is missing column {name}")
+        # Rows past the manifest count belong to a chunk that was being written when the writer stopped.
+        values = np.fromfile(directory / f"{name}.bin", dtype=np.dtype(spec["dtype"]).newbyteorder("<"), count=row_count)
+        if len(values) < row_count:
+            raise ValueError(f"{directory}/{name}.bin has {len(values)} rows, expected {row_count}")
+        if name in NON_NUMERIC_COLUMNS:
+            values = np.asarray(spec["categories"], dtype=object)[values]
+        raw[name] = values
+    return _dataset_from_columns(raw)
+
+
+@lru_cache(maxsize=1)
+def get_dataset() -> Dataset:
+    path = Path(get_env(DATASET_PATH_ENV) or DEFAULT_DATASET_PATH)
+    dataset = load_columnar(path) if path.is_dir() else load_csv(path)
+    logger.info("Loaded local dataset", extra={"path": str(path), "rows": dataset.row_count})
+    return dataset
+
+
+def _numeric_literal(comparison: Comparison) -> np.ndarray:
+    if any(not isinstance(value, float) for value in comparison.values):
+        raise ValueError(f"{comparison.column} must be compared with numbers")
+    return np.asarray(comparison.values, dtype=np.float64)
+
+
+def category_selection(categories: np.ndarray, comparison: Comparison) -> np.ndarray:
+    if comparison.operator in ("=", "IN"):
+        return np.isin(categories, list(comparison.values))
+    operator = _NUMERIC_OPERATORS[comparison.operator]
+    if categories.dtype != object:
+        return operator(categories, comparison.values[0])
+    return np.array([operator(category, comparison.values[0]) for category in categories], dtype=bool)
+
+
+def _comparison_mask(dataset: Dataset, comparison: Comparison) -> np.ndarray:
+    column = comparison.column
+    if column in NON_NUMERIC_COLUMNS:
+        if any(not isinstance(value, str) for value in comparison.values):
+            raise ValueError(f"{column} must be compared with string literals")
+        # Compare on the factorized codes so string work is proportional to the category count.
+        return category_selection(dataset.categories[column], comparison)[dataset.codes[column]]
+    values = dataset.columns[column]
+    literals = _numeric_literal(comparison)
+    if comparison.operator == "IN":
+        return np.isin(values, literals)
+    return _NUMERIC_OPERATORS[comparison.operator](values, literals[0])
+
+
+def _filter_indices(dataset: Dataset, statement: Statement) -> np.ndarray:
+    mask = np.ones(dataset.row_count, dtype=bool)
+    for comparison in statement.conditions:
+        mask &= _comparison_mask(dataset, comparison)
+    return np.flatnonzero(mask)
+
+
+def _group_ids(dataset: Dataset, group_by: Sequence[str], rows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # Fold the per-column codes into one int64 key, then compact to dense group ids.
+    space = math.prod(len(dataset.categories[name]) for name in group_by)
+    if space > np.iinfo(np.int64).max:
+        # The folded key would overflow and merge distinct groups; compare the code tuples instead.
+        codes = np.stack([dataset.codes[name][rows] for name in group_by], axis=1)
+        _, first, group_ids = np.unique(codes, axis=0, return_index=True, return_inverse=True)
+        return group_ids.reshape(-1), rows[first]
+    combined = np.zeros(len(rows), dtype=np.int64)
+    for name in group_by:
+        combined = combined * len(dataset.categories[name]) + dataset.codes[name][rows]
+    if space > 4 * max(len(rows), 1):
+        # Sparse key space: sorting is cheaper than a dense lookup table.
+        _, first, group_ids = np.unique(combined, return_index=True, return_inverse=True)
+        return group_ids.reshape(-1), rows[first]
+    present = np.bincount(combined, minlength=space) > 0
+    dense = np.cumsum(present) - 1
+    group_ids = dense[combined]
+    first = np.empty(int(present.sum()), dtype=np.int64)
+    # Reverse assignment leaves the first occurrence of each group in place.
+    first[group_ids[::-1]] = np.arange(len(rows) - 1, -1, -1)
+    return group_ids, rows[first]
+
+
+def _empty_aggregate(function: str) -> Any:
+    # ClickHouse returns type defaults for aggregates over no rows; AVG is nan there, None here to stay JSON-safe.
+    if function == "COUNT":
+        return 0
+    if function == "AVG":
+        return None
+    return 0.0
+
+
+def single_row_result(statement: Statement, values: tuple) -> LocalResult:
+    # Applies LIMIT/OFFSET to a result that is always exactly one row.
+    visible = statement.limit != 0 and statement.offset == 0
+    return LocalResult(columns=statement.labels, rows=[values] if visible else [])
+
+
+def empty_aggregate_result(statement: Statement) -> LocalResult:
+    # An ungrouped aggregate over no rows still yields one row, as in ClickHouse.
+    return single_row_result(statement, tuple(_empty_aggregate(item.function) for item in statement.items))
+
+
+def check_grouping(statement: Statement) -> None:
+    for item in statement.items:
+        if item.function is None and item.column not in statement.group_by:
+            raise ValueError(f"{item.column} must appear in GROUP BY or be aggregated")
+
+
+def _aggregate(
+    dataset: Dataset,
+    function: str,
+    column: str,
+    rows: np.ndarray,
+    group_ids: np.ndarray,
+    group_count: int,
+) -> np.ndarray:
+    if column in NON_NUMERIC_COLUMNS:
+        # Only COUNT is allowed on non-numeric columns and they have no nulls.
+        return np.bincount(group_ids, minlength=group_count).astype(np.int64)
+    values = dataset.columns[column][rows]
+    present = ~np.isnan(values)
+    counts = np.bincount(group_ids, weights=present, minlength=group_count)
+    if function == "COUNT":
+        return counts.astype(np.int64)
+    if function in ("SUM", "AVG"):
+        sums = np.bincount(group_ids, weights=np.where(present, values, 0.0), minlength=group_count)
+        if function == "SUM":
+            return sums
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return sums / counts
+    if not group_count:
+        # reduceat needs at least one index; a filter that matched nothing leaves no groups.
+        return np.empty(0, dtype=np.float64)
+    order = np.argsort(group_ids, kind="stable")
+    starts = np.flatnonzero(np.r_[True, np.diff(group_ids[order]) != 0])
+    reducer = np.fmin if function == "MIN" else np.fmax
+    return reducer.reduceat(values[order], starts)
+
+
+def _sort_key(values: np.ndarray, descending: bool) -> np.ndarray:
+    if values.dtype == object:
+        _, values = np.unique(values.astype(str), return_inverse=True)
+        values = values.astype(np.float64)
+    return -values if descending else values
+
+
+def _order(keys: List[np.ndarray], row_count: int, limit: int | None, offset: int = 0) -> np.ndarray:
+    stop = None if limit is None else offset + limit
+    if not keys:
+        return np.arange(row_count)[offset:stop]
+    if len(keys) == 1 and stop is not None and stop < row_count:
+        # Partial sort: select the top `stop` candidates, then sort only those.
+        key = keys[0]
+        if stop == 0:
+            return np.arange(0)
+        candidates = np.argpartition(key, stop - 1)[:stop]
+        return candidates[np.argsort(key[candidates], kind="stable")][offset:]
+    indices = np.lexsort(tuple(reversed(keys)))
+    return indices[offset:stop]
+
+
+def _resolve_order_column(
+    name: str,
+    statement: Statement,
+    outputs: Dict[str, np.ndarray],
+    fallback: Dict[str, np.ndarray],
+) -> np.ndarray:
+    for item, label in zip(statement.items, statement.labels):
+        if item.alias == name:
+            return outputs[label]
+    for item, label in zip(statement.items, statement.labels):
+        if item.function is None and item.column == name:
+            return outputs[label]
+    if name in fallback:
+        return fallback[name]
+    raise ValueError(f"ORDER BY {name} must reference a selected column, alias or GROUP BY column")
+
+
+def _to_python(values: np.ndarray) -> List[Any]:
+    if values.dtype == np.float64:
+        return [None if value != value else value for value in values.tolist()]
+    return values.tolist()
+
+
+def order_and_project(
+    statement: Statement,
+    outputs: Dict[str, np.ndarray],
+    fallback: Dict[str, np.ndarray],
+    row_count: int,
+) -> LocalResult:
+    # outputs holds one array per select label; fallback holds other columns ORDER BY may reference.
+    labels = statement.labels
+    keys = [
+        _sort_key(_resolve_order_column(order.name, statement, outputs, fallback), order.descending)
+        for order in statement.order_by
+    ]
+    selected = _order(keys, row_count, statement.limit, statement.offset)
+    columns = [_to_python(outputs[label][selected]) for label in labels]
+    return LocalResult(columns=labels, rows=list(zip(*columns)) if columns else [])
+
+
+def execute_statement(statement: Statement, dataset: Dataset | None = None) -> LocalResult:
+    dataset = dataset or get_dataset()
+    rows = _filter_indices(dataset, statement)
+    outputs: Dict[str, np.ndarray] = {}
+    fallback: Dict[str, np.ndarray] = {}
+    labels = statement.labels
+    if statement.group_by or statement.has_aggregates:
+        check_grouping(statement)
+        if not statement.group_by and len(rows) == 0:
+            return empty_aggregate_result(statement)
+        if statement.group_by:
+            group_ids, first_rows = _group_ids(dataset, statement.group_by, rows)
+            group_count = len(first_rows)
+        else:
+            group_ids = np.zeros(len(rows), dtype=np.int64)
+            group_count = 1
+        for name in statement.group_by:
+            fallback[name] = dataset.columns[name][first_rows]
+        for item, label in zip(statement.items, labels):
+            if item.function is None:
+                outputs[label] = fallback[item.column]
+            else:
+                outputs[label] = _aggregate(dataset, item.function, item.column, rows, group_ids, group_count)
+        output_rows = group_count
+    else:
+        for name in COLUMNS:
+            fallback[name] = dataset.columns[name][rows]
+        for item, label in zip(statement.items, labels):
+            outputs[label] = fallback[item.column]
+        output_rows = len(rows)
+    return order_and_project(statement, outputs, fallback, output_rows)
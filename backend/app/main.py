@@ -1,20 +1,119 @@
+import asyncio
+import hmac
+import json
 import logging
 import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Dict, TypeVar
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 
-from .clickhouse_client import clickhouse_ping, execute_sql
-from .sql_generation import ConfigurationError, generate_sql
+from .admission import DeadlineMiddleware, Overloaded, admission_stats
+from .clickhouse_client import clickhouse_ping, close_pool, pool_stats
+from .config import get_env, get_int_env
+from .column_stats import current_catalog
+from .intent_parser import intent_stats
+from .metrics import PROMETHEUS_MEDIA_TYPE, MetricsMiddleware, render_prometheus, request_tokens, stage
+from .prompt_index import prompt_index_stats
+from .query_log import (
+    LoggedQuery,
+    new_entry,
+    query_log_stats,
+    record_query,
+    start_query_log,
+    stop_query_log,
+    warm_up_stats,
+)
+from .query_executor import (
+    build_cube_at_startup,
+    clickhouse_row_count,
+    count_rows,
+    execute_batch,
+    execute_sql,
+    execute_sql_arrow,
+    execute_sql_columnar,
+    execution_flight_stats,
+    on_table_reloaded,
+    result_cache_stats,
+    start_stats_refresher,
+    stop_stats_refresher,
+    stream_sql,
+)
+from .pagination import Cursor, decode_cursor, encode_cursor, resolve_page_size
+from .result_formats import (
+    ARROW_FORMAT,
+    ARROW_MEDIA_TYPE,
+    COLUMNAR_FORMAT,
+    FormatUnavailable,
+    encode_arrow,
+    encode_json,
+    negotiate_format,
+)
+from .sql_generation import (
+    ConfigurationError,
+    configured_model,
+    generate_sql,
+    generation_flight_stats,
+    llm_routing_stats,
+    prompt_fingerprint,
+    sql_cache_stats,
+)
+from .shared_cache import shared_cache_stats
+from .startup import readiness, start_warm_up, stop_warm_up
+
+
+DISCONNECT_POLL_SECONDS = 0.25
+ADMIN_TOKEN_ENV = "ADMIN_TOKEN"
+ADMIN_TOKEN_HEADER = "x-admin-token"
+BATCH_CONCURRENCY_ENV = "BATCH_CONCURRENCY"
+BATCH_MAX_PROMPTS_ENV = "BATCH_MAX_PROMPTS"
+DEFAULT_BATCH_CONCURRENCY = 8
+DEFAULT_BATCH_MAX_PROMPTS = 100
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+SSE_MEDIA_TYPE = "text/event-stream"
+
+T = TypeVar("T")
 
 
 class QueryRequest(BaseModel):
     prompt: str
+    page_size: int | None = None
+    include_total: bool = False
+
+
+class BatchRequest(BaseModel):
+    prompts: list[str]
+    page_size: int | None = None
+
+
+class PageRequest(BaseModel):
+    cursor: str
+    include_total: bool = False
+
 
+class ClientDisconnected(Exception):
+    pass
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    build_cube_at_startup()
+    start_stats_refresher()
+    start_query_log()
+    await start_warm_up()
+    yield
+    await stop_warm_up()
+    await stop_query_log()
+    await stop_stats_refresher()
+    await close_pool()
+
+
+app = FastAPI(lifespan=lifespan)
 
 allowed_origins = [
     origin.strip()
@@ -30,7 +129,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS", "PATCH"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "Retry-After"],
 )
+app.add_middleware(DeadlineMiddleware)
+app.add_middleware(MetricsMiddleware)
 logger = logging.getLogger(__name__)
 
 
@@ -39,66 +141,465 @@ def _error_response(
     message: str,
     sql: str = "",
     include_rows: bool = True,
+    headers: Dict[str, str] | None = None,
 ) -> JSONResponse:
     content = {"sql": sql, "error": message}
     if include_rows:
         content["columns"] = []
         content["rows"] = []
-    return JSONResponse(status_code=status_code, content=content)
+    return JSONResponse(status_code=status_code, content=content, headers=headers)
+
+
+def _overloaded_response(exc: Overloaded, sql: str = "", include_rows: bool = True) -> JSONResponse:
+    logger.info("Request shed", extra={"status": exc.status_code, "retry_after": exc.retry_after})
+    headers = {"Retry-After": str(exc.retry_after)}
+    return _error_response(exc.status_code, str(exc), sql=sql, include_rows=include_rows, headers=headers)
+
+
+async def _until_disconnected(http_request: Request, awaitable: Awaitable[T]) -> T:
+    # Cancel in-flight LLM/ClickHouse work as soon as the caller goes away instead of finishing it for nobody.
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
 
 
 @app.get("/api/health")
-def health():
+async def health():
     return {"status": "ok"}
 
 
+@app.get("/api/ready")
+async def ready():
+    # 503 until startup warm-up has finished, so a load balancer only routes to warm workers.
+    state = readiness()
+    return JSONResponse(status_code=200 if state["ready"] else 503, content=state)
+
+
 @app.get("/api/clickhouse/health")
-def clickhouse_health():
+async def clickhouse_health():
     try:
-        return clickhouse_ping()
+        return await clickhouse_ping(row_count=clickhouse_row_count())
     except Exception as exc:
         logger.exception("ClickHouse health check failed")
         raise HTTPException(status_code=500, detail=str(exc))
 
 
+@app.get("/api/clickhouse/pool")
+async def clickhouse_pool():
+    # Null until the first ClickHouse query opens the pool.
+    return {"pool": pool_stats()}
+
+
+@app.get("/api/admission")
+async def admission():
+    # Per-stage concurrency, queue depth and rejections; a stage appears once it has been used.
+    return {"stages": admission_stats(), "llm": llm_routing_stats()}
+
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    return {
+        "sql": sql_cache_stats(),
+        "intent": intent_stats(),
+        "prompt_index": prompt_index_stats(),
+        "results": result_cache_stats(),
+        "shared": await shared_cache_stats(),
+        "query_log": query_log_stats(),
+        "warm_up": warm_up_stats(),
+        "coalescing": {
+            "generation": generation_flight_stats(),
+            "execution": execution_flight_stats(),
+        },
+    }
+
+
+def _cache_gauges(name: str, stats: Dict[str, Any]) -> list[tuple[str, str, str, Dict[str, Any], float]]:
+    labels = {"cache": name}
+    return [
+        ("cache_hits_total", "counter", "Cache hits.", labels, stats["hits"]),
+        ("cache_misses_total", "counter", "Cache misses.", labels, stats["misses"]),
+        ("cache_hit_ratio", "gauge", "Cache hits over lookups since start.", labels, stats["hit_ratio"]),
+        ("cache_entries", "gauge", "Entries currently cached.", labels, stats["entries"]),
+        ("cache_shared_hits_total", "counter", "Local misses answered by the shared cache tier.", labels,
+         stats["shared_hits"]),
+    ]
+
+
+def _flight_gauges(name: str, stats: Dict[str, Any]) -> list[tuple[str, str, str, Dict[str, Any], float]]:
+    labels = {"flight": name}
+    return [
+        ("coalescing_in_flight", "gauge", "Distinct calls currently running.", labels, stats["in_flight"]),
+        ("coalescing_executions_total", "counter", "Calls that ran.", labels, stats["executions"]),
+        ("coalescing_coalesced_total", "counter", "Callers that joined a running call.", labels, stats["coalesced"]),
+        ("coalescing_failures_total", "counter", "Calls that raised.", labels, stats["failures"]),
+    ]
+
+
+@app.get("/api/metrics")
+async def metrics():
+    # Prometheus text format; counters are per process and reset on restart.
+    gauges = _cache_gauges("sql", sql_cache_stats()) + _cache_gauges("results", result_cache_stats())
+    gauges += _flight_gauges("generation", generation_flight_stats())
+    gauges += _flight_gauges("execution", execution_flight_stats())
+    for outcome, count in intent_stats().items():
+        gauges.append(("intent_prompts_total", "counter", "Prompts by intent parser outcome.", {"outcome": outcome}, count))
+    index = prompt_index_stats()
+    gauges.append(("prompt_index_entries", "gauge", "Prompt/SQL pairs in the prompt index.", {}, index["entries"]))
+    gauges.append(("prompt_index_reused_total", "counter", "Prompts answered from the prompt index.", {}, index["reused"]))
+    for name, gate in admission_stats().items():
+        labels = {"stage": name}
+        gauges.append(("admission_active", "gauge", "Calls running in an admission-controlled stage.", labels, gate["active"]))
+        gauges.append(("admission_queue_depth", "gauge", "Calls waiting to enter a stage.", labels, gate["queued"]))
+        for reason, count in gate["rejected"].items():
+            gauges.append(("admission_rejected_total", "counter", "Calls shed before entering a stage.",
+                           {**labels, "reason": reason}, count))
+    shared = await shared_cache_stats()
+    if shared is not None:
+        gauges.append(("shared_cache_bytes", "gauge", "Bytes of values in the shared cache tier.", {}, shared["bytes"] or 0))
+        gauges.append(("shared_cache_evictions_total", "counter", "Shared cache entries evicted by this worker.", {},
+                       shared["evictions"]))
+    routing = llm_routing_stats()
+    for name in ("hedged", "second_wins", "failovers"):
+        gauges.append((f"llm_{name}_total", "counter", f"SQL generation calls: {name.replace('_', ' ')}.", {}, routing[name]))
+    for model, state in routing["models"].items():
+        gauges.append(("llm_circuit_open", "gauge", "1 while a model's circuit breaker is open.", {"model": model},
+                       int(state["state"] != "closed")))
+    pool = pool_stats()
+    if pool is not None:
+        gauges.append(("clickhouse_pool_in_use", "gauge", "Pooled ClickHouse clients checked out.", {}, pool["in_use"]))
+        gauges.append(("clickhouse_pool_waiting", "gauge", "Callers waiting for a ClickHouse client.", {}, pool["waiting"]))
+    return Response(content=render_prometheus(gauges), media_type=PROMETHEUS_MEDIA_TYPE)
+
+
+@app.post("/api/admin/table-reloaded")
+async def table_reloaded(http_request: Request):
+    # Called after the served table or dataset is rewritten (evals/scale_dataset.py --notify-url). Drops
+    # cached results, the dataset, the cube and the column statistics. With the shared cache on, the
+    # other workers on the host follow within a second.
+    token = get_env(ADMIN_TOKEN_ENV)
+    if not token:
+        raise HTTPException(status_code=403, detail=f"{ADMIN_TOKEN_ENV} is not configured")
+    if not hmac.compare_digest(http_request.headers.get(ADMIN_TOKEN_HEADER, ""), token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    await on_table_reloaded()
+    return {"status": "reloaded"}
+
+
+@app.get("/api/stats/columns")
+async def column_stats():
+    catalog = current_catalog()
+    if catalog is None:
+        raise HTTPException(status_code=503, detail="Column statistics are not available yet")
+    return catalog.as_dict()
+
+
+def _next_cursor(page: Cursor, has_more: bool) -> str | None:
+    if not has_more:
+        return None
+    return encode_cursor(Cursor(sql=page.sql, offset=page.offset + page.page_size, page_size=page.page_size))
+
+
+async def _run_query(
+    page: Cursor, fmt: str, include_total: bool, http_request: Request, logged: LoggedQuery | None = None
+) -> Response:
+    sql, offset, page_size = page.sql, page.offset, page.page_size
+    total = await _until_disconnected(http_request, count_rows(sql)) if include_total else None
+    if fmt == ARROW_FORMAT:
+        table, backend, has_more = await _until_disconnected(
+            http_request, execute_sql_arrow(sql, offset, page_size)
+        )
+        if logged is not None:
+            logged.row_count, logged.backend = table.num_rows, backend
+        headers = {"X-Query-Backend": backend}
+        next_cursor = _next_cursor(page, has_more)
+        if next_cursor:
+            headers["X-Next-Cursor"] = next_cursor
+        if total is not None:
+            headers["X-Total-Rows"] = str(total)
+        with stage("encode"):
+            content = encode_arrow(table, sql, backend)
+        return Response(content=content, media_type=ARROW_MEDIA_TYPE, headers=headers)
+    if fmt == COLUMNAR_FORMAT:
+        result = await _until_disconnected(http_request, execute_sql_columnar(sql, offset, page_size))
+    else:
+        result = await _until_disconnected(http_request, execute_sql(sql, offset, page_size))
+    if logged is not None:
+        rows = result["data"][0] if fmt == COLUMNAR_FORMAT and result["data"] else result.get("rows", [])
+        logged.row_count, logged.backend = len(rows), result["backend"]
+    body = {"sql": sql, "columns": result["columns"]}
+    if fmt == COLUMNAR_FORMAT:
+        body["data"] = result["data"]
+    else:
+        body["rows"] = result["rows"]
+    body["backend"] = result["backend"]
+    body["next_cursor"] = _next_cursor(page, result["has_more"])
+    if total is not None:
+        body["total_rows"] = total
+    # Encoded here rather than by FastAPI so the encoding shows up as its own stage.
+    with stage("encode"):
+        content = encode_json(body)
+    return Response(content=content, media_type="application/json")
+
+
+def _elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 3)
+
+
+def _logged_error(logged: LoggedQuery | None, status_code: int, message: str, sql: str) -> JSONResponse:
+    if logged is not None:
+        logged.error = message
+    return _error_response(status_code, message, sql=sql)
+
+
+async def _query_response(
+    prompt: str | None,
+    page: Cursor | None,
+    page_size: int | None,
+    include_total: bool,
+    format: str | None,
+    http_request: Request,
+):
+    # Shared by /api/query (prompt, first page) and /api/query/page (cursor, later pages).
+    try:
+        # ?format=rows|columnar|arrow, or the Arrow / columnar media type in Accept.
+        fmt = negotiate_format(format, http_request.headers.get("accept", ""))
+        if page is None:
+            page_size = resolve_page_size(page_size)
+    except ValueError as exc:
+        return _error_response(400, str(exc))
+    sql = page.sql if page else ""
+    # Only prompt requests are logged; later pages replay SQL that is already in the log.
+    logged = new_entry(prompt) if page is None else None
+    started = time.perf_counter()
+    try:
+        if page is None:
+            # End-to-end path: NL prompt -> CFG-constrained SQL -> ClickHouse execution.
+            sql = await _until_disconnected(http_request, generate_sql(prompt))
+            page = Cursor(sql=sql, offset=0, page_size=page_size)
+            if logged is not None:
+                logged.sql = sql
+                logged.timings_ms["generation"] = _elapsed_ms(started)
+        executing = time.perf_counter()
+        response = await _run_query(page, fmt, include_total, http_request, logged)
+        if logged is not None:
+            logged.timings_ms["execution"] = _elapsed_ms(executing)
+        return response
+    except ConfigurationError as exc:
+        logger.exception("SQL generation configuration error")
+        return _logged_error(logged, 500, str(exc), sql)
+    except FormatUnavailable as exc:
+        return _logged_error(logged, 406, str(exc), sql)
+    except Overloaded as exc:
+        if logged is not None:
+            logged.error = str(exc)
+        return _overloaded_response(exc, sql)
+    except ValueError as exc:
+        logger.exception("SQL generation validation error")
+        return _logged_error(logged, 400, str(exc), sql)
+    except TimeoutError:
+        logger.exception("Query generation or execution timed out")
+        return _logged_error(logged, 504, "Query timed out", sql)
+    except ClientDisconnected:
+        logger.info("Client disconnected; cancelled query")
+        return _logged_error(logged, 499, "Client disconnected", sql)
+    except Exception as exc:
+        logger.exception("Query generation or execution failed")
+        return _logged_error(logged, 502, str(exc), sql)
+    finally:
+        if logged is not None:
+            logged.timings_ms["total"] = _elapsed_ms(started)
+            record_query(logged)
+
+
 @app.post("/api/query")
-def query(request: QueryRequest):
+async def query(request: QueryRequest, http_request: Request, format: str | None = None):
     prompt = request.prompt.strip()
     if not prompt:
         return _error_response(400, "prompt is required")
-    sql = ""
+    return await _query_response(prompt, None, request.page_size, request.include_total, format, http_request)
+
+
+def _batch_error(exc: BaseException) -> tuple[int, str]:
+    # Same status mapping as /api/query, applied per batch item.
+    if isinstance(exc, ConfigurationError):
+        return 500, str(exc)
+    if isinstance(exc, Overloaded):
+        return exc.status_code, str(exc)
+    if isinstance(exc, ValueError):
+        return 400, str(exc)
+    if isinstance(exc, TimeoutError):
+        return 504, "Query timed out"
+    return 502, str(exc)
+
+
+async def _generate_all(prompts: list[str]) -> list[str | BaseException]:
+    # Bounded fan-out so one large batch cannot monopolise the LLM rate limit.
+    semaphore = asyncio.Semaphore(get_int_env(BATCH_CONCURRENCY_ENV, DEFAULT_BATCH_CONCURRENCY))
+
+    async def generate(prompt: str) -> str:
+        async with semaphore:
+            return await generate_sql(prompt)
+
+    return await asyncio.gather(*(generate(prompt) for prompt in prompts), return_exceptions=True)
+
+
+async def _run_batch(prompts: list[str], page_size: int) -> list[Dict[str, Any]]:
+    generated = await _generate_all(prompts)
+    sqls = [sql for sql in generated if isinstance(sql, str)]
+    executed = iter(await execute_batch(sqls, page_size))
+    results = []
+    for sql in generated:
+        outcome = next(executed) if isinstance(sql, str) else sql
+        if isinstance(outcome, BaseException):
+            status, message = _batch_error(outcome)
+            if status >= 500:
+                logger.error("Batch item failed", exc_info=outcome)
+            results.append({"sql": sql if isinstance(sql, str) else "", "status": status, "error": message})
+            continue
+        results.append(
+            {
+                "sql": sql,
+                "status": 200,
+                "columns": outcome["columns"],
+                "rows": outcome["rows"],
+                "backend": outcome["backend"],
+                "next_cursor": _next_cursor(Cursor(sql=sql, offset=0, page_size=page_size), outcome["has_more"]),
+            }
+        )
+    return results
+
+
+@app.post("/api/query/batch")
+async def query_batch(request: BatchRequest, http_request: Request):
+    # Many prompts in one request: generation runs concurrently, identical SQL executes once, and
+    # compatible aggregates share a ClickHouse round trip. Results keep the input order.
+    prompts = [prompt.strip() for prompt in request.prompts]
+    limit = get_int_env(BATCH_MAX_PROMPTS_ENV, DEFAULT_BATCH_MAX_PROMPTS)
+    if not prompts or len(prompts) > limit:
+        return JSONResponse(status_code=400, content={"error": f"prompts must contain 1 to {limit} items"})
+    if not all(prompts):
+        return JSONResponse(status_code=400, content={"error": "every prompt must be non-empty"})
     try:
-        # End-to-end path: NL prompt -> CFG-constrained SQL -> ClickHouse execution.
-        sql = generate_sql(prompt)
-        result = execute_sql(sql)
-        return {"sql": sql, "columns": result["columns"], "rows": result["rows"]}
+        page_size = resolve_page_size(request.page_size)
+        return {"results": await _until_disconnected(http_request, _run_batch(prompts, page_size))}
+    except ValueError as exc:
+        return JSONResponse(status_code=400, content={"error": str(exc)})
+    except ClientDisconnected:
+        logger.info("Client disconnected; cancelled batch")
+        return JSONResponse(status_code=499, content={"error": "Client disconnected"})
+
+
+@app.post("/api/query/page")
+async def query_page(request: PageRequest, http_request: Request, format: str | None = None):
+    # Next page of an earlier /api/query result; the cursor carries the SQL, so the LLM is not called again.
+    try:
+        page = decode_cursor(request.cursor)
+    except ValueError as exc:
+        return _error_response(400, str(exc))
+    return await _query_response(None, page, None, request.include_total, format, http_request)
+
+
+def _encode_event(event: Dict[str, Any], media_type: str) -> bytes:
+    payload = json.dumps(jsonable_encoder(event), separators=(",", ":"))
+    if media_type == SSE_MEDIA_TYPE:
+        return f"event: {event['event']}\ndata: {payload}\n\n".encode()
+    return f"{payload}\n".encode()
+
+
+async def _query_events(sql: str, media_type: str) -> AsyncIterator[bytes]:
+    yield _encode_event({"event": "sql", "sql": sql}, media_type)
+    try:
+        async for event in stream_sql(sql):
+            yield _encode_event(event, media_type)
+    except Overloaded as exc:
+        yield _encode_event(
+            {"event": "error", "status": exc.status_code, "error": str(exc), "retry_after": exc.retry_after}, media_type
+        )
+    except ValueError as exc:
+        logger.exception("Streaming query validation error")
+        yield _encode_event({"event": "error", "status": 400, "error": str(exc)}, media_type)
+    except TimeoutError:
+        logger.exception("Streaming query timed out")
+        yield _encode_event({"event": "error", "status": 504, "error": "Query timed out"}, media_type)
+    except Exception as exc:
+        logger.exception("Streaming query failed")
+        yield _encode_event({"event": "error", "status": 502, "error": str(exc)}, media_type)
+
+
+@app.post("/api/query/stream")
+async def query_stream(request: QueryRequest, http_request: Request):
+    # Progressive /api/query: the SQL goes out as soon as it validates, then the header and row blocks.
+    # Send "Accept: text/event-stream" for SSE; anything else gets NDJSON.
+    prompt = request.prompt.strip()
+    if not prompt:
+        return _error_response(400, "prompt is required")
+    accept = http_request.headers.get("accept", "")
+    media_type = SSE_MEDIA_TYPE if SSE_MEDIA_TYPE in accept else NDJSON_MEDIA_TYPE
+    try:
+        sql = await _until_disconnected(http_request, generate_sql(prompt))
     except ConfigurationError as exc:
         logger.exception("SQL generation configuration error")
-        return _error_response(500, str(exc), sql=sql)
+        return _error_response(500, str(exc))
+    except Overloaded as exc:
+        return _overloaded_response(exc)
     except ValueError as exc:
         logger.exception("SQL generation validation error")
-        return _error_response(400, str(exc), sql=sql)
+        return _error_response(400, str(exc))
+    except TimeoutError:
+        logger.exception("SQL generation timed out")
+        return _error_response(504, "SQL generation timed out")
+    except ClientDisconnected:
+        logger.info("Client disconnected; cancelled SQL generation")
+        return _error_response(499, "Client disconnected")
     except Exception as exc:
-        logger.exception("Query generation or execution failed")
-        return _error_response(502, str(exc), sql=sql)
+        logger.exception("SQL generation failed")
+        return _error_response(502, str(exc))
+    # Starlette cancels the body iterator when the client disconnects, which also kills the ClickHouse query.
+    return StreamingResponse(
+        _query_events(sql, media_type),
+        media_type=media_type,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/sql/fingerprint")
+async def sql_fingerprint():
+    # Changes whenever generation would: lets eval runs tell which cached answers are still current.
+    return {"fingerprint": prompt_fingerprint(), "model": configured_model()}
 
 
 @app.post("/api/sql/generate")
-def sql_generate(request: QueryRequest):
+async def sql_generate(request: QueryRequest, http_request: Request):
     prompt = request.prompt.strip()
     if not prompt:
         return _error_response(400, "prompt is required", include_rows=False)
     sql = ""
     try:
         # Generation-only endpoint for debugging/evals (no ClickHouse execution).
-        sql = generate_sql(prompt)
-        return {"sql": sql}
+        sql = await _until_disconnected(http_request, generate_sql(prompt))
+        return {"sql": sql, "tokens": request_tokens()}
     except ConfigurationError as exc:
         logger.exception("SQL generation configuration error")
         return _error_response(500, str(exc), sql=sql, include_rows=False)
+    except Overloaded as exc:
+        return _overloaded_response(exc, sql=sql, include_rows=False)
     except ValueError as exc:
         logger.exception("SQL generation validation error")
         return _error_response(400, str(exc), sql=sql, include_rows=False)
+    except TimeoutError:
+        logger.exception("SQL generation timed out")
+        return _error_response(504, "SQL generation timed out", sql=sql, include_rows=False)
+    except ClientDisconnected:
+        logger.info("Client disconnected; cancelled SQL generation")
+        return _error_response(499, "Client disconnected", sql=sql, include_rows=False)
     except Exception as exc:
         logger.exception("SQL generation failed")
         return _error_response(502, str(exc), sql=sql, include_rows=False)
@@ -0,0 +1,207 @@
+import bisect
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, List, Tuple
+
+# In-process latency and traffic metrics. Each pipeline stage is timed into a fixed-bucket histogram
+# (an increment under the GIL, no locks) and into the current request's timings, which the middleware
+# sends back as a Server-Timing header. /api/metrics renders everything in Prometheus text format.
+PREFIX = "raindrop"
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Upper bounds in milliseconds, roughly x2.5 apart: sub-millisecond cache hits up to LLM timeouts.
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+QUANTILES = (0.5, 0.95, 0.99)
+UNMATCHED_PATH = "unmatched"
+
+# Stage -> accumulated milliseconds for the request being served; None outside a request.
+_request_timings: ContextVar[Dict[str, float] | None] = ContextVar("request_timings", default=None)
+# LLM tokens ("input", "output") spent on the request being served.
+_request_tokens: ContextVar[Dict[str, int] | None] = ContextVar("request_tokens", default=None)
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS_MS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        # Linear interpolation inside the bucket holding the q-th observation, as histogram_quantile does.
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = BUCKETS_MS[index - 1] if index else 0.0
+                if index == len(BUCKETS_MS):
+                    return lower
+                return lower + (BUCKETS_MS[index] - lower) * (rank - seen) / count
+            seen += count
+        return BUCKETS_MS[-1]
+
+
+_stages: Dict[str, Histogram] = {}
+_requests: Dict[str, Histogram] = {}
+_responses: Dict[Tuple[str, int], int] = {}
+_in_flight: Dict[str, int] = {}
+_tokens: Dict[str, int] = {"input": 0, "output": 0}
+
+
+def observe_stage(name: str, ms: float) -> None:
+    histogram = _stages.get(name)
+    if histogram is None:
+        histogram = _stages[name] = Histogram()
+    histogram.observe(ms)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + ms
+
+
+def record_tokens(input_tokens: int, output_tokens: int) -> None:
+    _tokens["input"] += input_tokens
+    _tokens["output"] += output_tokens
+    tokens = _request_tokens.get()
+    if tokens is not None:
+        tokens["input"] = tokens.get("input", 0) + input_tokens
+        tokens["output"] = tokens.get("output", 0) + output_tokens
+
+
+def request_tokens() -> Dict[str, int]:
+    # Zero when the request was answered without an LLM call, or by joining another caller's call.
+    tokens = _request_tokens.get() or {}
+    return {"input": tokens.get("input", 0), "output": tokens.get("output", 0)}
+
+
+class stage:
+    # with stage("llm"): ...  Times the block even when it raises.
+    __slots__ = ("name", "_started")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __enter__(self) -> "stage":
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        observe_stage(self.name, (time.perf_counter() - self._started) * 1000)
+
+
+def server_timing(timings: Dict[str, float]) -> str:
+    return ", ".join(f"{name};dur={ms:.3f}" for name, ms in timings.items())
+
+
+class MetricsMiddleware:
+    # Plain ASGI rather than BaseHTTPMiddleware: no extra task per request, and streaming bodies pass
+    # through untouched. Stages finished before the response starts are reported in Server-Timing.
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http" or not scope["path"].startswith("/api/"):
+            await self.app(scope, receive, send)
+            return
+        path = scope["path"]
+        timings: Dict[str, float] = {}
+        token = _request_timings.set(timings)
+        tokens_token = _request_tokens.set({})
+        started = time.perf_counter()
+        status = 500
+        _in_flight[path] = _in_flight.get(path, 0) + 1
+
+        async def send_with_timing(message: Dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                timings["total"] = (time.perf_counter() - started) * 1000
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing(timings).encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _in_flight[path] -= 1
+            _request_timings.reset(token)
+            _request_tokens.reset(tokens_token)
+            if scope.get("route") is None:
+                # Keep arbitrary 404 paths from growing the label set.
+                if not _in_flight[path]:
+                    del _in_flight[path]
+                path = UNMATCHED_PATH
+            histogram = _requests.get(path)
+            if histogram is None:
+                histogram = _requests[path] = Histogram()
+            histogram.observe((time.perf_counter() - started) * 1000)
+            _responses[(path, status)] = _responses.get((path, status), 0) + 1
+
+
+def _labels(**labels: Any) -> str:
+    parts = []
+    for name, value in labels.items():
+        text = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{name}="{text}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _histogram_lines(name: str, label: str, histograms: Dict[str, Histogram], help_text: str) -> List[str]:
+    lines = [f"# HELP {name} {help_text}.", f"# TYPE {name} histogram"]
+    for key, histogram in sorted(histograms.items()):
+        cumulative = 0
+        for bound, count in zip((*BUCKETS_MS, "+Inf"), histogram.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels(**{label: key, 'le': bound})} {cumulative}")
+        lines.append(f"{name}_sum{_labels(**{label: key})} {_number(histogram.sum)}")
+        lines.append(f"{name}_count{_labels(**{label: key})} {histogram.count}")
+    quantile_name = f"{name}_quantile"
+    lines += [f"# HELP {quantile_name} {help_text}, estimated quantiles.", f"# TYPE {quantile_name} gauge"]
+    for key, histogram in sorted(histograms.items()):
+        for q in QUANTILES:
+            value = round(histogram.quantile(q), 3)
+            lines.append(f"{quantile_name}{_labels(**{label: key, 'quantile': q})} {_number(value)}")
+    return lines
+
+
+def render_prometheus(gauges: Iterable[Tuple[str, str, str, Dict[str, Any], float]] = ()) -> str:
+    # gauges: (name, type, help, labels, value) samples gathered from the rest of the app at scrape time.
+    lines = _histogram_lines(f"{PREFIX}_stage_latency_ms", "stage", _stages, "Time spent per pipeline stage")
+    lines += _histogram_lines(f"{PREFIX}_http_request_latency_ms", "path", _requests, "HTTP request latency")
+    lines += [f"# HELP {PREFIX}_http_responses_total HTTP responses by status.",
+              f"# TYPE {PREFIX}_http_responses_total counter"]
+    for (path, status), count in sorted(_responses.items()):
+        lines.append(f"{PREFIX}_http_responses_total{_labels(path=path, status=status)} {count}")
+    lines += [f"# HELP {PREFIX}_http_errors_total HTTP responses with a 4xx or 5xx status.",
+              f"# TYPE {PREFIX}_http_errors_total counter"]
+    for (path, status), count in sorted(_responses.items()):
+        if status >= 400:
+            lines.append(f"{PREFIX}_http_errors_total{_labels(path=path, status=status)} {count}")
+    lines += [f"# HELP {PREFIX}_http_in_flight Requests currently being served.",
+              f"# TYPE {PREFIX}_http_in_flight gauge"]
+    for path, count in sorted(_in_flight.items()):
+        lines.append(f"{PREFIX}_http_in_flight{_labels(path=path)} {count}")
+    lines += [f"# HELP {PREFIX}_llm_tokens_total LLM tokens spent generating SQL.",
+              f"# TYPE {PREFIX}_llm_tokens_total counter"]
+    for kind, count in _tokens.items():
+        lines.append(f"{PREFIX}_llm_tokens_total{_labels(kind=kind)} {count}")
+    declared = set()
+    # Samples of one metric must be contiguous in the exposition format.
+    for name, kind, help_text, labels, value in sorted(gauges, key=lambda gauge: gauge[0]):
+        full_name = f"{PREFIX}_{name}"
+        if full_name not in declared:
+            declared.add(full_name)
+            lines += [f"# HELP {full_name} {help_text}", f"# TYPE {full_name} {kind}"]
+        lines.append(f"{full_name}{_labels(**labels) if labels else ''} {_number(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,88 @@
+import base64
+import binascii
+import json
+from dataclasses import dataclass, replace
+
+from .clickhouse_client import MAX_RESULT_ROWS
+from .config import get_int_env
+from .sql_plan import OrderItem, Statement
+
+# Results are served a page at a time instead of failing once they outgrow MAX_RESULT_ROWS. Each page
+# asks for one extra row to learn whether another page follows, so the page size stays below the limit.
+PAGE_SIZE_ENV = "QUERY_PAGE_SIZE"
+MAX_PAGE_SIZE = MAX_RESULT_ROWS - 1
+DEFAULT_PAGE_SIZE = MAX_PAGE_SIZE
+CURSOR_VERSION = 1
+
+
+@dataclass(frozen=True)
+class Cursor:
+    sql: str
+    offset: int
+    page_size: int
+
+
+def default_page_size() -> int:
+    return resolve_page_size(get_int_env(PAGE_SIZE_ENV, DEFAULT_PAGE_SIZE))
+
+
+def resolve_page_size(page_size: int | None) -> int:
+    if page_size is None:
+        return default_page_size()
+    if page_size < 1 or page_size > MAX_PAGE_SIZE:
+        raise ValueError(f"page_size must be between 1 and {MAX_PAGE_SIZE}")
+    return page_size
+
+
+def encode_cursor(cursor: Cursor) -> str:
+    payload = json.dumps(
+        {"v": CURSOR_VERSION, "sql": cursor.sql, "offset": cursor.offset, "page_size": cursor.page_size},
+        separators=(",", ":"),
+    )
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> Cursor:
+    # The SQL inside is re-validated against the grammar before it runs, so a forged cursor gains nothing.
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if payload["v"] != CURSOR_VERSION:
+            raise ValueError("unsupported cursor version")
+        cursor = Cursor(sql=str(payload["sql"]), offset=int(payload["offset"]), page_size=int(payload["page_size"]))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError, KeyError, TypeError, ValueError) as exc:
+        raise ValueError("Invalid cursor") from exc
+    if cursor.offset < 0:
+        raise ValueError("Invalid cursor")
+    resolve_page_size(cursor.page_size)
+    return cursor
+
+
+def is_single_row(statement: Statement) -> bool:
+    return statement.has_aggregates and not statement.group_by
+
+
+def _stable_order(statement: Statement) -> tuple[OrderItem, ...]:
+    # Pages are only consistent under a total order, so the requested ORDER BY is extended with
+    # tie-breakers. Groups are unique on the GROUP BY columns; plain rows that tie on every selected
+    # column are identical, so their relative order does not matter.
+    tie_breakers = statement.group_by or tuple(item.column for item in statement.items)
+    ordered = {order.name for order in statement.order_by}
+    extra = tuple(OrderItem(name=name) for name in dict.fromkeys(tie_breakers) if name not in ordered)
+    return statement.order_by + extra
+
+
+def page_statement(statement: Statement, offset: int, page_size: int) -> Statement:
+    # Rewrites the statement to fetch rows [offset, offset + page_size] of the full result, staying
+    # inside the statement's own LIMIT.
+    if is_single_row(statement):
+        return replace(statement, offset=offset)
+    fetch = page_size + 1
+    if statement.limit is not None:
+        fetch = max(min(fetch, statement.limit - offset), 0)
+    return replace(statement, order_by=_stable_order(statement), limit=fetch, offset=offset)
+
+
+def unpaged_statement(statement: Statement) -> Statement:
+    # The statement whose row count is the total across all pages.
+    return replace(statement, order_by=(), offset=0)
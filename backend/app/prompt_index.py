@@ -0,0 +1,323 @@
+import asyncio
+import json
+import logging
+import os
+import zlib
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Deque, Dict, Iterable, List
+
+import numpy as np
+
+from .config import get_env, get_float_env, get_int_env
+from .intent_parser import schema_terms
+
+logger = logging.getLogger(__name__)
+
+# Past prompt→SQL pairs, searchable by prompt similarity. Prompts are compared as TF-IDF vectors over
+# character trigrams. Candidates come from MinHash LSH buckets, so a lookup scores a bounded handful of
+# entries however large the index grows; only those are compared exactly. Each entry records the model and
+# prompt fingerprint that produced its SQL, and is only reused under the same ones.
+INDEX_PATH_ENV = "PROMPT_INDEX_PATH"
+DEFAULT_INDEX_PATH = Path(__file__).resolve().parent.parent / "prompt_index.jsonl"
+REUSE_SIMILARITY_ENV = "PROMPT_INDEX_REUSE_SIMILARITY"
+DEFAULT_REUSE_SIMILARITY = 0.95
+FEW_SHOT_ENV = "PROMPT_INDEX_FEW_SHOT"
+DEFAULT_FEW_SHOT = 3
+NO_FILE = "off"
+NGRAM = 3
+BANDS = 8
+ROWS_PER_BAND = 4
+# Most recent entries kept per LSH bucket, and how many of the candidates sharing the most buckets are
+# scored exactly. Together they bound the work per lookup.
+BUCKET_CAPACITY = 32
+MAX_SCORED_CANDIDATES = 16
+# The file is rewritten with one line per prompt once it holds this many times more lines than entries.
+COMPACT_RATIO = 2
+COMPACT_MIN_LINES = 1000
+_PRIME = (1 << 61) - 1
+
+_rng = np.random.default_rng(0x5EED)
+_HASH_A = _rng.integers(1, 1 << 31, size=BANDS * ROWS_PER_BAND, dtype=np.uint64)
+_HASH_B = _rng.integers(0, 1 << 31, size=BANDS * ROWS_PER_BAND, dtype=np.uint64)
+
+
+@dataclass(frozen=True)
+class Neighbor:
+    prompt: str
+    sql: str
+    similarity: float
+
+
+def _shingles(text: str) -> List[str]:
+    padded = f" {text} "
+    return [padded[i:i + NGRAM] for i in range(max(len(padded) - NGRAM + 1, 1))]
+
+
+def _signature(shingles: Iterable[str]) -> np.ndarray:
+    # Universal hashing of the crc32 of each shingle; crc32 keeps signatures stable across processes.
+    unique = set(shingles)
+    features = np.fromiter((zlib.crc32(s.encode()) for s in unique), dtype=np.uint64, count=len(unique))
+    hashed = (_HASH_A[:, None] * features[None, :] + _HASH_B[:, None]) % _PRIME
+    return hashed.min(axis=1)
+
+
+def _band_keys(signature: np.ndarray) -> List[tuple[int, bytes]]:
+    rows = signature.reshape(BANDS, ROWS_PER_BAND)
+    return [(band, rows[band].tobytes()) for band in range(BANDS)]
+
+
+def _grown(array: np.ndarray, needed: int) -> np.ndarray:
+    grown = np.zeros(max(needed, 2 * len(array)), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def _read_entries(path: Path) -> tuple[Dict[str, dict], int, int]:
+    # Latest line per prompt, with the number of lines read and of lines skipped as malformed.
+    entries: Dict[str, dict] = {}
+    lines = skipped = 0
+    with path.open(encoding="utf-8") as handle:
+        for line in handle:
+            lines += 1
+            try:
+                entry = json.loads(line)
+                prompt, sql = str(entry["prompt"]), str(entry["sql"])
+            except (json.JSONDecodeError, KeyError, TypeError):
+                skipped += 1
+                continue
+            entries.pop(prompt, None)
+            entries[prompt] = {
+                "prompt": prompt,
+                "sql": sql,
+                "model": entry.get("model"),
+                "fingerprint": entry.get("fingerprint"),
+            }
+    return entries, lines, skipped
+
+
+class PromptIndex:
+    def __init__(self, path: Path | None) -> None:
+        self._path = path
+        self._prompts: List[str] = []
+        self._sql: List[str] = []
+        # (model, fingerprint) that generated each entry's SQL; None for lines written before they were kept.
+        self._versions: List[tuple[str, str] | None] = []
+        self._ids: Dict[str, int] = {}
+        # Trigram vocabulary and per-trigram document frequency for the IDF weights.
+        self._vocabulary: Dict[str, int] = {}
+        self._document_frequency = np.zeros(1024, dtype=np.int64)
+        # Each entry's trigram ids in CSR layout: entry i owns _terms[_offsets[i]:_offsets[i + 1]].
+        self._terms = np.zeros(1 << 16, dtype=np.int32)
+        self._offsets = np.zeros(1 << 12, dtype=np.int64)
+        self._buckets: Dict[tuple[int, bytes], Deque[int]] = {}
+        self._lookups = 0
+        self._reused = 0
+        self._lines = 0
+        self._compactions = 0
+        # File writes run one at a time off the event loop, so appends and compaction never interleave.
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prompt-index")
+        if path is not None and path.exists():
+            self._load(path)
+
+    def _load(self, path: Path) -> None:
+        entries, self._lines, skipped = _read_entries(path)
+        for entry in entries.values():
+            version = (entry["model"], entry["fingerprint"]) if entry["model"] and entry["fingerprint"] else None
+            self._insert(entry["prompt"], entry["sql"], version)
+        if skipped:
+            logger.warning("Skipped %d malformed prompt index lines in %s", skipped, path)
+        logger.info("Loaded prompt index", extra={"entries": len(self._prompts), "path": str(path)})
+        if self._needs_compaction():
+            self._compact()
+
+    def __len__(self) -> int:
+        return len(self._prompts)
+
+    def _insert(self, prompt: str, sql: str, version: tuple[str, str] | None) -> None:
+        existing = self._ids.get(prompt)
+        if existing is not None:
+            # Latest SQL for a prompt wins.
+            self._sql[existing] = sql
+            self._versions[existing] = version
+            return
+        entry_id = len(self._prompts)
+        self._prompts.append(prompt)
+        self._sql.append(sql)
+        self._versions.append(version)
+        self._ids[prompt] = entry_id
+        shingles = _shingles(prompt)
+        self._count_documents(set(shingles))
+        self._append_terms(entry_id, [self._vocabulary[shingle] for shingle in shingles])
+        for key in _band_keys(_signature(shingles)):
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = deque(maxlen=BUCKET_CAPACITY)
+            bucket.append(entry_id)
+
+    async def add(self, prompt: str, sql: str, model: str, fingerprint: str) -> None:
+        existing = self._ids.get(prompt)
+        version = (model, fingerprint)
+        if existing is not None and self._sql[existing] == sql and self._versions[existing] == version:
+            return
+        self._insert(prompt, sql, version)
+        if self._path is not None:
+            line = json.dumps({"prompt": prompt, "sql": sql, "model": model, "fingerprint": fingerprint}) + "\n"
+            await asyncio.get_running_loop().run_in_executor(self._writer, self._append, line)
+
+    def _append(self, line: str) -> None:
+        try:
+            with self._path.open("a", encoding="utf-8") as handle:
+                handle.write(line)
+        except OSError:
+            # The in-memory index still has the entry; persistence is best effort.
+            logger.exception("Failed to persist prompt index entry")
+            return
+        self._lines += 1
+        if self._needs_compaction():
+            self._compact()
+
+    def _needs_compaction(self) -> bool:
+        return self._lines >= COMPACT_MIN_LINES and self._lines > COMPACT_RATIO * len(self._prompts)
+
+    def _compact(self) -> None:
+        # Re-read the file rather than dumping memory, so lines other workers appended are kept.
+        staging = self._path.with_name(f"{self._path.name}.{os.getpid()}.tmp")
+        try:
+            entries, _, _ = _read_entries(self._path)
+            with staging.open("w", encoding="utf-8") as handle:
+                for entry in entries.values():
+                    handle.write(json.dumps(entry) + "\n")
+            os.replace(staging, self._path)
+        except OSError:
+            logger.exception("Failed to compact prompt index")
+            staging.unlink(missing_ok=True)
+            return
+        self._lines = len(entries)
+        self._compactions += 1
+        logger.info("Compacted prompt index", extra={"entries": len(entries), "path": str(self._path)})
+
+    def _count_documents(self, shingles: Iterable[str]) -> None:
+        ids = [self._vocabulary.setdefault(shingle, len(self._vocabulary)) for shingle in shingles]
+        if len(self._vocabulary) > len(self._document_frequency):
+            self._document_frequency = _grown(self._document_frequency, len(self._vocabulary))
+        self._document_frequency[ids] += 1
+
+    def _append_terms(self, entry_id: int, ids: List[int]) -> None:
+        start = self._offsets[entry_id]
+        end = start + len(ids)
+        if end > len(self._terms):
+            self._terms = _grown(self._terms, end)
+        if entry_id + 2 > len(self._offsets):
+            self._offsets = _grown(self._offsets, entry_id + 2)
+        self._terms[start:end] = ids
+        self._offsets[entry_id + 1] = end
+
+    def _term_ids(self, text: str) -> np.ndarray:
+        # One id per trigram occurrence, so repeats count towards term frequency; -1 for unseen trigrams.
+        vocabulary = self._vocabulary
+        shingles = _shingles(text)
+        return np.fromiter((vocabulary.get(s, -1) for s in shingles), dtype=np.int64, count=len(shingles))
+
+    def _idf(self, ids: np.ndarray) -> np.ndarray:
+        frequency = np.where(ids >= 0, self._document_frequency[np.maximum(ids, 0)], 0)
+        return np.log((len(self._prompts) + 1) / (1 + frequency)) + 1
+
+    def _similarities(self, prompt: str, entry_ids: List[int]) -> np.ndarray:
+        # Cosine similarity of TF-IDF vectors, as a sparse dot product over the candidates' trigrams.
+        query_ids, query_counts = np.unique(self._term_ids(prompt), return_counts=True)
+        query_weights = query_counts * self._idf(query_ids)
+        query_norm = np.sqrt(np.dot(query_weights, query_weights)) or 1.0
+        known = query_ids >= 0
+        query_ids, query_weights = query_ids[known], query_weights[known]
+
+        starts = self._offsets[entry_ids]
+        lengths = self._offsets[np.asarray(entry_ids) + 1] - starts
+        owners = np.repeat(np.arange(len(entry_ids)), lengths)
+        # Position of every candidate term in the flat buffer, without a Python loop over candidates.
+        slots = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(starts, lengths)
+        width = len(self._vocabulary) + 1
+        keys, counts = np.unique(owners * width + self._terms[slots], return_counts=True)
+        owners, ids = keys // width, keys % width
+        weights = counts * self._idf(ids)
+        norms = np.sqrt(np.bincount(owners, weights * weights, minlength=len(entry_ids)))
+
+        positions = np.minimum(np.searchsorted(query_ids, ids), max(len(query_ids) - 1, 0))
+        if len(query_ids):
+            matched = query_ids[positions] == ids
+            dots = np.bincount(owners, np.where(matched, weights * query_weights[positions], 0.0), minlength=len(entry_ids))
+        else:
+            dots = np.zeros(len(entry_ids))
+        return dots / (norms * query_norm)
+
+    def _ranked(self, prompt: str) -> List[tuple[int, float]]:
+        # Candidate entry ids with their similarity, most similar first.
+        self._lookups += 1
+        shared_bands: Counter = Counter()
+        for key in _band_keys(_signature(_shingles(prompt))):
+            shared_bands.update(self._buckets.get(key, ()))
+        if not shared_bands:
+            return []
+        entry_ids = [entry_id for entry_id, _ in shared_bands.most_common(MAX_SCORED_CANDIDATES)]
+        similarities = self._similarities(prompt, entry_ids)
+        return [(entry_ids[i], round(float(similarities[i]), 4)) for i in np.argsort(-similarities, kind="stable")]
+
+    def _neighbor(self, entry_id: int, similarity: float) -> Neighbor:
+        return Neighbor(prompt=self._prompts[entry_id], sql=self._sql[entry_id], similarity=similarity)
+
+    def neighbors(self, prompt: str, k: int) -> List[Neighbor]:
+        return [self._neighbor(entry_id, similarity) for entry_id, similarity in self._ranked(prompt)[:k]]
+
+    def near_duplicate(self, prompt: str, threshold: float, model: str, fingerprint: str) -> Neighbor | None:
+        # Only SQL from the current model, grammar and instructions is reused, as with the SQL cache.
+        # Character similarity alone equates "class A" and "class B", "women" and "men", "over 50" and
+        # "over 60", so reuse also needs the same schema terms; near misses only serve as few-shot examples.
+        version = (model, fingerprint)
+        for entry_id, similarity in self._ranked(prompt):
+            if similarity < threshold:
+                break
+            if self._versions[entry_id] != version:
+                continue
+            candidate = self._prompts[entry_id]
+            if candidate == prompt or schema_terms(candidate) == schema_terms(prompt):
+                self._reused += 1
+                return self._neighbor(entry_id, similarity)
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._prompts),
+            "buckets": len(self._buckets),
+            "vocabulary": len(self._vocabulary),
+            "lookups": self._lookups,
+            "reused": self._reused,
+            "compactions": self._compactions,
+            "path": str(self._path) if self._path is not None else None,
+        }
+
+
+def _index_path() -> Path | None:
+    value = get_env(INDEX_PATH_ENV)
+    if value is not None and value.strip().lower() == NO_FILE:
+        return None
+    return Path(value) if value else DEFAULT_INDEX_PATH
+
+
+@lru_cache(maxsize=1)
+def prompt_index() -> PromptIndex:
+    return PromptIndex(_index_path())
+
+
+def reuse_similarity() -> float:
+    return get_float_env(REUSE_SIMILARITY_ENV, DEFAULT_REUSE_SIMILARITY)
+
+
+def few_shot_count() -> int:
+    return max(get_int_env(FEW_SHOT_ENV, DEFAULT_FEW_SHOT), 0)
+
+
+def prompt_index_stats() -> dict:
+    return prompt_index().stats()
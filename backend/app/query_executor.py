@@ -0,0 +1,513 @@
+import asyncio
+import logging
+import sys
+import time
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, List, Sequence
+
+from .aggregate_cube import answer_from_cube, cube_mode, get_cube, reset_cube
+from .cache import LRUCache
+from .clickhouse_client import MAX_RESULT_ROWS, run_query, run_query_arrow, stream_query
+from .column_stats import (
+    CLICKHOUSE_SOURCE,
+    StatsCatalog,
+    answer_from_stats,
+    collect_clickhouse,
+    collect_local,
+    current_catalog,
+    refresh_catalog,
+    reset_catalog,
+    start_refresher,
+    stop_refresher,
+)
+from .config import get_env, get_float_env, get_int_env
+from .local_engine import Dataset, LocalResult, execute_statement, get_dataset
+from .metrics import stage
+from .pagination import is_single_row, page_statement, unpaged_statement
+from .query_router import observe_clickhouse_latency, route
+from .result_formats import arrow_table, pyarrow_module
+from .shared_cache import TieredCache, decode_value, encode_value
+from .single_flight import SingleFlight
+from .statement_merge import merge_key, merged_statement, split_merged
+from .sql_plan import SelectItem, Statement, canonical_key, parse_statement, render_sql
+
+logger = logging.getLogger(__name__)
+
+BACKEND_ENV = "QUERY_BACKEND"
+CLICKHOUSE_BACKEND = "clickhouse"
+LOCAL_BACKEND = "local"
+AUTO_BACKEND = "auto"
+CACHE_BACKEND = "cache"
+CUBE_BACKEND = "cube"
+STATS_BACKEND = "stats"
+BACKENDS = (CLICKHOUSE_BACKEND, LOCAL_BACKEND, AUTO_BACKEND)
+DEFAULT_BACKEND = CLICKHOUSE_BACKEND
+RESULT_CACHE_MAX_BYTES_ENV = "RESULT_CACHE_MAX_BYTES"
+RESULT_CACHE_MAX_ENTRIES_ENV = "RESULT_CACHE_MAX_ENTRIES"
+RESULT_CACHE_TTL_SECONDS_ENV = "RESULT_CACHE_TTL_SECONDS"
+DEFAULT_RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_RESULT_CACHE_MAX_ENTRIES = 4096
+# The table is static between reloads, so entries live until evicted or invalidated.
+DEFAULT_RESULT_CACHE_TTL_SECONDS = 0.0
+STREAM_BLOCK_ROWS_ENV = "STREAM_BLOCK_ROWS"
+DEFAULT_STREAM_BLOCK_ROWS = 256
+
+
+@dataclass(frozen=True)
+class _CachedResult:
+    items: tuple[SelectItem, ...]
+    columns: tuple[str, ...]
+    rows: tuple[tuple[Any, ...], ...]
+
+
+_execution_flight = SingleFlight("execution")
+
+
+@lru_cache(maxsize=1)
+def query_backend() -> str:
+    backend = (get_env(BACKEND_ENV, DEFAULT_BACKEND) or DEFAULT_BACKEND).strip().lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"{BACKEND_ENV} must be one of {', '.join(BACKENDS)}, got {backend!r}")
+    return backend
+
+
+def _result_size(entry: _CachedResult) -> int:
+    # Rough in-memory footprint; good enough to keep the cache inside its byte budget.
+    size = sys.getsizeof(entry.rows) + sum(sys.getsizeof(column) for column in entry.columns)
+    for row in entry.rows:
+        size += sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+    return size
+
+
+def _encode_result(entry: _CachedResult) -> bytes | None:
+    items = tuple((item.function, item.column, item.alias) for item in entry.items)
+    return encode_value((items, entry.columns, entry.rows))
+
+
+def _decode_result(blob: bytes) -> _CachedResult:
+    items, columns, rows = decode_value(blob)
+    return _CachedResult(items=tuple(SelectItem(*item) for item in items), columns=columns, rows=rows)
+
+
+def _reloaded_by_another_worker() -> None:
+    # Another worker ran on_table_reloaded and cleared the shared results; drop what this one derived
+    # from the table as well. The catalog is rebuilt in the background.
+    logger.info("Table reloaded by another worker")
+    get_dataset.cache_clear()
+    reset_cube()
+    reset_catalog()
+    asyncio.ensure_future(refresh_catalog())
+
+
+@lru_cache(maxsize=1)
+def _result_cache() -> TieredCache:
+    local = LRUCache(
+        max_entries=get_int_env(RESULT_CACHE_MAX_ENTRIES_ENV, DEFAULT_RESULT_CACHE_MAX_ENTRIES),
+        ttl_seconds=get_float_env(RESULT_CACHE_TTL_SECONDS_ENV, DEFAULT_RESULT_CACHE_TTL_SECONDS),
+        max_bytes=get_int_env(RESULT_CACHE_MAX_BYTES_ENV, DEFAULT_RESULT_CACHE_MAX_BYTES),
+        sizeof=_result_size,
+    )
+    return TieredCache(local, "results", _encode_result, _decode_result, on_cleared=_reloaded_by_another_worker)
+
+
+def result_cache_stats() -> Dict[str, Any]:
+    return _result_cache().stats()
+
+
+def execution_flight_stats() -> Dict[str, Any]:
+    return _execution_flight.stats()
+
+
+def invalidate_result_cache() -> None:
+    _result_cache().clear()
+    logger.info("Result cache invalidated")
+
+
+async def on_table_reloaded() -> None:
+    # Everything derived from the table's contents is only valid for the data it was read from.
+    invalidate_result_cache()
+    get_dataset.cache_clear()
+    reset_cube()
+    reset_catalog()
+    await refresh_catalog()
+
+
+async def _collect_stats() -> StatsCatalog:
+    if query_backend() == CLICKHOUSE_BACKEND:
+        return await collect_clickhouse()
+    return collect_local(get_dataset())
+
+
+def start_stats_refresher() -> None:
+    start_refresher(_collect_stats)
+
+
+async def stop_stats_refresher() -> None:
+    await stop_refresher()
+
+
+def clickhouse_row_count() -> int | None:
+    # Only a ClickHouse-sourced catalog describes the remote table.
+    catalog = current_catalog()
+    if catalog is None or catalog.source != CLICKHOUSE_SOURCE:
+        return None
+    return catalog.row_count
+
+
+def _result_columns(statement: Statement, cached: _CachedResult) -> List[str]:
+    # Equivalent statements may alias differently, so names come from the caller's statement
+    # and fall back to what the backend reported when neither side used an alias.
+    columns = []
+    for item, cached_item, cached_column in zip(statement.items, cached.items, cached.columns or statement.labels):
+        if item.alias:
+            columns.append(item.alias)
+        elif not cached_item.alias:
+            columns.append(cached_column)
+        else:
+            columns.append(item.label)
+    return columns
+
+
+def _materialize(statement: Statement, cached: _CachedResult, backend: str) -> Dict[str, Any]:
+    columns = _result_columns(statement, cached)
+    with stage("materialize"):
+        rows = [dict(zip(columns, row)) for row in cached.rows]
+    return {"columns": columns, "rows": rows, "backend": backend}
+
+
+def _local_dataset() -> Dataset | None:
+    try:
+        return get_dataset()
+    except (OSError, ValueError):
+        logger.exception("Local dataset unavailable; routing to ClickHouse")
+        return None
+
+
+def _select_backend(statement: Statement) -> str:
+    backend = query_backend()
+    if backend != AUTO_BACKEND:
+        return backend
+    dataset = _local_dataset()
+    if dataset is None:
+        return CLICKHOUSE_BACKEND
+    return route(statement, dataset).backend
+
+
+def _run_cube(statement: Statement) -> LocalResult | None:
+    # The cube is built from the local dataset, so it only answers when that copy is authoritative.
+    if query_backend() == CLICKHOUSE_BACKEND or cube_mode() == "off":
+        return None
+    if _local_dataset() is None:
+        return None
+    return answer_from_cube(statement)
+
+
+def build_cube_at_startup() -> None:
+    if query_backend() != CLICKHOUSE_BACKEND and cube_mode() == "startup":
+        get_cube()
+
+
+def _run_local(statement: Statement, capped: bool = True) -> tuple[List[str], List[tuple]]:
+    result = execute_statement(statement)
+    # Mirror ClickHouse's result_overflow_mode="throw" so both backends fail alike.
+    if capped and len(result.rows) > MAX_RESULT_ROWS:
+        raise RuntimeError(f"Result exceeds {MAX_RESULT_ROWS} rows; add a LIMIT or aggregate")
+    return result.columns, result.rows
+
+
+def _answer_in_process(statement: Statement, capped: bool = True) -> tuple[List[str], List[tuple], str] | None:
+    # Everything that can answer without a ClickHouse round trip, cheapest first.
+    shortcut = answer_from_stats(statement)
+    backend = STATS_BACKEND
+    if shortcut is None:
+        shortcut = _run_cube(statement)
+        backend = CUBE_BACKEND
+    if shortcut is not None:
+        return shortcut.columns, shortcut.rows, backend
+    if _select_backend(statement) == LOCAL_BACKEND:
+        columns, rows = _run_local(statement, capped)
+        return columns, rows, LOCAL_BACKEND
+    return None
+
+
+async def _cached_or_in_process(
+    statement: Statement, cache_key: Any, capped: bool = True
+) -> tuple[_CachedResult | None, str]:
+    # For paths that bypass the execution flight: answers that need no ClickHouse round trip.
+    entry = await _result_cache().get(cache_key)
+    if entry is not None:
+        return entry, CACHE_BACKEND
+    with stage("in_process"):
+        answer = _answer_in_process(statement, capped)
+    if answer is None:
+        return None, CLICKHOUSE_BACKEND
+    columns, rows, backend = answer
+    entry = _CachedResult(items=statement.items, columns=tuple(columns), rows=tuple(rows))
+    if len(rows) <= MAX_RESULT_ROWS:
+        # Only an uncapped stream gets more; execute_sql must never be handed it from the cache.
+        _result_cache().set(cache_key, entry)
+    return entry, backend
+
+
+async def _execute_uncached(sql: str, statement: Statement, cache_key: Any) -> tuple[_CachedResult, str]:
+    with stage("in_process"):
+        answer = _answer_in_process(statement)
+    if answer is not None:
+        columns, rows, backend = answer
+    else:
+        backend = CLICKHOUSE_BACKEND
+        started = time.perf_counter()
+        with stage("clickhouse"):
+            columns, rows = await run_query(sql)
+        observe_clickhouse_latency((time.perf_counter() - started) * 1000)
+    entry = _CachedResult(items=statement.items, columns=tuple(columns), rows=tuple(rows))
+    _result_cache().set(cache_key, entry)
+    return entry, backend
+
+
+def _prepare(sql: str, offset: int, page_size: int | None) -> tuple[Statement, str]:
+    with stage("parse"):
+        statement = parse_statement(sql)
+    if page_size is None:
+        return statement, sql
+    statement = page_statement(statement, offset, page_size)
+    return statement, render_sql(statement)
+
+
+def _has_more(statement: Statement, row_count: int, page_size: int | None) -> bool:
+    return page_size is not None and not is_single_row(statement) and row_count > page_size
+
+
+async def _execute(sql: str, offset: int, page_size: int | None) -> tuple[Statement, _CachedResult, str, bool]:
+    # With a page size, runs one page of the statement; the extra row fetched past the page only
+    # signals that more follow and is dropped here.
+    statement, sql = _prepare(sql, offset, page_size)
+    cache_key = canonical_key(statement)
+    entry = await _result_cache().get(cache_key)
+    backend = CACHE_BACKEND
+    if entry is None:
+        # Logically identical statements in flight together share one execution; each caller
+        # still gets column names from its own statement.
+        entry, backend = await _execution_flight.run(
+            cache_key, lambda: _execute_uncached(sql, statement, cache_key)
+        )
+    entry, has_more = _paged_entry(statement, entry, page_size)
+    return statement, entry, backend, has_more
+
+
+async def execute_sql(sql: str, offset: int = 0, page_size: int | None = None) -> Dict[str, Any]:
+    statement, entry, backend, has_more = await _execute(sql, offset, page_size)
+    return {**_materialize(statement, entry, backend), "has_more": has_more}
+
+
+def _column_data(entry: _CachedResult) -> List[List[Any]]:
+    # Transposes in C; no per-row work in Python.
+    if not entry.rows:
+        return [[] for _ in entry.columns or entry.items]
+    with stage("materialize"):
+        return [list(values) for values in zip(*entry.rows)]
+
+
+async def execute_sql_columnar(sql: str, offset: int = 0, page_size: int | None = None) -> Dict[str, Any]:
+    statement, entry, backend, has_more = await _execute(sql, offset, page_size)
+    return {
+        "columns": _result_columns(statement, entry),
+        "data": _column_data(entry),
+        "backend": backend,
+        "has_more": has_more,
+    }
+
+
+async def _execute_arrow_uncached(sql: str, statement: Statement, cache_key: Any):
+    started = time.perf_counter()
+    with stage("clickhouse"):
+        table = await run_query_arrow(sql)
+    observe_clickhouse_latency((time.perf_counter() - started) * 1000)
+    columns = table.column_names
+    data = [column.to_pylist() for column in table.columns]
+    rows = tuple(zip(*data)) if data else ()
+    _result_cache().set(cache_key, _CachedResult(items=statement.items, columns=tuple(columns), rows=rows))
+    return table
+
+
+async def execute_sql_arrow(sql: str, offset: int = 0, page_size: int | None = None):
+    # Returns (pyarrow.Table, backend, has_more). ClickHouse results come from its Arrow output directly;
+    # anything answered from the cache or in-process is converted column by column.
+    pyarrow_module()
+    statement, sql = _prepare(sql, offset, page_size)
+    cache_key = canonical_key(statement)
+    entry, backend = await _cached_or_in_process(statement, cache_key)
+    if entry is not None:
+        table = arrow_table(_result_columns(statement, entry), _column_data(entry))
+    else:
+        table = await _execution_flight.run(
+            ("arrow", cache_key), lambda: _execute_arrow_uncached(sql, statement, cache_key)
+        )
+        header = _CachedResult(items=statement.items, columns=tuple(table.column_names), rows=())
+        table = table.rename_columns(_result_columns(statement, header))
+        backend = CLICKHOUSE_BACKEND
+    has_more = _has_more(statement, table.num_rows, page_size)
+    if has_more:
+        table = table.slice(0, page_size)
+    return table, backend, has_more
+
+
+async def count_rows(sql: str) -> int:
+    # Total rows across every page. Only computed on request, then cached like any other result.
+    statement = unpaged_statement(parse_statement(sql))
+    cache_key = ("count", canonical_key(statement))
+    cached = await _result_cache().get(cache_key)
+    if cached is not None:
+        return cached.rows[0][0]
+    if _select_backend(statement) == LOCAL_BACKEND:
+        with stage("in_process"):
+            total = len(execute_statement(statement).rows)
+    else:
+        with stage("clickhouse"):
+            _, rows = await run_query(f"SELECT count() FROM ({render_sql(statement)})")
+        total = int(rows[0][0])
+    _result_cache().set(cache_key, _CachedResult(items=(), columns=("count",), rows=((total,),)))
+    return total
+
+
+def _paged_entry(statement: Statement, entry: _CachedResult, page_size: int | None) -> tuple[_CachedResult, bool]:
+    has_more = _has_more(statement, len(entry.rows), page_size)
+    if has_more:
+        entry = replace(entry, rows=entry.rows[:page_size])
+    return entry, has_more
+
+
+async def _execute_merged(statements: List[Statement], keys: List[Any]) -> Dict[Any, tuple[_CachedResult, str]]:
+    merged = merged_statement(statements)
+    started = time.perf_counter()
+    with stage("clickhouse"):
+        _, rows = await run_query(render_sql(merged))
+    observe_clickhouse_latency((time.perf_counter() - started) * 1000)
+    results = {}
+    for statement, key in zip(statements, keys):
+        result = split_merged(statement, merged, rows)
+        entry = _CachedResult(items=statement.items, columns=tuple(result.columns), rows=tuple(result.rows))
+        _result_cache().set(key, entry)
+        results[key] = (entry, CLICKHOUSE_BACKEND)
+    return results
+
+
+async def _execute_group(
+    statements: List[Statement], keys: List[Any], sqls: List[str]
+) -> Dict[Any, tuple[_CachedResult, str] | BaseException]:
+    if len(statements) > 1:
+        try:
+            return await _execute_merged(statements, keys)
+        except Exception:
+            # A merged query can fail where the individual ones would not (e.g. the combined result
+            # hits a server limit); fall back rather than failing the whole group.
+            logger.warning("Merged batch query failed; running statements individually", exc_info=True)
+    outcomes = await asyncio.gather(
+        *(
+            _execution_flight.run(key, lambda sql=sql, statement=statement, key=key: _execute_uncached(sql, statement, key))
+            for statement, key, sql in zip(statements, keys, sqls)
+        ),
+        return_exceptions=True,
+    )
+    return dict(zip(keys, outcomes))
+
+
+async def execute_batch(sqls: Sequence[str], page_size: int | None = None) -> List[Dict[str, Any] | BaseException]:
+    # Runs many statements at once: identical ones (by canonical key) execute once, and aggregate
+    # statements sharing filters and grouping are merged into a single ClickHouse query. Results come
+    # back in input order; a failing item yields its exception instead of failing the batch.
+    prepared: List[tuple[Statement, str, Any] | BaseException] = []
+    for sql in sqls:
+        try:
+            statement, rendered = _prepare(sql, 0, page_size)
+            prepared.append((statement, rendered, canonical_key(statement)))
+        except Exception as exc:
+            prepared.append(exc)
+
+    outcomes: Dict[Any, tuple[_CachedResult, str] | BaseException] = {}
+    groups: Dict[Any, tuple[List[Statement], List[Any], List[str]]] = {}
+    for item in prepared:
+        if isinstance(item, BaseException) or item[2] in outcomes:
+            continue
+        statement, rendered, key = item
+        try:
+            entry, backend = await _cached_or_in_process(statement, key)
+        except Exception as exc:
+            outcomes[key] = exc
+            continue
+        if entry is not None:
+            outcomes[key] = (entry, backend)
+            continue
+        outcomes[key] = None
+        group_key = merge_key(statement) or ("single", key)
+        members = groups.setdefault(group_key, ([], [], []))
+        members[0].append(statement)
+        members[1].append(key)
+        members[2].append(rendered)
+
+    for results in await asyncio.gather(*(_execute_group(*members) for members in groups.values())):
+        outcomes.update(results)
+
+    responses: List[Dict[str, Any] | BaseException] = []
+    for item in prepared:
+        if isinstance(item, BaseException):
+            responses.append(item)
+            continue
+        statement, _, key = item
+        outcome = outcomes[key]
+        if isinstance(outcome, BaseException):
+            responses.append(outcome)
+            continue
+        entry, backend = outcome
+        entry, has_more = _paged_entry(statement, entry, page_size)
+        responses.append({**_materialize(statement, entry, backend), "has_more": has_more})
+    return responses
+
+
+def _row_events(columns: List[str], rows: Sequence[tuple], block_rows: int) -> List[Dict[str, Any]]:
+    return [
+        {"event": "rows", "rows": [dict(zip(columns, row)) for row in rows[start:start + block_rows]]}
+        for start in range(0, len(rows), block_rows)
+    ]
+
+
+async def stream_sql(sql: str) -> AsyncIterator[Dict[str, Any]]:
+    # Same answer as execute_sql, delivered as a "columns" event, "rows" blocks and a closing "done".
+    # ClickHouse results are forwarded block by block as they arrive instead of being collected first.
+    statement = parse_statement(sql)
+    cache_key = canonical_key(statement)
+    block_rows = get_int_env(STREAM_BLOCK_ROWS_ENV, DEFAULT_STREAM_BLOCK_ROWS)
+    if block_rows < 1:
+        raise ValueError(f"{STREAM_BLOCK_ROWS_ENV} must be at least 1")
+    entry, backend = await _cached_or_in_process(statement, cache_key, capped=False)
+    if entry is not None:
+        columns = _result_columns(statement, entry)
+        yield {"event": "columns", "columns": columns, "backend": backend}
+        for event in _row_events(columns, entry.rows, block_rows):
+            yield event
+        yield {"event": "done", "row_count": len(entry.rows), "backend": backend}
+        return
+
+    started = time.perf_counter()
+    # Streams have no row cap. A copy is kept for the result cache only while the result is small
+    # enough for execute_sql to have returned it, so memory stays flat for large results.
+    received: List[tuple] | None = []
+    row_count = 0
+    async with stream_query(sql) as (reported, blocks):
+        observe_clickhouse_latency((time.perf_counter() - started) * 1000)
+        header = _CachedResult(items=statement.items, columns=tuple(reported), rows=())
+        columns = _result_columns(statement, header)
+        yield {"event": "columns", "columns": columns, "backend": CLICKHOUSE_BACKEND}
+        async for block in blocks:
+            row_count += len(block)
+            if row_count > MAX_RESULT_ROWS:
+                received = None
+            elif received is not None:
+                received.extend(block)
+            for event in _row_events(columns, block, block_rows):
+                yield event
+    if received is not None:
+        entry = _CachedResult(items=statement.items, columns=tuple(reported), rows=tuple(received))
+        _result_cache().set(cache_key, entry)
+    yield {"event": "done", "row_count": row_count, "backend": CLICKHOUSE_BACKEND}
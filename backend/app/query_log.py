@@ -0,0 +1,286 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+from .config import get_env, get_float_env, get_int_env
+from .pagination import default_page_size
+from .query_executor import execute_sql
+from .sql_generation import configured_model, normalize_prompt, prompt_fingerprint, seed_sql_cache
+
+logger = logging.getLogger(__name__)
+
+# Append-only record of /api/query requests in numbered JSONL segments. Requests only append to an
+# in-memory batch; a background task writes batches off the event loop. Full segments rotate, and once
+# there are too many the oldest are folded into compacted.jsonl, which keeps one counted line per
+# successful prompt/SQL pair. At startup the most frequent pairs are replayed to warm the caches.
+LOG_DIR_ENV = "QUERY_LOG_DIR"
+DEFAULT_LOG_DIR = Path(__file__).resolve().parent.parent / "query_log"
+SEGMENT_BYTES_ENV = "QUERY_LOG_SEGMENT_BYTES"
+DEFAULT_SEGMENT_BYTES = 4 * 1024 * 1024
+MAX_SEGMENTS_ENV = "QUERY_LOG_MAX_SEGMENTS"
+DEFAULT_MAX_SEGMENTS = 8
+FLUSH_SECONDS_ENV = "QUERY_LOG_FLUSH_SECONDS"
+DEFAULT_FLUSH_SECONDS = 1.0
+MAX_PENDING_ENV = "QUERY_LOG_MAX_PENDING"
+DEFAULT_MAX_PENDING = 10_000
+WARM_TOP_K_ENV = "CACHE_WARM_TOP_K"
+DEFAULT_WARM_TOP_K = 50
+NO_LOG = "off"
+SEGMENT_PREFIX = "queries-"
+SEGMENT_SUFFIX = ".jsonl"
+COMPACTED_NAME = "compacted.jsonl"
+# Pairs kept in compacted.jsonl, most frequent first.
+COMPACTED_MAX_ENTRIES = 10_000
+
+
+@dataclass
+class LoggedQuery:
+    prompt: str
+    sql: str
+    model: str
+    fingerprint: str
+    # Milliseconds per stage: "generation", "execution" and "total".
+    timings_ms: Dict[str, float] = field(default_factory=dict)
+    row_count: int | None = None
+    backend: str | None = None
+    error: str | None = None
+    at: float = field(default_factory=time.time)
+
+
+def new_entry(prompt: str) -> LoggedQuery:
+    return LoggedQuery(prompt=prompt, sql="", model=configured_model(), fingerprint=prompt_fingerprint())
+
+
+def _segment_number(path: Path) -> int:
+    return int(path.name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+
+
+def _read_lines(path: Path) -> Iterator[Dict[str, Any]]:
+    try:
+        with path.open(encoding="utf-8") as handle:
+            for line in handle:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash mid-write leaves a truncated last line; skip it.
+                    continue
+                if isinstance(entry, dict):
+                    yield entry
+    except FileNotFoundError:
+        return
+
+
+def _pair_key(entry: Dict[str, Any]) -> tuple[str, str, str, str] | None:
+    if entry.get("error") or not entry.get("sql") or not entry.get("prompt"):
+        return None
+    return normalize_prompt(entry["prompt"]), entry["sql"], entry.get("model", ""), entry.get("fingerprint", "")
+
+
+class QueryLog:
+    def __init__(self, directory: Path, segment_bytes: int, max_segments: int, max_pending: int) -> None:
+        if max_segments < 2:
+            raise ValueError(f"{MAX_SEGMENTS_ENV} must be at least 2")
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        self.max_pending = max_pending
+        self._pending: List[LoggedQuery] = []
+        self._wake = asyncio.Event()
+        self.written = 0
+        self.dropped = 0
+        self.rotations = 0
+        self.compactions = 0
+
+    def record(self, entry: LoggedQuery) -> None:
+        # Never blocks the request: if the writer falls behind, new entries are dropped and counted.
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self._pending.append(entry)
+        if len(self._pending) >= self.max_pending // 2:
+            self._wake.set()
+
+    async def flush(self) -> None:
+        batch, self._pending = self._pending, []
+        self._wake.clear()
+        if not batch:
+            return
+        try:
+            await asyncio.to_thread(self._write, batch)
+        except OSError:
+            logger.exception("Failed to write query log batch", extra={"entries": len(batch)})
+
+    async def run(self, interval: float) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=interval)
+            except TimeoutError:
+                pass
+            await self.flush()
+
+    def _segments(self) -> List[Path]:
+        return sorted(self.directory.glob(f"{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}"), key=_segment_number)
+
+    def _active_segment(self) -> Path:
+        segments = self._segments()
+        if segments and segments[-1].stat().st_size < self.segment_bytes:
+            return segments[-1]
+        number = _segment_number(segments[-1]) + 1 if segments else 0
+        if segments:
+            self.rotations += 1
+        return self.directory / f"{SEGMENT_PREFIX}{number:06d}{SEGMENT_SUFFIX}"
+
+    def _write(self, batch: List[LoggedQuery]) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        lines = "".join(json.dumps(asdict(entry), separators=(",", ":")) + "\n" for entry in batch)
+        with self._active_segment().open("a", encoding="utf-8") as handle:
+            handle.write(lines)
+        self.written += len(batch)
+        segments = self._segments()
+        if len(segments) > self.max_segments:
+            # Keep the newest half verbatim; fold everything older into the compacted file.
+            self._compact(segments[: len(segments) - self.max_segments // 2])
+
+    def _compact(self, segments: List[Path]) -> None:
+        counts, last_seen = self._pair_counts(segments)
+        compacted = self.directory / COMPACTED_NAME
+        staging = compacted.with_suffix(".tmp")
+        with staging.open("w", encoding="utf-8") as handle:
+            for key, count in counts.most_common(COMPACTED_MAX_ENTRIES):
+                prompt, sql, model, fingerprint = key
+                line = {"prompt": prompt, "sql": sql, "model": model, "fingerprint": fingerprint,
+                        "count": count, "at": last_seen[key]}
+                handle.write(json.dumps(line, separators=(",", ":")) + "\n")
+        # Replace before deleting, so a crash in between double counts rather than loses history.
+        os.replace(staging, compacted)
+        for segment in segments:
+            segment.unlink(missing_ok=True)
+        self.compactions += 1
+        logger.info("Compacted query log", extra={"segments": len(segments), "pairs": len(counts)})
+
+    def _pair_counts(self, segments: List[Path]) -> tuple[Counter, Dict[tuple, float]]:
+        counts: Counter = Counter()
+        last_seen: Dict[tuple, float] = {}
+        for path in [self.directory / COMPACTED_NAME, *segments]:
+            for entry in _read_lines(path):
+                key = _pair_key(entry)
+                if key is None:
+                    continue
+                counts[key] += int(entry.get("count", 1))
+                last_seen[key] = max(last_seen.get(key, 0.0), float(entry.get("at", 0.0)))
+        return counts, last_seen
+
+    def top_pairs(self, k: int, model: str, fingerprint: str) -> List[tuple[str, str, int]]:
+        # Most frequent successful (prompt, sql) pairs generated under the current model and prompt.
+        counts, _ = self._pair_counts(self._segments())
+        pairs = []
+        for (prompt, sql, pair_model, pair_fingerprint), count in counts.most_common():
+            if pair_model == model and pair_fingerprint == fingerprint:
+                pairs.append((prompt, sql, count))
+                if len(pairs) == k:
+                    break
+        return pairs
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "directory": str(self.directory),
+            "pending": len(self._pending),
+            "written": self.written,
+            "dropped": self.dropped,
+            "rotations": self.rotations,
+            "compactions": self.compactions,
+        }
+
+
+@lru_cache(maxsize=1)
+def query_log() -> QueryLog | None:
+    value = get_env(LOG_DIR_ENV)
+    if value is not None and value.strip().lower() == NO_LOG:
+        return None
+    return QueryLog(
+        Path(value) if value else DEFAULT_LOG_DIR,
+        segment_bytes=get_int_env(SEGMENT_BYTES_ENV, DEFAULT_SEGMENT_BYTES),
+        max_segments=get_int_env(MAX_SEGMENTS_ENV, DEFAULT_MAX_SEGMENTS),
+        max_pending=get_int_env(MAX_PENDING_ENV, DEFAULT_MAX_PENDING),
+    )
+
+
+def record_query(entry: LoggedQuery) -> None:
+    log = query_log()
+    if log is not None:
+        log.record(entry)
+
+
+def query_log_stats() -> Dict[str, Any] | None:
+    log = query_log()
+    return log.stats() if log is not None else None
+
+
+_warmed: Dict[str, int] = {"sql": 0, "results": 0, "failed": 0}
+
+
+async def warm_caches() -> None:
+    # Seeds the SQL cache with logged SQL (no LLM call) and runs each statement's first page so the
+    # result cache is warm too. Failures are logged and skipped; warm-up never blocks serving.
+    log = query_log()
+    top_k = get_int_env(WARM_TOP_K_ENV, DEFAULT_WARM_TOP_K)
+    if log is None or top_k <= 0:
+        return
+    started = time.perf_counter()
+    try:
+        pairs = await asyncio.to_thread(log.top_pairs, top_k, configured_model(), prompt_fingerprint())
+    except OSError:
+        logger.exception("Failed to read query log for cache warm-up")
+        return
+    page_size = default_page_size()
+    for prompt, sql, _ in pairs:
+        try:
+            seed_sql_cache(prompt, sql)
+            _warmed["sql"] += 1
+            await execute_sql(sql, 0, page_size)
+            _warmed["results"] += 1
+        except Exception:
+            _warmed["failed"] += 1
+            logger.warning("Cache warm-up query failed", exc_info=True)
+    logger.info(
+        "Warmed caches from query log",
+        extra={**_warmed, "ms": round((time.perf_counter() - started) * 1000, 1)},
+    )
+
+
+def warm_up_stats() -> Dict[str, int]:
+    return dict(_warmed)
+
+
+_tasks: List[asyncio.Task] = []
+
+
+def start_query_log() -> None:
+    loop = asyncio.get_running_loop()
+    log = query_log()
+    if log is not None:
+        interval = get_float_env(FLUSH_SECONDS_ENV, DEFAULT_FLUSH_SECONDS)
+        _tasks.append(loop.create_task(log.run(interval), name="query-log-flush"))
+    _tasks.append(loop.create_task(warm_caches(), name="cache-warm-up"))
+
+
+async def stop_query_log() -> None:
+    for task in _tasks:
+        task.cancel()
+    for task in _tasks:
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    _tasks.clear()
+    log = query_log()
+    if log is not None:
+        # Entries recorded since the last batch are written before shutdown.
+        await log.flush()
@@ -0,0 +1,146 @@
+import logging
+import threading
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+from typing import Any, Dict
+
+import numpy as np
+
+from .config import get_float_env
+from .local_engine import Dataset
+from .schema import NON_NUMERIC_COLUMNS
+from .sql_plan import Comparison, Statement
+
+logger = logging.getLogger(__name__)
+
+# Cost model for QUERY_BACKEND=auto. The local engine scans every row for each predicate, while
+# ClickHouse pays a network round trip up front; small tables win locally, huge ones remotely.
+LOCAL_NS_PER_ROW_ENV = "ROUTER_LOCAL_NS_PER_ROW"
+CLICKHOUSE_NS_PER_ROW_ENV = "ROUTER_CLICKHOUSE_NS_PER_ROW"
+CLICKHOUSE_LATENCY_MS_ENV = "ROUTER_CLICKHOUSE_LATENCY_MS"
+DEFAULT_LOCAL_NS_PER_ROW = 2.0
+DEFAULT_CLICKHOUSE_NS_PER_ROW = 0.2
+DEFAULT_CLICKHOUSE_LATENCY_MS = 80.0
+LATENCY_SMOOTHING = 0.2
+LOCAL_NS_PER_OUTPUT_CELL = 200.0
+
+LOCAL = "local"
+CLICKHOUSE = "clickhouse"
+
+
+@dataclass(frozen=True)
+class RouteDecision:
+    backend: str
+    estimated_rows: int
+    estimated_groups: int
+    local_cost_ms: float
+    clickhouse_cost_ms: float
+
+    def as_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class _LatencyEstimate:
+    # Exponentially weighted moving average of observed ClickHouse round trips.
+    def __init__(self, initial_ms: float) -> None:
+        self._value_ms = initial_ms
+        # Observed from the event loop today; locked like LRUCache, in case work moves to a thread.
+        self._lock = threading.Lock()
+
+    def observe(self, elapsed_ms: float) -> None:
+        with self._lock:
+            self._value_ms += LATENCY_SMOOTHING * (elapsed_ms - self._value_ms)
+
+    @property
+    def value_ms(self) -> float:
+        return self._value_ms
+
+
+@lru_cache(maxsize=1)
+def _clickhouse_latency() -> _LatencyEstimate:
+    return _LatencyEstimate(get_float_env(CLICKHOUSE_LATENCY_MS_ENV, DEFAULT_CLICKHOUSE_LATENCY_MS))
+
+
+def observe_clickhouse_latency(elapsed_ms: float) -> None:
+    _clickhouse_latency().observe(elapsed_ms)
+
+
+def _cumulative_counts(dataset: Dataset, column: str) -> np.ndarray:
+    # Counts per distinct value in sorted order; cumulative sums turn range predicates into lookups.
+    cumulative = dataset.cumulative_counts.get(column)
+    if cumulative is None:
+        counts = np.bincount(dataset.codes[column], minlength=len(dataset.categories[column]))
+        cumulative = dataset.cumulative_counts[column] = np.concatenate(([0], np.cumsum(counts)))
+    return cumulative
+
+
+def _matching_rows(dataset: Dataset, comparison: Comparison) -> int:
+    categories = dataset.categories[comparison.column]
+    cumulative = _cumulative_counts(dataset, comparison.column)
+    if comparison.column in NON_NUMERIC_COLUMNS or comparison.operator in ("=", "IN"):
+        total = 0
+        for value in set(comparison.values):
+            position = int(np.searchsorted(categories, value))
+            if position < len(categories) and categories[position] == value:
+                total += int(cumulative[position + 1] - cumulative[position])
+        if comparison.operator in ("=", "IN"):
+            return total
+    value = comparison.values[0]
+    side = "left" if comparison.operator in (">=", "<") else "right"
+    position = int(np.searchsorted(categories, value, side=side))
+    below = int(cumulative[position])
+    if comparison.operator in ("<", "<="):
+        return below
+    return dataset.row_count - below
+
+
+def _estimate_rows(dataset: Dataset, statement: Statement) -> int:
+    # Exact per predicate, independence assumed across predicates.
+    if dataset.row_count == 0:
+        return 0
+    selectivity = 1.0
+    for comparison in statement.conditions:
+        try:
+            selectivity *= _matching_rows(dataset, comparison) / dataset.row_count
+        except TypeError:
+            # Mismatched literal types are rejected by the engine itself; assume a full scan here.
+            continue
+    return int(round(selectivity * dataset.row_count))
+
+
+def _estimate_groups(dataset: Dataset, statement: Statement, rows: int) -> int:
+    if not statement.group_by:
+        return 1 if statement.has_aggregates else rows
+    groups = 1
+    for column in statement.group_by:
+        groups *= len(dataset.categories[column])
+    return min(groups, rows)
+
+
+def route(statement: Statement, dataset: Dataset) -> RouteDecision:
+    rows = _estimate_rows(dataset, statement)
+    groups = _estimate_groups(dataset, statement, rows)
+    if statement.limit is not None:
+        groups = min(groups, statement.limit)
+    local_ns_per_row = get_float_env(LOCAL_NS_PER_ROW_ENV, DEFAULT_LOCAL_NS_PER_ROW)
+    clickhouse_ns_per_row = get_float_env(CLICKHOUSE_NS_PER_ROW_ENV, DEFAULT_CLICKHOUSE_NS_PER_ROW)
+    scan_passes = len(statement.conditions) + 1
+    aggregate_passes = len(statement.items) + len(statement.group_by)
+    local_ns = (
+        dataset.row_count * scan_passes * local_ns_per_row
+        + rows * aggregate_passes * local_ns_per_row
+        + groups * len(statement.items) * LOCAL_NS_PER_OUTPUT_CELL
+    )
+    clickhouse_ns = dataset.row_count * clickhouse_ns_per_row
+    local_cost_ms = local_ns / 1e6
+    clickhouse_cost_ms = _clickhouse_latency().value_ms + clickhouse_ns / 1e6
+    backend = LOCAL if local_cost_ms <= clickhouse_cost_ms else CLICKHOUSE
+    decision = RouteDecision(
+        backend=backend,
+        estimated_rows=rows,
+        estimated_groups=groups,
+        local_cost_ms=round(local_cost_ms, 3),
+        clickhouse_cost_ms=round(clickhouse_cost_ms, 3),
+    )
+    logger.info("Routed query", extra={"route": decision.as_dict()})
+    return decision
@@ -0,0 +1,63 @@
+from typing import Any, Dict, List
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+
+# Result encodings for /api/query. "rows" is the original list of per-row objects; "columnar" sends the
+# column names once plus one array per column; "arrow" is an Apache Arrow IPC stream.
+ROWS_FORMAT = "rows"
+COLUMNAR_FORMAT = "columnar"
+ARROW_FORMAT = "arrow"
+FORMATS = (ROWS_FORMAT, COLUMNAR_FORMAT, ARROW_FORMAT)
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+COLUMNAR_MEDIA_TYPE = "application/vnd.raindrop.columnar+json"
+
+
+class FormatUnavailable(Exception):
+    pass
+
+
+def negotiate_format(requested: str | None, accept: str) -> str:
+    # An explicit ?format= wins over the Accept header.
+    if requested:
+        fmt = requested.strip().lower()
+        if fmt not in FORMATS:
+            raise ValueError(f"format must be one of {', '.join(FORMATS)}, got {requested!r}")
+        return fmt
+    if ARROW_MEDIA_TYPE in accept:
+        return ARROW_FORMAT
+    if COLUMNAR_MEDIA_TYPE in accept:
+        return COLUMNAR_FORMAT
+    return ROWS_FORMAT
+
+
+def _json_default(value: Any) -> Any:
+    # orjson covers the common types natively; anything else (e.g. Decimal) goes through FastAPI's encoder.
+    return jsonable_encoder(value)
+
+
+def encode_json(payload: Dict[str, Any]) -> bytes:
+    return orjson.dumps(payload, default=_json_default, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def pyarrow_module():
+    try:
+        import pyarrow
+    except ImportError as exc:
+        raise FormatUnavailable("Arrow output requires pyarrow; install the backend's 'arrow' extra") from exc
+    return pyarrow
+
+
+def arrow_table(columns: List[str], data: List[List[Any]]):
+    pa = pyarrow_module()
+    return pa.Table.from_arrays([pa.array(values) for values in data], names=columns)
+
+
+def encode_arrow(table, sql: str, backend: str) -> bytes:
+    pa = pyarrow_module()
+    # The SQL and backend ride along as schema metadata so Arrow clients need no side channel.
+    table = table.replace_schema_metadata({"sql": sql, "backend": backend})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
@@ -0,0 +1,442 @@
+import asyncio
+import hashlib
+import logging
+import marshal
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable
+
+from .cache import LRUCache
+from .config import get_env, get_int_env
+
+logger = logging.getLogger(__name__)
+
+# Host-wide cache tier shared by every worker process: one SQLite database in WAL mode, so readers
+# never block each other or the single writer. Each cache keeps its in-process LRU in front; a local
+# miss falls through to this tier, and every set writes both. One worker's LLM call or ClickHouse
+# query therefore serves the others. Entries are evicted least recently used once the database holds
+# more than SHARED_CACHE_MAX_BYTES of values. SQLite is never called on the event loop: reads run on
+# the default executor and writes are queued to one writer thread per process. Failures here are
+# logged and treated as misses. Off unless SHARED_CACHE_PATH is set: a single worker gains nothing from it.
+PATH_ENV = "SHARED_CACHE_PATH"
+MAX_BYTES_ENV = "SHARED_CACHE_MAX_BYTES"
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+NO_SHARED = "off"
+BUSY_TIMEOUT_MS = 2000
+# Sets between size checks, per process; eviction then trims to EVICT_TO of the budget.
+EVICT_EVERY = 32
+EVICT_TO = 0.9
+# A hit only rewrites accessed_at when it is older than this, so reads rarely take the write lock.
+# Eviction order is therefore only this precise.
+ACCESS_REFRESH_SECONDS = 60.0
+# Writes queued beyond this are dropped rather than letting the backlog grow without bound.
+MAX_PENDING_WRITES = 1000
+# How often a worker checks whether another worker cleared a namespace; its local tier can serve
+# cleared entries for at most this long.
+GENERATION_CHECK_SECONDS = 1.0
+# Bumped whenever the value encoding changes; older values then decode as misses.
+CODEC_VERSION = b"\x01"
+# Bumped whenever the table layout changes; an older entries table is dropped, not migrated.
+SCHEMA_VERSION = 2
+
+# Each entry carries the namespace generation its writer had seen. A clear bumps the generation, so an
+# entry written from before it is never served, even when its write lands after the clear.
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS entries (
+        namespace TEXT NOT NULL,
+        key BLOB NOT NULL,
+        value BLOB NOT NULL,
+        size INTEGER NOT NULL,
+        expires_at REAL,
+        accessed_at REAL NOT NULL,
+        generation INTEGER NOT NULL,
+        PRIMARY KEY (namespace, key)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)",
+    "CREATE TABLE IF NOT EXISTS generations (namespace TEXT PRIMARY KEY, generation INTEGER NOT NULL)",
+)
+_CURRENT_GENERATION = "COALESCE((SELECT generation FROM generations WHERE namespace = entries.namespace), 0)"
+
+
+def encode_value(value: Any) -> bytes | None:
+    # marshal: compact, C-speed, and round-trips tuples, str, bytes, int, float, bool and None. Every
+    # worker on a host runs the same interpreter, so its format is stable across them. None if unsupported.
+    try:
+        return CODEC_VERSION + marshal.dumps(value)
+    except ValueError:
+        return None
+
+
+def decode_value(blob: bytes) -> Any:
+    if blob[:1] != CODEC_VERSION:
+        raise ValueError("Unknown shared cache encoding")
+    return marshal.loads(blob[1:])
+
+
+def _digest(key: Hashable) -> bytes:
+    # Cache keys are nested tuples of str/int/float/None, whose repr is the same in every process.
+    return hashlib.blake2b(repr(key).encode("utf-8"), digest_size=16).digest()
+
+
+class SharedCache:
+    def __init__(self, path: Path, max_bytes: int) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-cache-writer")
+        self._pending_lock = threading.Lock()
+        self._pending_writes = 0
+        # Reads count on executor threads, so the counters they share are updated under a lock.
+        self._stats_lock = threading.Lock()
+        self._sets_since_check = 0
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.dropped_writes = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections are per thread: each executor thread and the writer thread open their own.
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # Losing the last writes on power failure only costs a few cache misses.
+            connection.execute("PRAGMA synchronous=NORMAL")
+            _create_schema(connection)
+            self._local.connection = connection
+        return connection
+
+    def _failed(self, action: str) -> None:
+        with self._stats_lock:
+            self.errors += 1
+        logger.warning("Shared cache %s failed", action, extra={"path": str(self.path)}, exc_info=True)
+
+    def _submit(self, work: Callable[[], Any], required: bool = False) -> "Future | None":
+        # Fire and forget: callers never wait on the write lock. Writes run in submission order. Only
+        # `required` work is queued past MAX_PENDING_WRITES; the rest is dropped and returns None.
+        with self._pending_lock:
+            if not required and self._pending_writes >= MAX_PENDING_WRITES:
+                self.dropped_writes += 1
+                return None
+            self._pending_writes += 1
+
+        def run() -> Any:
+            try:
+                return work()
+            finally:
+                with self._pending_lock:
+                    self._pending_writes -= 1
+
+        return self._writer.submit(run)
+
+    def get(self, namespace: str, key: Hashable) -> bytes | None:
+        # Blocking; call it off the event loop. Expired entries, and entries written before the
+        # namespace's last clear, read as misses and are left to eviction.
+        digest = _digest(key)
+        now = time.time()
+        try:
+            row = self._connection().execute(
+                "SELECT value, expires_at, accessed_at FROM entries WHERE namespace = ? AND key = ?"
+                f" AND generation >= {_CURRENT_GENERATION}",
+                (namespace, digest),
+            ).fetchone()
+        except sqlite3.Error:
+            self._failed("read")
+            return None
+        if row is None or (row[1] is not None and row[1] <= now):
+            with self._stats_lock:
+                self.misses += 1
+            return None
+        with self._stats_lock:
+            self.hits += 1
+        if now - row[2] >= ACCESS_REFRESH_SECONDS:
+            self._submit(lambda: self._touch(namespace, digest, now))
+        return row[0]
+
+    def _touch(self, namespace: str, digest: bytes, now: float) -> None:
+        try:
+            self._connection().execute(
+                "UPDATE entries SET accessed_at = ? WHERE namespace = ? AND key = ?", (now, namespace, digest)
+            )
+        except sqlite3.Error:
+            self._failed("access time update")
+
+    def set(self, namespace: str, key: Hashable, value: bytes, ttl_seconds: float | None, generation: int) -> None:
+        # `generation` is the namespace generation the caller had seen when it computed the value.
+        if len(value) > self.max_bytes:
+            return
+        now = time.time()
+        expires_at = now + ttl_seconds if ttl_seconds else None
+        self._submit(lambda: self._write(namespace, _digest(key), value, expires_at, now, generation))
+
+    def _write(
+        self, namespace: str, digest: bytes, value: bytes, expires_at: float | None, now: float, generation: int
+    ) -> None:
+        try:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO entries (namespace, key, value, size, expires_at, accessed_at, generation)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (namespace, digest, value, len(value), expires_at, now, generation),
+            )
+        except sqlite3.Error:
+            self._failed("write")
+            return
+        self.writes += 1
+        self._sets_since_check += 1
+        if self._sets_since_check >= EVICT_EVERY:
+            self._sets_since_check = 0
+            self._evict()
+
+    def _evict(self) -> None:
+        try:
+            connection = self._connection()
+            # BEGIN IMMEDIATE takes the write lock before measuring, so two workers never both evict.
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                # Expired and superseded entries go first, whatever the size.
+                expired = connection.execute(
+                    "DELETE FROM entries WHERE (expires_at IS NOT NULL AND expires_at <= ?)"
+                    f" OR generation < {_CURRENT_GENERATION}",
+                    (time.time(),),
+                )
+                self.evictions += expired.rowcount
+                (total,) = connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()
+                if total > self.max_bytes:
+                    excess = total - int(self.max_bytes * EVICT_TO)
+                    # Least recently used first, until at least `excess` bytes are freed.
+                    cursor = connection.execute(
+                        """
+                        DELETE FROM entries WHERE rowid IN (
+                            SELECT rowid FROM (
+                                SELECT rowid,
+                                       SUM(size) OVER (ORDER BY accessed_at, rowid ROWS UNBOUNDED PRECEDING)
+                                       - size AS freed_before
+                                FROM entries
+                            ) WHERE freed_before < ?
+                        )
+                        """,
+                        (excess,),
+                    )
+                    self.evictions += cursor.rowcount
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        except sqlite3.Error:
+            self._failed("eviction")
+
+    def clear(self, namespace: str) -> "Future[tuple[int, int] | None]":
+        # Bumping the generation tells the other workers to drop their local tiers too. Never dropped
+        # for backlog; the future resolves to the generation before and after, or None if it failed.
+        return self._submit(lambda: self._clear(namespace), required=True)
+
+    def _clear(self, namespace: str) -> tuple[int, int] | None:
+        try:
+            connection = self._connection()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute("DELETE FROM entries WHERE namespace = ?", (namespace,))
+                row = connection.execute(
+                    "SELECT generation FROM generations WHERE namespace = ?", (namespace,)
+                ).fetchone()
+                previous = row[0] if row is not None else 0
+                connection.execute(
+                    "INSERT OR REPLACE INTO generations (namespace, generation) VALUES (?, ?)",
+                    (namespace, previous + 1),
+                )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        except sqlite3.Error:
+            self._failed("clear")
+            return None
+        return previous, previous + 1
+
+    def generation(self, namespace: str) -> int | None:
+        # Blocking; None when it cannot be read.
+        try:
+            row = self._connection().execute(
+                "SELECT generation FROM generations WHERE namespace = ?", (namespace,)
+            ).fetchone()
+        except sqlite3.Error:
+            self._failed("generation read")
+            return None
+        return row[0] if row is not None else 0
+
+    def stats(self) -> Dict[str, Any]:
+        # Blocking; call it off the event loop.
+        try:
+            entries, size = self._connection().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        except sqlite3.Error:
+            self._failed("stats")
+            entries, size = None, None
+        with self._stats_lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            "path": str(self.path),
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "writes": self.writes,
+            "pending_writes": self._pending_writes,
+            "dropped_writes": self.dropped_writes,
+            "evictions": self.evictions,
+            "errors": self.errors,
+        }
+
+
+def _create_schema(connection: sqlite3.Connection) -> None:
+    # Under the write lock, so two workers opening an old file do not both drop its entries.
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        if connection.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            connection.execute("DROP TABLE IF EXISTS entries")
+            connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        for statement in _SCHEMA:
+            connection.execute(statement)
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+
+
+@lru_cache(maxsize=1)
+def shared_cache() -> SharedCache | None:
+    value = (get_env(PATH_ENV) or "").strip()
+    if not value or value.lower() == NO_SHARED:
+        return None
+    return SharedCache(Path(value), get_int_env(MAX_BYTES_ENV, DEFAULT_MAX_BYTES))
+
+
+async def shared_cache_stats() -> Dict[str, Any] | None:
+    cache = shared_cache()
+    return await asyncio.to_thread(cache.stats) if cache is not None else None
+
+
+_MISSING = object()
+
+
+class TieredCache:
+    # An in-process LRUCache in front of the shared tier. get is a coroutine, since a local miss reads
+    # the shared tier on a thread; set and clear return at once and write it in the background.
+    # encode/decode turn values into bytes and back; a value encode cannot handle stays local.
+    def __init__(
+        self,
+        local: LRUCache,
+        namespace: str,
+        encode: Callable[[Any], bytes | None],
+        decode: Callable[[bytes], Any],
+        on_cleared: Callable[[], None] | None = None,
+    ) -> None:
+        # on_cleared runs when another worker clears the namespace, not when this one does.
+        self.local = local
+        self.namespace = namespace
+        self._encode = encode
+        self._decode = decode
+        self._on_cleared = on_cleared
+        self.shared_hits = 0
+        # Last namespace generation seen; None until first read.
+        self._generation: int | None = None
+        self._generation_checked_at = float("-inf")
+        # This worker's clears: queued ones as futures, then the generations they produced. A bump to
+        # one of those is not another worker's reload.
+        self._pending_clears: list[Future] = []
+        self._own_generations: set[int] = set()
+
+    def _collect_own_clears(self) -> None:
+        pending = []
+        for future in self._pending_clears:
+            if not future.done():
+                pending.append(future)
+                continue
+            result = future.result()
+            if result is None:
+                continue
+            previous, generation = result
+            self._own_generations.add(generation)
+            if self._generation is None:
+                # Cleared before the first read: the generation it replaced is where this worker starts.
+                self._generation = previous
+        self._pending_clears = pending
+
+    async def _check_generation(self, shared: SharedCache) -> None:
+        # Another worker's clear() bumps the namespace's generation; drop the local copies it cleared.
+        now = time.monotonic()
+        if now - self._generation_checked_at < GENERATION_CHECK_SECONDS:
+            return
+        self._generation_checked_at = now
+        generation = await asyncio.to_thread(shared.generation, self.namespace)
+        if generation is None:
+            return
+        # Collected after the read, so any own clear the read could see is already accounted for.
+        self._collect_own_clears()
+        if self._generation is not None and generation > self._generation:
+            bumps = set(range(self._generation + 1, generation + 1))
+            if bumps - self._own_generations:
+                # This worker's own clears already emptied its local tier.
+                self.local.clear()
+                if self._on_cleared is not None:
+                    self._on_cleared()
+        self._own_generations = {own for own in self._own_generations if own > generation}
+        if self._generation is None or generation > self._generation:
+            self._generation = generation
+
+    async def get(self, key: Hashable, default: Any = None) -> Any:
+        shared = shared_cache()
+        if shared is None:
+            return self.local.get(key, default)
+        await self._check_generation(shared)
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        blob = await asyncio.to_thread(shared.get, self.namespace, key)
+        if blob is None:
+            return default
+        try:
+            value = self._decode(blob)
+        except (ValueError, EOFError, TypeError):
+            logger.warning("Dropping undecodable shared cache entry", extra={"namespace": self.namespace})
+            return default
+        self.shared_hits += 1
+        self.local.set(key, value)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> bool:
+        stored = self.local.set(key, value)
+        shared = shared_cache()
+        # Until this worker has read the generation it cannot tell the shared tier which one the value
+        # belongs to, so it stays local.
+        if shared is not None and self._generation is not None:
+            blob = self._encode(value)
+            if blob is not None:
+                shared.set(self.namespace, key, blob, self.local.ttl_seconds, self._generation)
+        return stored
+
+    def clear(self) -> None:
+        # Other workers drop their local copies within GENERATION_CHECK_SECONDS.
+        self.local.clear()
+        shared = shared_cache()
+        if shared is not None:
+            self._pending_clears.append(shared.clear(self.namespace))
+
+    def __len__(self) -> int:
+        return len(self.local)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.local.stats(), "shared_hits": self.shared_hits}
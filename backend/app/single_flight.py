@@ -0,0 +1,68 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class _Call:
+    def __init__(self, task: asyncio.Task) -> None:
+        self.task = task
+        self.waiters = 0
+        self.abandoned = False
+
+
+class SingleFlight:
+    # Concurrent callers with the same key share one execution. The work runs in its own task, so one
+    # caller disconnecting does not fail the others; it is cancelled only when every caller has left.
+    # Nothing is kept once the call finishes, so coalescing never serves stale results.
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self.executions = 0
+        self.coalesced = 0
+        self.failures = 0
+
+    def _forget(self, key: Hashable, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def _start(self, key: Hashable, factory: Callable[[], Awaitable[T]]) -> _Call:
+        call = _Call(asyncio.ensure_future(factory()))
+        self._calls[key] = call
+        self.executions += 1
+
+        def _done(task: asyncio.Task) -> None:
+            self._forget(key, call)
+            if not task.cancelled() and task.exception() is not None:
+                self.failures += 1
+
+        call.task.add_done_callback(_done)
+        return call
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable[T]]) -> T:
+        call = self._calls.get(key)
+        if call is None or call.abandoned:
+            call = self._start(key, factory)
+        else:
+            self.coalesced += 1
+            logger.debug("Coalesced %s call", self.name)
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.abandoned = True
+                self._forget(key, call)
+                call.task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._calls),
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "failures": self.failures,
+        }
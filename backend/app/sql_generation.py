@@ -1,11 +1,25 @@
+import asyncio
+import hashlib
 import logging
+import re
+import time
 from functools import lru_cache
+from typing import TYPE_CHECKING
 
-from openai import OpenAI
-
-from .config import get_env, require_env
+from .admission import AdmissionGate, Overloaded, budget
+from .cache import LRUCache
+from .config import get_env, get_float_env, get_int_env, require_env
+from .hedging import CLOSED, CircuitBreaker, Hedger, LatencyWindow
+from .intent_parser import answer_without_llm, record
+from .metrics import record_tokens, stage
+from .prompt_index import Neighbor, few_shot_count, prompt_index, reuse_similarity
 from .schema import COLUMNS, DATASET
-from .sql_grammar import sql_grammar, validate_sql
+from .shared_cache import TieredCache, decode_value, encode_value
+from .single_flight import SingleFlight
+from .sql_grammar import StreamingValidator, sql_grammar, validate_sql
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
 
 logger = logging.getLogger(__name__)
 
@@ -13,6 +27,35 @@ API_KEY_ENV = "OPENAI_API_KEY"
 MODEL_ENV = "OPENAI_MODEL"
 DEFAULT_MODEL = "gpt-5.2"
 TOOL_NAME = "sql_query"
+TIMEOUT_SECONDS_ENV = "OPENAI_TIMEOUT_SECONDS"
+DEFAULT_TIMEOUT_SECONDS = 30.0
+SQL_CACHE_MAX_ENTRIES_ENV = "SQL_CACHE_MAX_ENTRIES"
+SQL_CACHE_TTL_SECONDS_ENV = "SQL_CACHE_TTL_SECONDS"
+DEFAULT_SQL_CACHE_MAX_ENTRIES = 1024
+DEFAULT_SQL_CACHE_TTL_SECONDS = 24 * 60 * 60
+# Streams cut short at the first token outside the grammar are retried this many times.
+STREAM_RETRIES_ENV = "OPENAI_STREAM_RETRIES"
+DEFAULT_STREAM_RETRIES = 1
+LLM_MAX_CONCURRENCY_ENV = "LLM_MAX_CONCURRENCY"
+LLM_MAX_QUEUE_ENV = "LLM_MAX_QUEUE"
+DEFAULT_LLM_MAX_CONCURRENCY = 16
+DEFAULT_LLM_MAX_QUEUE = 64
+# Tail-latency control: a call still running past the primary model's recent LLM_HEDGE_QUANTILE
+# latency (never sooner than LLM_HEDGE_MIN_MS) is raced by a second call, sent to the fallback model
+# when one is configured. 0 disables hedging.
+FALLBACK_MODEL_ENV = "OPENAI_FALLBACK_MODEL"
+HEDGE_QUANTILE_ENV = "LLM_HEDGE_QUANTILE"
+HEDGE_MIN_MS_ENV = "LLM_HEDGE_MIN_MS"
+DEFAULT_HEDGE_QUANTILE = 0.9
+DEFAULT_HEDGE_MIN_MS = 500.0
+# No hedging until this many latencies have been seen for the model.
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 256
+BREAKER_FAILURES_ENV = "LLM_BREAKER_FAILURES"
+BREAKER_COOLDOWN_SECONDS_ENV = "LLM_BREAKER_COOLDOWN_SECONDS"
+DEFAULT_BREAKER_FAILURES = 5
+DEFAULT_BREAKER_COOLDOWN_SECONDS = 30.0
+CIRCUIT_OPEN = "circuit_open"
 COLUMN_LIST = ", ".join(COLUMNS)
 SYSTEM_INSTRUCTIONS = (
     f"You generate ClickHouse SQL for the dataset {DATASET} "
@@ -27,6 +70,11 @@ SYSTEM_INSTRUCTIONS = (
 )
 
 
+# Fold punctuation that does not change meaning; comparators, signs and decimal points are kept.
+_PUNCTUATION_RE = re.compile(r"(?!(?<=\d)\.(?=\d))[^\w\s<>=+\-%]")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
 class ConfigurationError(Exception):
     pass
 
@@ -38,14 +86,28 @@ def _settings() -> tuple[str, str]:
         f"{API_KEY_ENV} is required. Set it in backend/.env.",
         ConfigurationError,
     )
-    model = get_env(MODEL_ENV, DEFAULT_MODEL)
-    return api_key, model
+    return api_key, configured_model()
 
 
 @lru_cache(maxsize=1)
-def _client() -> OpenAI:
+def _client() -> "AsyncOpenAI":
+    # openai takes ~0.8s to import; prompts answered by the intent parser or caches never need it.
+    from openai import AsyncOpenAI
+
     api_key, _ = _settings()
-    return OpenAI(api_key=api_key)
+    return AsyncOpenAI(api_key=api_key)
+
+
+async def open_client() -> None:
+    # Startup warm-up: import openai off the event loop and open the keep-alive connection with a
+    # call that spends no tokens.
+    client = await asyncio.to_thread(_client)
+    await client.models.retrieve(configured_model())
+
+
+def configured_model() -> str:
+    # Readable without an API key, so the query log and cache warm-up work before any LLM call.
+    return get_env(MODEL_ENV, DEFAULT_MODEL)
 
 
 def _model_name() -> str:
@@ -53,6 +115,105 @@ def _model_name() -> str:
     return model
 
 
+def _fallback_model(model: str) -> str | None:
+    fallback = (get_env(FALLBACK_MODEL_ENV) or "").strip()
+    return fallback if fallback and fallback != model else None
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_latencies: dict[str, LatencyWindow] = {}
+_hedger = Hedger()
+
+
+def _breaker(model: str) -> CircuitBreaker:
+    breaker = _breakers.get(model)
+    if breaker is None:
+        breaker = _breakers[model] = CircuitBreaker(
+            get_int_env(BREAKER_FAILURES_ENV, DEFAULT_BREAKER_FAILURES),
+            get_float_env(BREAKER_COOLDOWN_SECONDS_ENV, DEFAULT_BREAKER_COOLDOWN_SECONDS),
+        )
+    return breaker
+
+
+def _latency(model: str) -> LatencyWindow:
+    window = _latencies.get(model)
+    if window is None:
+        window = _latencies[model] = LatencyWindow(LATENCY_WINDOW)
+    return window
+
+
+def _hedge_delay(model: str) -> float | None:
+    quantile = get_float_env(HEDGE_QUANTILE_ENV, DEFAULT_HEDGE_QUANTILE)
+    window = _latency(model)
+    if quantile <= 0 or len(window) < HEDGE_MIN_SAMPLES:
+        return None
+    return max(window.quantile(quantile), get_float_env(HEDGE_MIN_MS_ENV, DEFAULT_HEDGE_MIN_MS) / 1000)
+
+
+def llm_routing_stats() -> dict:
+    models = {}
+    for model, breaker in _breakers.items():
+        window = _latency(model)
+        models[model] = {**breaker.stats(), "samples": len(window), "p90_ms": round(window.quantile(0.9) * 1000, 1)}
+    return {**_hedger.stats(), "models": models}
+
+
+@lru_cache(maxsize=1)
+def _sql_cache() -> TieredCache:
+    # Shared across worker processes, so a prompt costs one LLM call per host rather than per worker.
+    local = LRUCache(
+        max_entries=get_int_env(SQL_CACHE_MAX_ENTRIES_ENV, DEFAULT_SQL_CACHE_MAX_ENTRIES),
+        ttl_seconds=get_float_env(SQL_CACHE_TTL_SECONDS_ENV, DEFAULT_SQL_CACHE_TTL_SECONDS),
+    )
+    return TieredCache(local, "sql", encode_value, decode_value)
+
+
+@lru_cache(maxsize=1)
+def _llm_gate() -> AdmissionGate:
+    # Caps concurrent Responses API calls so a spike queues here, boundedly, not behind rate limits.
+    return AdmissionGate(
+        "llm",
+        limit=get_int_env(LLM_MAX_CONCURRENCY_ENV, DEFAULT_LLM_MAX_CONCURRENCY),
+        max_queue=get_int_env(LLM_MAX_QUEUE_ENV, DEFAULT_LLM_MAX_QUEUE),
+    )
+
+
+@lru_cache(maxsize=1)
+def prompt_fingerprint() -> str:
+    # Any change to the grammar or instructions produces new cache keys, so stale SQL is never served.
+    digest = hashlib.sha256()
+    digest.update(sql_grammar().encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(SYSTEM_INSTRUCTIONS.encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def normalize_prompt(prompt: str) -> str:
+    text = _PUNCTUATION_RE.sub(" ", prompt.lower())
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def _cache_key(prompt: str, model: str) -> tuple[str, str, str]:
+    return normalize_prompt(prompt), model, prompt_fingerprint()
+
+
+_generation_flight = SingleFlight("generation")
+
+
+def sql_cache_stats() -> dict:
+    return _sql_cache().stats()
+
+
+def generation_flight_stats() -> dict:
+    return _generation_flight.stats()
+
+
+def seed_sql_cache(prompt: str, sql: str) -> None:
+    # Used by startup warm-up; SQL from before a grammar change fails here and is not seeded.
+    validate_sql(sql)
+    _sql_cache().set(_cache_key(prompt.strip(), configured_model()), sql)
+
+
 def _custom_tool() -> dict:
     # The tool's plaintext input is CFG-constrained to our SQL grammar.
     return {
@@ -67,35 +228,183 @@ def _custom_tool() -> dict:
     }
 
 
-def _extract_sql(response) -> str:
+def _with_examples(text: str, examples: list[Neighbor]) -> str:
+    # Nearest past prompts go in as worked examples; the grammar still constrains the answer.
+    if not examples:
+        return text
+    shown = "\n\n".join(f"Request: {example.prompt}\nSQL: {example.sql}" for example in examples)
+    return f"Similar past requests:\n\n{shown}\n\nRequest: {text}"
+
+
+class _MalformedStream(Exception):
+    pass
+
+
+async def _stream_sql(client: "AsyncOpenAI", model: str, text: str) -> str:
+    # Tool call input is validated as it arrives, so malformed output aborts the stream at the first
+    # bad token instead of after the full response, and a complete stream needs no second parse.
+    validator = StreamingValidator()
     # Only accept the constrained tool call input; do not fall back to free-form text.
-    for item in response.output:
-        if getattr(item, "type", None) == "custom_tool_call" and getattr(item, "name", "") == TOOL_NAME:
-            return item.input
-    raise RuntimeError("No custom tool call was returned")
+    tool_items: set[str] = set()
+    stream = await client.responses.create(
+        model=model,
+        input=text,
+        instructions=SYSTEM_INSTRUCTIONS,
+        tools=[_custom_tool()],
+        # Force a tool call so we always get CFG-constrained SQL back.
+        tool_choice={"type": "custom", "name": TOOL_NAME},
+        temperature=0,
+        max_output_tokens=256,
+        stream=True,
+    )
+    try:
+        async for event in stream:
+            if event.type == "response.output_item.added":
+                item = event.item
+                if getattr(item, "type", None) == "custom_tool_call" and getattr(item, "name", "") == TOOL_NAME:
+                    tool_items.add(item.id)
+            elif event.type == "response.custom_tool_call_input.delta" and event.item_id in tool_items:
+                try:
+                    validator.feed(event.delta)
+                except ValueError as exc:
+                    raise _MalformedStream(validator.text) from exc
+            elif event.type == "response.completed":
+                usage = event.response.usage
+                if usage is not None:
+                    record_tokens(usage.input_tokens, usage.output_tokens)
+            elif event.type in ("response.failed", "response.incomplete", "error"):
+                raise RuntimeError(f"Responses API stream ended with {event.type}")
+    finally:
+        # Closing mid-stream drops the connection, which stops generation on the server side.
+        await stream.close()
+    if not tool_items:
+        raise RuntimeError("No custom tool call was returned")
+    with stage("validation"):
+        try:
+            validator.finish()
+        except ValueError as exc:
+            raise _MalformedStream(validator.text) from exc
+    return validator.text.strip()
 
 
-def generate_sql(prompt: str) -> str:
-    text = prompt.strip()
-    if not text:
-        raise ValueError("prompt is required")
+async def _generate_with(client: "AsyncOpenAI", model: str, text: str) -> str:
+    retries = get_int_env(STREAM_RETRIES_ENV, DEFAULT_STREAM_RETRIES)
+    attempt = 0
+    while True:
+        try:
+            with stage("llm"):
+                return await _stream_sql(client, model, text)
+        except _MalformedStream as exc:
+            logger.warning("Aborted SQL stream outside the grammar", extra={"attempt": attempt, "sql": str(exc)})
+            if attempt >= retries:
+                raise ValueError("SQL does not match the allowed grammar") from exc
+            attempt += 1
+
+
+async def _attempt(client: "AsyncOpenAI", model: str, text: str) -> tuple[str, str]:
+    # One model's call, feeding its breaker and latency window. A call cancelled because it lost the
+    # race still records its elapsed time, a lower bound, so slow models do not look fast.
+    breaker = _breaker(model)
+    started = time.perf_counter()
+    try:
+        sql = await _generate_with(client, model, text)
+    except asyncio.CancelledError:
+        _latency(model).add(time.perf_counter() - started)
+        breaker.release()
+        raise
+    except Exception:
+        breaker.failure()
+        raise
+    _latency(model).add(time.perf_counter() - started)
+    breaker.success()
+    return sql, model
+
+
+async def _hedged_generate(client: "AsyncOpenAI", primary: str, text: str) -> tuple[str, str]:
+    # Routes around a model whose breaker is open, hedges a slow call, and fails over on an error.
+    # The first grammar-valid SQL wins; the other call is cancelled, which closes its stream.
+    fallback = _fallback_model(primary)
+    models = [primary] + ([fallback] if fallback else [])
+    first = next((model for model in models if _breaker(model).allow()), None)
+    if first is None:
+        raise Overloaded("llm", CIRCUIT_OPEN, min(_breaker(model).retry_after() for model in models))
+    attempted = [first]
+
+    def second(failover: bool):
+        other = next((model for model in models if model != first), None)
+        if other is not None and _breaker(other).allow():
+            target = other
+        elif not failover and _breaker(first).state == CLOSED:
+            # No fallback to go to: hedge with the same model, which usually lands on a faster replica.
+            target = first
+        else:
+            return None
+        attempted.append(target)
+        logger.info("Hedging SQL generation" if not failover else "Failing over SQL generation",
+                    extra={"from": first, "to": target})
+        return lambda: _attempt(client, target, text)
+
+    try:
+        async with asyncio.timeout(budget(get_float_env(TIMEOUT_SECONDS_ENV, DEFAULT_TIMEOUT_SECONDS))):
+            return await _hedger.race(lambda: _attempt(client, first, text), second, _hedge_delay(first))
+    except TimeoutError:
+        # A model that hangs never raises on its own; count the timeout against every model still running.
+        for model in attempted:
+            _breaker(model).failure()
+        raise
+
+
+async def _generate_uncached(text: str, model: str, cache_key: tuple[str, str, str]) -> str:
+    index = prompt_index()
+    normalized, _, fingerprint = cache_key
+    with stage("index"):
+        reused = index.near_duplicate(normalized, reuse_similarity(), model, fingerprint)
+    if reused is not None:
+        try:
+            # The entry matched this grammar's fingerprint, but the file may have been edited by hand.
+            with stage("validation"):
+                validate_sql(reused.sql)
+        except ValueError:
+            reused = None
+    if reused is not None:
+        logger.info("Reused SQL from prompt index", extra={"similarity": reused.similarity})
+        _sql_cache().set(cache_key, reused.sql)
+        return reused.sql
+    with stage("index"):
+        examples = index.neighbors(normalized, few_shot_count()) if few_shot_count() else []
     client = _client()
-    model = _model_name()
     try:
-        response = client.responses.create(
-            model=model,
-            input=text,
-            instructions=SYSTEM_INSTRUCTIONS,
-            tools=[_custom_tool()],
-            # Force a tool call so we always get CFG-constrained SQL back.
-            tool_choice={"type": "custom", "name": TOOL_NAME},
-            temperature=0,
-            max_output_tokens=256,
-        )
+        # Queue time counts against the request's deadline; the stage timeout starts once admitted.
+        async with _llm_gate().admit():
+            sql, model = await _hedged_generate(client, model, _with_examples(text, examples))
+    except (ValueError, Overloaded):
+        raise
     except Exception:
         logger.exception("OpenAI Responses API call failed")
         raise
-    sql = _extract_sql(response)
-    validate_sql(sql)
     logger.info("Generated SQL via CFG", extra={"tool": TOOL_NAME, "model": model})
+    # Only validated SQL is cached, so a hit can skip both the LLM call and re-validation.
+    _sql_cache().set(cache_key, sql)
+    await index.add(normalized, sql, *cache_key[1:])
     return sql
+
+
+async def generate_sql(prompt: str) -> str:
+    text = prompt.strip()
+    if not text:
+        raise ValueError("prompt is required")
+    # Common question shapes are parsed deterministically; only the rest need the LLM.
+    with stage("intent"):
+        intent = answer_without_llm(text)
+    record(intent is not None)
+    if intent is not None:
+        logger.info("Generated SQL via intent parser", extra={"confidence": intent.confidence})
+        return intent.sql
+    model = _model_name()
+    cache_key = _cache_key(text, model)
+    cached = await _sql_cache().get(cache_key)
+    if cached is not None:
+        logger.info("SQL cache hit", extra={"model": model})
+        return cached
+    # Identical normalized prompts arriving together share one LLM call.
+    return await _generation_flight.run(cache_key, lambda: _generate_uncached(text, model, cache_key))
@@ -1,9 +1,26 @@
+import hashlib
+import logging
+import os
+import sys
 from functools import lru_cache
+from pathlib import Path
 
-from lark import Lark, UnexpectedInput
+import lark
+from lark import Lark, Token, Tree, UnexpectedCharacters, UnexpectedInput
+from lark.lexer import LexerState, LexerThread
+from lark.utils import TextSlice
 
+from .config import get_env
 from .schema import COLUMNS, DATABASE, NUMERIC_COLUMNS, TABLE
 
+logger = logging.getLogger(__name__)
+
+# Building the LALR tables takes ~70ms, loading them ~8ms; they are pickled to disk (Lark's own cache format) under a
+# name derived from the grammar, lark and Python versions, so a cold worker loads them instead.
+GRAMMAR_CACHE_DIR_ENV = "GRAMMAR_CACHE_DIR"
+DEFAULT_GRAMMAR_CACHE_DIR = Path(__file__).resolve().parent.parent / ".grammar_cache"
+NO_CACHE = "off"
+
 
 # Grammar is generated from schema constants to keep the model constraint and server-side validation in sync.
 def _token(name: str) -> str:
@@ -57,11 +74,11 @@ comparison: column comparator literal
 
 literal_list: literal ("," literal)*
 
-comparator: "="
-          | ">="
-          | "<="
-          | ">"
-          | "<"
+comparator: EQ
+          | GE
+          | LE
+          | GT
+          | LT
 
 limit_clause: LIMIT INT
 
@@ -112,6 +129,11 @@ AVG: "AVG"
 MIN: "MIN"
 MAX: "MAX"
 AND: "AND"
+EQ: "="
+GE: ">="
+LE: "<="
+GT: ">"
+LT: "<"
 DEFAULT_DB: "{DATABASE}"
 BODY_PERFORMANCE_TABLE: "{TABLE}"
 {TOKEN_DEFS}
@@ -127,16 +149,116 @@ def sql_grammar() -> str:
     return _SQL_GRAMMAR
 
 
+def grammar_hash() -> str:
+    digest = hashlib.sha256()
+    digest.update(_SQL_GRAMMAR.encode("utf-8"))
+    digest.update(f"\0{lark.__version__}\0{sys.version_info[:2]}".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def _grammar_cache_path() -> Path | None:
+    value = get_env(GRAMMAR_CACHE_DIR_ENV)
+    if value is not None and value.strip().lower() == NO_CACHE:
+        return None
+    directory = Path(value) if value else DEFAULT_GRAMMAR_CACHE_DIR
+    return directory / f"sql_grammar-{grammar_hash()}.lark"
+
+
+def _build_parser(cache: str | bool = False) -> Lark:
+    return Lark(_SQL_GRAMMAR, start="start", parser="lalr", cache=cache)
+
+
 @lru_cache(maxsize=1)
 def _parser() -> Lark:
-    return Lark(_SQL_GRAMMAR, start="start", parser="lalr")
+    path = _grammar_cache_path()
+    if path is None:
+        return _build_parser()
+    if path.exists():
+        return _build_parser(str(path))
+    # Written under a private name and renamed, so a worker never loads another's partial file.
+    staging = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        parser = _build_parser(str(staging))
+        os.replace(staging, path)
+    except OSError:
+        logger.warning("Could not persist grammar tables", extra={"path": str(path)}, exc_info=True)
+        staging.unlink(missing_ok=True)
+        return _build_parser()
+    return parser
+
+
+def load_parser() -> None:
+    # Called during startup warm-up so the first validation does not build or load the tables.
+    _parser()
+
 
+def parser_stats() -> dict:
+    path = _grammar_cache_path()
+    return {"grammar_hash": grammar_hash(), "cache_path": str(path) if path else None,
+            "cached": bool(path and path.exists())}
 
-def validate_sql(sql: str) -> None:
+
+def validate_sql(sql: str) -> Tree:
     text = sql.strip()
     if not text:
         raise ValueError("sql is required")
     try:
-        _parser().parse(text)
+        return _parser().parse(text)
     except UnexpectedInput as exc:
         raise ValueError("SQL does not match the allowed grammar") from exc
+
+
+class StreamingValidator:
+    # Validates SQL as it streams in, by feeding tokens to the LALR parser's interactive state.
+    # Only text before the last whitespace is lexed, since a trailing word may still grow ("ORD" ->
+    # "ORDER", "1.5" -> "1.5e3"); WS_INLINE cannot occur inside a token except in a quoted string,
+    # and an unterminated quote is left for the next delta. finish() feeds the rest and returns the
+    # tree, so a streamed statement never needs a second parse.
+    __slots__ = ("_interactive", "_text", "_offset")
+
+    def __init__(self) -> None:
+        self._interactive = _parser().parse_interactive("")
+        self._text = ""
+        self._offset = 0
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    def feed(self, delta: str) -> None:
+        # Raises ValueError at the first token the grammar cannot accept.
+        self._text += delta
+        if not self._offset:
+            # Leading whitespace (including newlines) is stripped, as validate_sql does.
+            self._text = self._text.lstrip()
+        boundary = max(self._text.rfind(" "), self._text.rfind("\t"))
+        if boundary > self._offset:
+            self._advance(boundary, final=False)
+
+    def finish(self) -> Tree:
+        text = self._text.rstrip()
+        if not text:
+            raise ValueError("sql is required")
+        self._advance(len(text), final=True)
+        try:
+            return self._interactive.feed_eof()
+        except UnexpectedInput as exc:
+            raise ValueError("SQL does not match the allowed grammar") from exc
+
+    def _advance(self, end: int, final: bool) -> None:
+        interactive = self._interactive
+        thread = LexerThread(interactive.lexer_thread.lexer, LexerState(TextSlice(self._text, self._offset, end)))
+        token: Token
+        try:
+            for token in thread.lex(interactive.parser_state):
+                interactive.feed_token(token)
+                self._offset = token.end_pos
+        except UnexpectedCharacters as exc:
+            remainder = self._text[exc.pos_in_stream:end]
+            if final or not remainder.startswith("'") or "'" in remainder[1:]:
+                raise ValueError("SQL does not match the allowed grammar") from exc
+        except UnexpectedInput as exc:
+            raise ValueError("SQL does not match the allowed grammar") from exc
+        else:
+            self._offset = end
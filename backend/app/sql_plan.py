@@ -0,0 +1,233 @@
+from dataclasses import dataclass
+from typing import Hashable
+
+from lark import Token, Transformer, Tree
+
+from .schema import DATASET
+from .sql_grammar import validate_sql
+
+# Structured view of a grammar-valid statement, built from the Lark parse tree so callers never re-parse SQL text.
+
+Literal = str | float
+
+
+@dataclass(frozen=True)
+class SelectItem:
+    function: str | None
+    column: str
+    alias: str | None = None
+
+    @property
+    def is_aggregate(self) -> bool:
+        return self.function is not None
+
+    @property
+    def label(self) -> str:
+        # Mirrors the column name ClickHouse reports for the expression.
+        if self.alias:
+            return self.alias
+        if self.function is None:
+            return self.column
+        return f"{self.function.lower()}({self.column})"
+
+
+@dataclass(frozen=True)
+class Comparison:
+    column: str
+    operator: str
+    values: tuple[Literal, ...]
+
+
+@dataclass(frozen=True)
+class OrderItem:
+    name: str
+    descending: bool = False
+
+
+@dataclass(frozen=True)
+class Statement:
+    items: tuple[SelectItem, ...]
+    conditions: tuple[Comparison, ...] = ()
+    group_by: tuple[str, ...] = ()
+    order_by: tuple[OrderItem, ...] = ()
+    limit: int | None = None
+    # Never produced by the grammar; set by pagination.
+    offset: int = 0
+
+    @property
+    def labels(self) -> list[str]:
+        return [item.label for item in self.items]
+
+    @property
+    def has_aggregates(self) -> bool:
+        return any(item.is_aggregate for item in self.items)
+
+
+class _StatementBuilder(Transformer):
+    def start(self, children):
+        return children[0]
+
+    def select_stmt(self, children):
+        fields = {"items": (), "conditions": (), "group_by": (), "order_by": (), "limit": None}
+        for child in children:
+            if isinstance(child, tuple) and len(child) == 2 and child[0] in fields:
+                fields[child[0]] = child[1]
+        return Statement(**fields)
+
+    def select_list(self, children):
+        return ("items", tuple(children))
+
+    def select_item(self, children):
+        item = children[0]
+        if isinstance(item, str):
+            return SelectItem(function=None, column=item)
+        return item
+
+    def agg_expr(self, children):
+        return children[0]
+
+    def _aggregate(self, children):
+        function = str(children[0])
+        column = children[1]
+        alias = children[2] if len(children) > 2 else None
+        return SelectItem(function=function, column=column, alias=alias)
+
+    sum_expr = avg_expr = min_expr = max_expr = count_expr = _aggregate
+
+    def alias(self, children):
+        return str(children[-1])
+
+    def column(self, children):
+        return str(children[0])
+
+    numeric_column = column
+
+    def column_list(self, children):
+        return tuple(children)
+
+    def where_clause(self, children):
+        return ("conditions", children[-1])
+
+    def condition(self, children):
+        return tuple(child for child in children if isinstance(child, Comparison))
+
+    def comparison(self, children):
+        column = children[0]
+        if isinstance(children[1], Token) and children[1].type == "IN":
+            return Comparison(column=column, operator="IN", values=tuple(children[2]))
+        return Comparison(column=column, operator=children[1], values=(children[2],))
+
+    def comparator(self, children):
+        return str(children[0])
+
+    def literal_list(self, children):
+        return tuple(children)
+
+    def literal(self, children):
+        return children[0]
+
+    def string_literal(self, children):
+        return str(children[0])[1:-1]
+
+    def number_literal(self, children):
+        return float(children[0])
+
+    def group_by_clause(self, children):
+        return ("group_by", children[-1])
+
+    def order_by_clause(self, children):
+        return ("order_by", children[-1])
+
+    def order_list(self, children):
+        return tuple(children)
+
+    def order_item(self, children):
+        descending = len(children) > 1 and children[1] == "DESC"
+        return OrderItem(name=str(children[0]), descending=descending)
+
+    def order_dir(self, children):
+        return str(children[0])
+
+    def limit_clause(self, children):
+        return ("limit", int(children[-1]))
+
+    def table_name(self, children):
+        return ("table", None)
+
+
+def statement_from_tree(tree: Tree) -> Statement:
+    return _StatementBuilder().transform(tree)
+
+
+def parse_statement(sql: str) -> Statement:
+    return statement_from_tree(validate_sql(sql))
+
+
+def _literal_key(value: Literal) -> tuple[int, Literal]:
+    return (0, value) if isinstance(value, float) else (1, value)
+
+
+def _canonical_comparison(comparison: Comparison) -> tuple:
+    values = tuple(sorted(set(comparison.values), key=_literal_key))
+    operator = comparison.operator
+    if operator == "IN" and len(values) == 1:
+        operator = "="
+    return (comparison.column, operator, values)
+
+
+def canonical_key(statement: Statement) -> Hashable:
+    # Aliases, conjunct order, IN-list order and GROUP BY order do not change the result set,
+    # so they are folded away; ORDER BY references to aliases are resolved to their expressions.
+    expressions = tuple((item.function, item.column) for item in statement.items)
+    aliases = {item.alias: (item.function, item.column) for item in statement.items if item.alias}
+    order_by = tuple(
+        (aliases.get(order.name, (None, order.name)), order.descending)
+        for order in statement.order_by
+    )
+    conditions = tuple(sorted({_canonical_comparison(c) for c in statement.conditions}, key=repr))
+    return (
+        expressions,
+        conditions,
+        tuple(sorted(set(statement.group_by))),
+        order_by,
+        statement.limit,
+        statement.offset,
+    )
+
+
+def _render_literal(value: Literal) -> str:
+    if isinstance(value, str):
+        # The grammar's string literals cannot contain quotes, so no escaping is needed.
+        return f"'{value}'"
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _render_item(item: SelectItem) -> str:
+    expression = item.column if item.function is None else f"{item.function}({item.column})"
+    return f"{expression} AS {item.alias}" if item.alias else expression
+
+
+def _render_comparison(comparison: Comparison) -> str:
+    if comparison.operator == "IN":
+        values = ", ".join(_render_literal(value) for value in comparison.values)
+        return f"{comparison.column} IN ({values})"
+    return f"{comparison.column} {comparison.operator} {_render_literal(comparison.values[0])}"
+
+
+def render_sql(statement: Statement) -> str:
+    # ClickHouse SQL for a statement, including rewrites (such as OFFSET) the grammar itself does not allow.
+    parts = [f"SELECT {', '.join(_render_item(item) for item in statement.items)} FROM {DATASET}"]
+    if statement.conditions:
+        parts.append("WHERE " + " AND ".join(_render_comparison(c) for c in statement.conditions))
+    if statement.group_by:
+        parts.append("GROUP BY " + ", ".join(statement.group_by))
+    if statement.order_by:
+        parts.append(
+            "ORDER BY "
+            + ", ".join(f"{order.name} DESC" if order.descending else order.name for order in statement.order_by)
+        )
+    if statement.limit is not None:
+        parts.append(f"LIMIT {statement.limit}")
+    if statement.offset:
+        parts.append(f"OFFSET {statement.offset}")
+    return " ".join(parts)
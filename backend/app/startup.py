@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+from .clickhouse_client import warm_pool
+from .config import get_float_env, get_int_env
+from .local_engine import get_dataset
+from .prompt_index import prompt_index
+from .query_executor import AUTO_BACKEND, CLICKHOUSE_BACKEND, query_backend
+from .sql_generation import open_client
+from .sql_grammar import load_parser
+
+logger = logging.getLogger(__name__)
+
+# Everything the first request would otherwise pay for on a cold worker: the grammar tables, the
+# openai import and client, ClickHouse TLS connections, the dataset and the prompt index. The lifespan
+# hook waits up to STARTUP_WARM_UP_SECONDS before serving; anything slower finishes in the background
+# and /api/ready reports 503 until it has.
+WARM_UP_SECONDS_ENV = "STARTUP_WARM_UP_SECONDS"
+DEFAULT_WARM_UP_SECONDS = 10.0
+CLICKHOUSE_CONNECTIONS_ENV = "STARTUP_CLICKHOUSE_CONNECTIONS"
+DEFAULT_CLICKHOUSE_CONNECTIONS = 2
+
+# Step name -> {"ok", "ms", "error"}; a step that failed is still done, the request path retries it.
+_steps: Dict[str, Dict[str, Any]] = {}
+_tasks: List[asyncio.Task] = []
+
+
+async def _step(name: str, work: Callable[[], Awaitable[Any]]) -> None:
+    started = time.perf_counter()
+    try:
+        await work()
+        _steps[name] = {"ok": True}
+    except Exception as exc:
+        logger.warning("Warm-up step failed", extra={"step": name}, exc_info=True)
+        _steps[name] = {"ok": False, "error": str(exc)}
+    _steps[name]["ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+
+async def _warm_up() -> None:
+    started = time.perf_counter()
+    steps = [
+        _step("grammar", lambda: asyncio.to_thread(load_parser)),
+        _step("openai", open_client),
+        _step("prompt_index", lambda: asyncio.to_thread(prompt_index)),
+    ]
+    backend = query_backend()
+    if backend in (CLICKHOUSE_BACKEND, AUTO_BACKEND):
+        connections = get_int_env(CLICKHOUSE_CONNECTIONS_ENV, DEFAULT_CLICKHOUSE_CONNECTIONS)
+        if connections > 0:
+            steps.append(_step("clickhouse", lambda: warm_pool(connections)))
+    if backend != CLICKHOUSE_BACKEND:
+        steps.append(_step("dataset", lambda: asyncio.to_thread(get_dataset)))
+    await asyncio.gather(*steps)
+    logger.info("Warm-up finished", extra={"ms": round((time.perf_counter() - started) * 1000, 1)})
+
+
+async def start_warm_up() -> None:
+    task = asyncio.get_running_loop().create_task(_warm_up(), name="startup-warm-up")
+    _tasks.append(task)
+    timeout = get_float_env(WARM_UP_SECONDS_ENV, DEFAULT_WARM_UP_SECONDS)
+    done, _ = await asyncio.wait({task}, timeout=max(timeout, 0.0))
+    if not done:
+        logger.warning("Serving before warm-up finished", extra={"timeout": timeout})
+
+
+async def stop_warm_up() -> None:
+    for task in _tasks:
+        task.cancel()
+    for task in _tasks:
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    _tasks.clear()
+
+
+def readiness() -> Dict[str, Any]:
+    return {"ready": bool(_tasks) and all(task.done() for task in _tasks), "steps": dict(_steps)}
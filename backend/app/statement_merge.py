@@ -0,0 +1,58 @@
+from typing import Any, Dict, Hashable, List, Sequence
+
+import numpy as np
+
+from .local_engine import LocalResult, check_grouping, order_and_project
+from .sql_plan import SelectItem, Statement, canonical_key
+
+# Aggregate statements that share filters and grouping differ only in which aggregates they select,
+# so a batch can fetch all of them in one query and split the rows back out per statement.
+
+
+def merge_key(statement: Statement) -> Hashable | None:
+    # None for statements that cannot be merged: row-level selects may be large and would have to be
+    # re-sorted in Python.
+    if not statement.has_aggregates:
+        return None
+    try:
+        check_grouping(statement)
+    except ValueError:
+        return None
+    _, conditions, group_by, _, _, _ = canonical_key(statement)
+    return (conditions, group_by)
+
+
+def _expressions(statement: Statement) -> List[tuple[str | None, str]]:
+    return [(None, column) for column in statement.group_by] + [
+        (item.function, item.column) for item in statement.items
+    ]
+
+
+def merged_statement(statements: Sequence[Statement]) -> Statement:
+    # One select item per distinct expression across the group. Columns are matched by position, and
+    # each statement's own ORDER BY and LIMIT are applied when splitting.
+    expressions = dict.fromkeys(expr for statement in statements for expr in _expressions(statement))
+    items = tuple(SelectItem(function=function, column=column) for function, column in expressions)
+    first = statements[0]
+    return Statement(items=items, conditions=first.conditions, group_by=first.group_by)
+
+
+def _as_array(values: Sequence[Any]) -> np.ndarray:
+    if any(isinstance(value, str) for value in values):
+        return np.array(values, dtype=object)
+    return np.array([np.nan if value is None else value for value in values])
+
+
+def split_merged(statement: Statement, merged: Statement, rows: Sequence[tuple]) -> LocalResult:
+    # Projects one statement's columns out of the merged rows and applies its ORDER BY / LIMIT / OFFSET.
+    positions = {(item.function, item.column): index for index, item in enumerate(merged.items)}
+    columns = list(zip(*rows)) if rows else [() for _ in merged.items]
+
+    def column(function: str | None, name: str) -> np.ndarray:
+        return _as_array(columns[positions[(function, name)]])
+
+    fallback: Dict[str, np.ndarray] = {name: column(None, name) for name in statement.group_by}
+    outputs = {
+        label: column(item.function, item.column) for item, label in zip(statement.items, statement.labels)
+    }
+    return order_and_project(statement, outputs, fallback, len(rows))
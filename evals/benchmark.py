@@ -0,0 +1,572 @@
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import platform
+import random
+import re
+import resource
+import socket
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Dict, List
+
+import httpx
+
+logger = logging.getLogger("evals")
+
+# Offline throughput benchmark: drives /api/query at several concurrency levels with OpenAI replaced by a
+# replay stand-in (recorded tool-call outputs plus configurable latency) and ClickHouse replaced by the
+# embedded NumPy engine, optionally behind simulated network latency. Writes a JSON report per run so
+# results can be compared between commits with --compare.
+ROOT_DIR = Path(__file__).resolve().parent.parent
+BACKEND_DIR = ROOT_DIR / "backend"
+REPORT_VERSION = 1
+
+METRICS = (
+    ("height_cm", "height"),
+    ("weight_kg", "weight"),
+    ("body_fat_pct", "body fat"),
+    ("grip_force", "grip force"),
+    ("situps_count", "sit-ups"),
+    ("broad_jump_cm", "broad jump"),
+    ("systolic", "systolic pressure"),
+)
+FUNCTIONS = (("AVG", "Average"), ("MAX", "Maximum"), ("MIN", "Minimum"))
+FILTERS = (
+    ("", ""),
+    (" WHERE gender = 'F'", " for women"),
+    (" WHERE gender = 'M'", " for men"),
+    (" WHERE fitness_class = 'A'", " in fitness class A"),
+    (" WHERE age > 50", " for people over 50"),
+)
+GROUPS = (("", ""), ("gender", " by gender"), ("fitness_class", " by fitness class"))
+
+
+@dataclass(frozen=True)
+class Workload:
+    prompts: List[str]
+    # Prompt -> SQL the OpenAI stand-in returns for it.
+    recordings: Dict[str, str]
+
+
+def _synthetic_pairs() -> List[tuple[str, str]]:
+    table = "default.bodyPerformance"
+    pairs = []
+    for column, words in METRICS:
+        for function, verb in FUNCTIONS:
+            for where, filter_words in FILTERS:
+                for group, group_words in GROUPS:
+                    prompt = f"{verb} {words}{filter_words}{group_words}"
+                    if group:
+                        sql = f"SELECT {group}, {function}({column}) FROM {table}{where} GROUP BY {group} ORDER BY {group}"
+                    else:
+                        sql = f"SELECT {function}({column}) FROM {table}{where}"
+                    pairs.append((prompt, sql))
+        for limit in (5, 10):
+            # Top-N lists are outside the intent parser's shapes, so these always reach the LLM stand-in.
+            prompt = f"Show the {limit} people with the highest {words} and their age"
+            sql = f"SELECT age, {column} FROM {table} ORDER BY {column} DESC LIMIT {limit}"
+            pairs.append((prompt, sql))
+    return pairs
+
+
+def _skewed_sample(rng: random.Random, items: List[str], count: int) -> List[str]:
+    # Zipf-like: a few prompts are asked often and most rarely, as in real traffic.
+    weights = [1 / rank for rank in range(1, len(items) + 1)]
+    return rng.choices(items, weights=weights, k=count)
+
+
+def _read_prompts(path: Path) -> List[str]:
+    # JSONL with a "prompt" per line; a query log directory is read segment by segment.
+    files = sorted(path.glob("*.jsonl")) if path.is_dir() else [path]
+    prompts = []
+    for file in files:
+        with file.open(encoding="utf-8") as handle:
+            for line in handle:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(entry, dict) and str(entry.get("prompt", "")).strip():
+                    prompts.append(entry["prompt"].strip())
+    return prompts
+
+
+def _build_workload(args: argparse.Namespace) -> Workload:
+    rng = random.Random(args.seed)
+    pairs = _synthetic_pairs()
+    recordings = dict(pairs)
+    if args.recordings:
+        recordings.update(json.loads(Path(args.recordings).read_text(encoding="utf-8")))
+    if args.workload == "synthetic":
+        distinct = [prompt for prompt, _ in pairs]
+        rng.shuffle(distinct)
+        distinct = distinct[: args.distinct]
+    else:
+        distinct = list(dict.fromkeys(_read_prompts(Path(args.workload))))
+        if not distinct:
+            raise ValueError(f"No prompts found in {args.workload}")
+    return Workload(prompts=_skewed_sample(rng, distinct, args.requests), recordings=recordings)
+
+
+class ReplayStream:
+    # The streamed event sequence the backend reads: tool call added, input deltas, completed.
+    def __init__(self, sql: str, tool_name: str) -> None:
+        item = SimpleNamespace(type="custom_tool_call", name=tool_name, id="replay")
+        self.events = [SimpleNamespace(type="response.output_item.added", item=item)]
+        self.events += [
+            SimpleNamespace(type="response.custom_tool_call_input.delta", item_id="replay", delta=delta)
+            for delta in re.findall(r"\S+\s*", sql)
+        ]
+        self.events.append(SimpleNamespace(type="response.completed", response=SimpleNamespace(usage=None)))
+
+    def __aiter__(self) -> AsyncIterator[SimpleNamespace]:
+        return self._iterate()
+
+    async def _iterate(self) -> AsyncIterator[SimpleNamespace]:
+        for event in self.events:
+            yield event
+
+    async def close(self) -> None:
+        pass
+
+
+class ReplayModels:
+    # Stands in for AsyncOpenAI().models, which the startup warm-up calls to open the connection.
+    async def retrieve(self, model: str) -> SimpleNamespace:
+        return SimpleNamespace(id=model)
+
+
+@dataclass
+class LatencyModel:
+    # Milliseconds before the first streamed event. `tail_fraction` of calls take `tail_ms` instead,
+    # and `error_fraction` fail, to exercise hedging, failover and the circuit breaker.
+    median_ms: float
+    jitter_ms: float
+    dist: str = "uniform"
+    tail_fraction: float = 0.0
+    tail_ms: float = 0.0
+    error_fraction: float = 0.0
+
+    def sample(self) -> float:
+        if random.random() < self.tail_fraction:
+            return self.tail_ms
+        if self.dist == "lognormal":
+            # Jitter is read as the spread of a lognormal around the median.
+            sigma = math.log1p(self.jitter_ms / self.median_ms) if self.median_ms > 0 else 0.0
+            return random.lognormvariate(math.log(max(self.median_ms, 1e-3)), sigma)
+        return self.median_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+
+
+class ReplayResponses:
+    # Stands in for AsyncOpenAI().responses: streams the recorded custom tool call after a delay drawn
+    # from the latency model of the requested model.
+    def __init__(self, recordings: Dict[str, str], latencies: Dict[str, LatencyModel], tool_name: str) -> None:
+        self.recordings = recordings
+        self.latencies = latencies
+        self.tool_name = tool_name
+        self.calls = 0
+        self.misses = 0
+        self.errors = 0
+
+    async def create(self, *, input: str, model: str = "", **_: Any) -> ReplayStream:
+        self.calls += 1
+        latency = self.latencies.get(model) or self.latencies[""]
+        await asyncio.sleep(max(latency.sample(), 0.0) / 1000)
+        if random.random() < latency.error_fraction:
+            self.errors += 1
+            raise RuntimeError(f"Injected failure from {model or 'the LLM stand-in'}")
+        sql = self.recordings.get(input)
+        if sql is None:
+            self.misses += 1
+            raise RuntimeError(f"No recorded SQL for prompt {input!r}")
+        return ReplayStream(sql, self.tool_name)
+
+
+class RecordingResponses:
+    # Wraps the real client and keeps every prompt -> SQL it streams back, for later replay.
+    def __init__(self, responses: Any, tool_name: str) -> None:
+        self.responses = responses
+        self.tool_name = tool_name
+        self.recorded: Dict[str, str] = {}
+        self.calls = 0
+        self.misses = 0
+        self.errors = 0
+
+    async def create(self, *, input: str, **kwargs: Any) -> Any:
+        self.calls += 1
+        stream = await self.responses.create(input=input, **kwargs)
+        return RecordingStream(stream, lambda sql: self.recorded.__setitem__(input, sql))
+
+
+class RecordingStream:
+    def __init__(self, stream: Any, on_done: Any) -> None:
+        self.stream = stream
+        self.on_done = on_done
+
+    def __aiter__(self) -> AsyncIterator[Any]:
+        return self._iterate()
+
+    async def _iterate(self) -> AsyncIterator[Any]:
+        async for event in self.stream:
+            if event.type == "response.custom_tool_call_input.done":
+                self.on_done(event.input)
+            yield event
+
+    async def close(self) -> None:
+        await self.stream.close()
+
+
+def _configure_environment(args: argparse.Namespace) -> None:
+    # Must run before the backend is imported: several settings are read once and cached.
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark-replay")
+    os.environ["QUERY_BACKEND"] = "local" if args.backend == "local" else "clickhouse"
+    # Keep runs independent of each other and of anything on disk.
+    os.environ["QUERY_LOG_DIR"] = "off"
+    os.environ["PROMPT_INDEX_PATH"] = "off"
+    os.environ["SHARED_CACHE_PATH"] = "off"
+    # The replay stand-in is keyed on the bare prompt, so no few-shot examples are added to it.
+    os.environ["PROMPT_INDEX_FEW_SHOT"] = "0"
+    if args.fallback_model:
+        os.environ["OPENAI_FALLBACK_MODEL"] = args.fallback_model
+    if args.hedge_quantile is not None:
+        os.environ["LLM_HEDGE_QUANTILE"] = str(args.hedge_quantile)
+    if args.no_intent:
+        os.environ["INTENT_MIN_CONFIDENCE"] = "2"
+    if str(BACKEND_DIR) not in sys.path:
+        sys.path.insert(0, str(BACKEND_DIR))
+
+
+def _install_stubs(args: argparse.Namespace, workload: Workload):
+    from app import query_executor, sql_generation
+    from app.column_stats import collect_local
+    from app.config import get_float_env
+    from app.local_engine import execute_statement, get_dataset
+    from app.sql_plan import parse_statement
+
+    if args.record:
+        responses = RecordingResponses(sql_generation._client().responses, sql_generation.TOOL_NAME)
+    else:
+        primary = LatencyModel(
+            args.llm_latency_ms, args.llm_jitter_ms, args.llm_latency_dist,
+            args.llm_tail_fraction, args.llm_tail_ms, args.llm_error_fraction,
+        )
+        latencies = {"": primary}
+        if args.fallback_model:
+            latencies[args.fallback_model] = LatencyModel(
+                args.fallback_latency_ms, args.llm_jitter_ms * args.fallback_latency_ms / max(args.llm_latency_ms, 1.0),
+                args.llm_latency_dist,
+            )
+        responses = ReplayResponses(workload.recordings, latencies, sql_generation.TOOL_NAME)
+        quantile = get_float_env(sql_generation.HEDGE_QUANTILE_ENV, sql_generation.DEFAULT_HEDGE_QUANTILE)
+        if args.llm_tail_fraction and quantile >= 1 - args.llm_tail_fraction:
+            # The hedge threshold is a latency quantile: once stalls are at least 1 - quantile of calls,
+            # it is the stall latency itself and no stalled call is hedged.
+            logger.warning(
+                "Hedge quantile %s is not below 1 - --llm-tail-fraction; stalled calls will not be hedged", quantile
+            )
+    client = SimpleNamespace(responses=responses, models=ReplayModels())
+    sql_generation._client = lambda: client
+
+    if args.backend == "stub-clickhouse":
+        # ClickHouse stand-in: the embedded engine answers after a simulated round trip.
+        async def run_query(sql: str) -> tuple[List[str], List[tuple]]:
+            await asyncio.sleep(args.clickhouse_latency_ms / 1000)
+            result = execute_statement(parse_statement(sql))
+            return result.columns, result.rows
+
+        async def collect_clickhouse():
+            return collect_local(get_dataset())
+
+        query_executor.run_query = run_query
+        query_executor.collect_clickhouse = collect_clickhouse
+    return responses
+
+
+def _reset_caches() -> None:
+    from app import query_executor, sql_generation
+    from app.prompt_index import prompt_index
+
+    sql_generation._sql_cache.cache_clear()
+    query_executor._result_cache.cache_clear()
+    prompt_index.cache_clear()
+    # Hedge thresholds and breakers are learned per level too.
+    sql_generation._latencies.clear()
+    sql_generation._breakers.clear()
+
+
+def _parse_server_timing(header: str) -> Dict[str, float]:
+    timings = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip() == "dur":
+                timings[name] = float(value)
+    return timings
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def rank(q: float) -> float:
+        return round(ordered[min(int(q * len(ordered)), len(ordered) - 1)], 3)
+
+    return {
+        "p50": rank(0.5),
+        "p95": rank(0.95),
+        "p99": rank(0.99),
+        "max": round(ordered[-1], 3),
+        "mean": round(sum(ordered) / len(ordered), 3),
+    }
+
+
+def _max_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux and bytes on macOS.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+async def _run_level(client: httpx.AsyncClient, prompts: List[str], concurrency: int, fmt: str) -> Dict[str, Any]:
+    queue: asyncio.Queue = asyncio.Queue()
+    for prompt in prompts:
+        queue.put_nowait(prompt)
+    latencies: List[float] = []
+    stages: Dict[str, List[float]] = {}
+    statuses: Dict[str, int] = {}
+
+    async def worker() -> None:
+        while not queue.empty():
+            prompt = queue.get_nowait()
+            started = time.perf_counter()
+            try:
+                response = await client.post(f"/api/query?format={fmt}", json={"prompt": prompt})
+                status = str(response.status_code)
+            except httpx.HTTPError as exc:
+                logger.warning("Request failed: %s", exc)
+                status = "transport_error"
+                response = None
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+            if response is not None:
+                for name, ms in _parse_server_timing(response.headers.get("server-timing", "")).items():
+                    stages.setdefault(name, []).append(ms)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    errors = sum(count for status, count in statuses.items() if status != "200")
+    return {
+        "concurrency": concurrency,
+        "requests": len(prompts),
+        "errors": errors,
+        "statuses": statuses,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(prompts) / elapsed, 2) if elapsed else None,
+        "latency_ms": _percentiles(latencies),
+        "stage_ms": {name: _percentiles(values) for name, values in sorted(stages.items())},
+        "max_rss_mb": _max_rss_mb(),
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _run_levels(args: argparse.Namespace, workload: Workload, responses: Any) -> List[Dict[str, Any]]:
+    from app import sql_generation
+    from app.main import app
+
+    levels = []
+
+    async def run_all(client: httpx.AsyncClient) -> None:
+        for concurrency in args.concurrency:
+            if not args.warm:
+                _reset_caches()
+            calls_before = responses.calls
+            routing_before = sql_generation.llm_routing_stats()
+            level = await _run_level(client, workload.prompts, concurrency, args.format)
+            level["llm_calls"] = responses.calls - calls_before
+            routing = sql_generation.llm_routing_stats()
+            level["llm_routing"] = {
+                key: routing[key] - routing_before[key] for key in ("hedged", "second_wins", "failovers")
+            }
+            levels.append(level)
+            logger.info(
+                "concurrency=%d rps=%s p50=%sms p95=%sms errors=%d",
+                concurrency,
+                level["requests_per_second"],
+                level["latency_ms"].get("p50"),
+                level["latency_ms"].get("p95"),
+                level["errors"],
+            )
+
+    timeout = httpx.Timeout(args.timeout)
+    if args.uvicorn:
+        import uvicorn
+
+        port = _free_port()
+        server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        serving = asyncio.create_task(server.serve())
+        while not server.started:
+            if serving.done():
+                serving.result()
+            await asyncio.sleep(0.05)
+        try:
+            limits = httpx.Limits(max_connections=max(args.concurrency))
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=timeout, limits=limits) as client:
+                await run_all(client)
+        finally:
+            server.should_exit = True
+            await serving
+    else:
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=timeout) as client:
+                await run_all(client)
+    return levels
+
+
+def _git_commit() -> str | None:
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def _compare(current: Dict[str, Any], baseline_path: Path) -> None:
+    baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+    previous = {level["concurrency"]: level for level in baseline.get("levels", [])}
+    print(f"Compared with {baseline_path} ({baseline.get('commit') or 'unknown commit'}):")
+    for level in current["levels"]:
+        before = previous.get(level["concurrency"])
+        if before is None:
+            continue
+        rps_before, rps_after = before["requests_per_second"], level["requests_per_second"]
+        p95_before, p95_after = before["latency_ms"].get("p95"), level["latency_ms"].get("p95")
+        rps_change = f"{(rps_after / rps_before - 1) * 100:+.1f}%" if rps_before else "n/a"
+        p95_change = f"{(p95_after / p95_before - 1) * 100:+.1f}%" if p95_before else "n/a"
+        print(
+            f"  concurrency {level['concurrency']}: rps {rps_before} -> {rps_after} ({rps_change}), "
+            f"p95 {p95_before}ms -> {p95_after}ms ({p95_change})"
+        )
+
+
+def _concurrency_levels(value: str) -> List[int]:
+    try:
+        levels = [int(part) for part in value.split(",") if part.strip()]
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError("concurrency must be a comma-separated list of integers") from exc
+    if not levels or any(level < 1 for level in levels):
+        raise argparse.ArgumentTypeError("concurrency levels must be at least 1")
+    return levels
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--workload",
+        default="synthetic",
+        help="'synthetic', a JSONL file with a \"prompt\" per line, or a query log directory",
+    )
+    parser.add_argument("--requests", type=int, default=200, help="Requests per concurrency level")
+    parser.add_argument("--distinct", type=int, default=60, help="Distinct prompts in the synthetic mix")
+    parser.add_argument("--concurrency", type=_concurrency_levels, default=[1, 4, 16, 64])
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--format", choices=("rows", "columnar"), default="rows")
+    parser.add_argument(
+        "--backend",
+        choices=("local", "stub-clickhouse"),
+        default="local",
+        help="'local' uses the embedded engine; 'stub-clickhouse' adds --clickhouse-latency-ms per query",
+    )
+    parser.add_argument("--clickhouse-latency-ms", type=float, default=20.0)
+    parser.add_argument("--llm-latency-ms", type=float, default=800.0)
+    parser.add_argument("--llm-jitter-ms", type=float, default=200.0)
+    parser.add_argument("--llm-latency-dist", choices=("uniform", "lognormal"), default="uniform")
+    parser.add_argument("--llm-tail-fraction", type=float, default=0.0, help="Share of LLM calls that stall")
+    parser.add_argument("--llm-tail-ms", type=float, default=5000.0, help="Latency of a stalled LLM call")
+    parser.add_argument("--llm-error-fraction", type=float, default=0.0, help="Share of primary LLM calls that fail")
+    parser.add_argument("--fallback-model", help="Sets OPENAI_FALLBACK_MODEL; the stand-in answers it too")
+    parser.add_argument("--fallback-latency-ms", type=float, default=400.0)
+    parser.add_argument("--hedge-quantile", type=float, help="Sets LLM_HEDGE_QUANTILE for the run")
+    parser.add_argument("--recordings", help="JSON object of prompt -> SQL added to the replay recordings")
+    parser.add_argument(
+        "--record",
+        help="Call the real OpenAI API and write the prompt -> SQL it returns to this file for later replay",
+    )
+    parser.add_argument("--no-intent", action="store_true", help="Send every prompt to the LLM stand-in")
+    parser.add_argument("--warm", action="store_true", help="Keep caches between levels instead of clearing them")
+    parser.add_argument("--uvicorn", action="store_true", help="Serve over HTTP with uvicorn instead of in-process")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--output", help="Write the JSON report here (default: stdout)")
+    parser.add_argument("--compare", help="Earlier JSON report to compare throughput and p95 against")
+    args = parser.parse_args()
+    if args.requests < 1 or args.distinct < 1:
+        parser.error("--requests and --distinct must be at least 1")
+    return args
+
+
+def main() -> int:
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    # One line per request would drown the per-level summaries.
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("app").setLevel(logging.WARNING)
+    args = _parse_args()
+    _configure_environment(args)
+    workload = _build_workload(args)
+    logger.info(
+        "Benchmarking %d requests per level over %d distinct prompts",
+        len(workload.prompts),
+        len(set(workload.prompts)),
+    )
+    responses = _install_stubs(args, workload)
+    levels = asyncio.run(_run_levels(args, workload, responses))
+
+    if args.record:
+        Path(args.record).write_text(json.dumps(responses.recorded, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+        logger.info("Recorded %d prompt -> SQL pairs to %s", len(responses.recorded), args.record)
+    report = {
+        "version": REPORT_VERSION,
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "settings": {
+            key: getattr(args, key)
+            for key in (
+                "workload", "requests", "distinct", "seed", "format", "backend", "clickhouse_latency_ms",
+                "llm_latency_ms", "llm_jitter_ms", "llm_latency_dist", "llm_tail_fraction", "llm_tail_ms",
+                "llm_error_fraction", "fallback_model", "fallback_latency_ms", "hedge_quantile", "no_intent", "warm",
+                "uvicorn",
+            )
+        },
+        "llm_replay_misses": responses.misses,
+        "llm_injected_errors": responses.errors,
+        "levels": levels,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+        logger.info("Wrote report to %s", args.output)
+    else:
+        print(text)
+    if args.compare:
+        _compare(report, Path(args.compare))
+    return 1 if any(level["errors"] for level in levels) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
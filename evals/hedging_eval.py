@@ -0,0 +1,253 @@
+import asyncio
+import logging
+import os
+import sys
+import time
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Awaitable, Callable, Deque, Dict, List
+
+from benchmark import ReplayModels, ReplayStream
+
+logger = logging.getLogger("evals")
+
+# Behavioural evals for hedged and fallback SQL generation, against a scripted stand-in for the OpenAI
+# client whose calls take a set latency or fail. Each case drives sql_generation's routing directly and
+# checks which calls were made, which one won and what was cancelled. No backend or API key needed.
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+PRIMARY = "primary-model"
+FALLBACK = "fallback-model"
+SQL = "SELECT MAX(age) FROM default.bodyPerformance"
+FAST_MS = 20.0
+SLOW_MS = 2000.0
+HEDGE_MIN_MS = 60.0
+BREAKER_FAILURES = 3
+BREAKER_COOLDOWN_SECONDS = 0.2
+# Hedging needs this many timed calls before it has a threshold (sql_generation.HEDGE_MIN_SAMPLES).
+WARM_CALLS = 20
+# The losing call is cancelled without being awaited; this gives it time to unwind before it is checked.
+UNWIND_SECONDS = 0.05
+
+
+class ScriptedResponses:
+    # Stands in for AsyncOpenAI().responses. Each model answers its scripted (milliseconds, fails) steps
+    # in order, then FAST_MS successes; calls cancelled while waiting are counted.
+    def __init__(self, tool_name: str) -> None:
+        self.tool_name = tool_name
+        self.scripts: Dict[str, Deque[tuple[float, bool]]] = {}
+        self.calls: Dict[str, int] = {}
+        self.cancelled: Dict[str, int] = {}
+
+    def script(self, model: str, *steps: tuple[float, bool]) -> None:
+        self.scripts.setdefault(model, deque()).extend(steps)
+
+    async def create(self, *, model: str, **_: Any) -> ReplayStream:
+        self.calls[model] = self.calls.get(model, 0) + 1
+        script = self.scripts.get(model)
+        delay_ms, fails = script.popleft() if script else (FAST_MS, False)
+        try:
+            await asyncio.sleep(delay_ms / 1000)
+        except asyncio.CancelledError:
+            self.cancelled[model] = self.cancelled.get(model, 0) + 1
+            raise
+        if fails:
+            raise RuntimeError(f"Injected failure from {model}")
+        return ReplayStream(SQL, self.tool_name)
+
+
+@dataclass
+class Context:
+    generation: Any
+    hedging: Any
+    responses: ScriptedResponses
+
+    async def generate(self) -> tuple[str, str, float]:
+        started = time.perf_counter()
+        client = SimpleNamespace(responses=self.responses, models=ReplayModels())
+        sql, model = await self.generation._hedged_generate(client, PRIMARY, "prompt")
+        seconds = time.perf_counter() - started
+        await asyncio.sleep(UNWIND_SECONDS)
+        return sql, model, seconds
+
+    async def warm(self) -> None:
+        # Fills the primary's latency window so the hedge threshold is max(p90, HEDGE_MIN_MS).
+        for _ in range(WARM_CALLS):
+            await self.generate()
+
+    def routing(self) -> Dict[str, int]:
+        return self.generation._hedger.stats()
+
+    def breaker(self, model: str) -> str:
+        return self.generation._breaker(model).state
+
+
+async def _hedge_fires(context: Context) -> List[str]:
+    await context.warm()
+    before = context.routing()
+    context.responses.script(PRIMARY, (SLOW_MS, False))
+    _, model, seconds = await context.generate()
+    after = context.routing()
+    problems = []
+    if model != FALLBACK:
+        problems.append(f"Winner was {model}, expected {FALLBACK}")
+    if after["hedged"] - before["hedged"] != 1 or after["second_wins"] - before["second_wins"] != 1:
+        problems.append(f"Routing went from {before} to {after}, expected one hedge won by the second call")
+    if seconds >= SLOW_MS / 1000 / 2:
+        problems.append(f"Took {seconds:.3f}s; the hedge did not cut the stall short")
+    if context.responses.cancelled.get(PRIMARY) != 1:
+        problems.append(f"Cancelled calls were {context.responses.cancelled}, expected the primary's")
+    return problems
+
+
+async def _no_hedge_below_threshold(context: Context) -> List[str]:
+    await context.warm()
+    before = context.routing()
+    context.responses.script(PRIMARY, (HEDGE_MIN_MS / 2, False))
+    _, model, _ = await context.generate()
+    after = context.routing()
+    problems = []
+    if model != PRIMARY or after["hedged"] != before["hedged"]:
+        problems.append(f"Winner was {model} and routing went from {before} to {after}, expected no hedge")
+    if context.responses.calls.get(FALLBACK):
+        problems.append(f"The fallback was called {context.responses.calls[FALLBACK]} times")
+    return problems
+
+
+async def _hedge_same_model(context: Context) -> List[str]:
+    await context.warm()
+    before = context.routing()
+    calls_before = context.responses.calls.get(PRIMARY, 0)
+    context.responses.script(PRIMARY, (SLOW_MS, False), (FAST_MS, False))
+    _, model, seconds = await context.generate()
+    after = context.routing()
+    problems = []
+    if model != PRIMARY or after["hedged"] - before["hedged"] != 1:
+        problems.append(f"Winner was {model} and routing went from {before} to {after}, expected one hedge")
+    if context.responses.calls.get(PRIMARY, 0) - calls_before != 2:
+        problems.append("Expected the stalled call and one hedge to the same model")
+    if seconds >= SLOW_MS / 1000 / 2 or context.responses.cancelled.get(PRIMARY) != 1:
+        problems.append(f"Took {seconds:.3f}s with cancelled calls {context.responses.cancelled}")
+    return problems
+
+
+async def _failover(context: Context) -> List[str]:
+    before = context.routing()
+    context.responses.script(PRIMARY, (0.0, True))
+    _, model, _ = await context.generate()
+    after = context.routing()
+    if model != FALLBACK or after["failovers"] - before["failovers"] != 1:
+        return [f"Winner was {model} and routing went from {before} to {after}, expected one failover"]
+    return []
+
+
+async def _breaker_opens(context: Context) -> List[str]:
+    context.responses.script(PRIMARY, *[(0.0, True)] * BREAKER_FAILURES)
+    for _ in range(BREAKER_FAILURES):
+        await context.generate()
+    problems = []
+    if context.breaker(PRIMARY) != context.hedging.OPEN:
+        problems.append(f"Breaker is {context.breaker(PRIMARY)} after {BREAKER_FAILURES} failures")
+    calls_before = context.responses.calls.get(PRIMARY, 0)
+    _, model, _ = await context.generate()
+    if model != FALLBACK or context.responses.calls.get(PRIMARY, 0) != calls_before:
+        problems.append(f"With the breaker open, {model} answered and the primary was still called")
+    return problems
+
+
+async def _breaker_half_opens(context: Context) -> List[str]:
+    problems = await _breaker_opens(context)
+    await asyncio.sleep(BREAKER_COOLDOWN_SECONDS * 1.5)
+    calls_before = context.responses.calls.get(PRIMARY, 0)
+    _, model, _ = await context.generate()
+    if context.responses.calls.get(PRIMARY, 0) - calls_before != 1 or model != PRIMARY:
+        problems.append(f"After the cooldown {model} answered; expected one trial call to the primary")
+    if context.breaker(PRIMARY) != context.hedging.CLOSED:
+        problems.append(f"Breaker is {context.breaker(PRIMARY)} after a successful trial call")
+    return problems
+
+
+async def _breaker_fails_fast(context: Context) -> List[str]:
+    context.responses.script(PRIMARY, *[(0.0, True)] * BREAKER_FAILURES)
+    for _ in range(BREAKER_FAILURES):
+        try:
+            await context.generate()
+        except RuntimeError:
+            pass
+    calls_before = context.responses.calls.get(PRIMARY, 0)
+    try:
+        await context.generate()
+    except context.generation.Overloaded as exc:
+        if exc.status_code != 503 or context.responses.calls.get(PRIMARY, 0) != calls_before:
+            return [f"Got {exc.status_code} after calling the primary again"]
+        return []
+    return ["A call went through with the only model's breaker open"]
+
+
+@dataclass(frozen=True)
+class TestCase:
+    name: str
+    run: Callable[[Context], Awaitable[List[str]]]
+    fallback: bool = True
+
+
+TEST_CASES: tuple[TestCase, ...] = (
+    TestCase(name="Hedge to the fallback past the learned threshold", run=_hedge_fires),
+    TestCase(name="No hedge for a call within the threshold", run=_no_hedge_below_threshold),
+    TestCase(name="Hedge to the same model without a fallback", run=_hedge_same_model, fallback=False),
+    TestCase(name="Failover on a primary error", run=_failover),
+    TestCase(name="Breaker opens after consecutive failures", run=_breaker_opens),
+    TestCase(name="Breaker half-opens after the cooldown", run=_breaker_half_opens),
+    TestCase(name="Open breaker without a fallback fails fast", run=_breaker_fails_fast, fallback=False),
+)
+
+
+def _configure_environment() -> None:
+    os.environ.setdefault("OPENAI_API_KEY", "hedging-eval")
+    os.environ["OPENAI_MODEL"] = PRIMARY
+    os.environ["LLM_HEDGE_MIN_MS"] = str(HEDGE_MIN_MS)
+    os.environ["LLM_BREAKER_FAILURES"] = str(BREAKER_FAILURES)
+    os.environ["LLM_BREAKER_COOLDOWN_SECONDS"] = str(BREAKER_COOLDOWN_SECONDS)
+    if str(BACKEND_DIR) not in sys.path:
+        sys.path.insert(0, str(BACKEND_DIR))
+
+
+async def _run_case(case: TestCase) -> List[str]:
+    from app import hedging, sql_generation
+
+    # Each case starts with no latency history, closed breakers and fresh counters.
+    sql_generation._latencies.clear()
+    sql_generation._breakers.clear()
+    sql_generation._hedger = hedging.Hedger()
+    if case.fallback:
+        os.environ["OPENAI_FALLBACK_MODEL"] = FALLBACK
+    else:
+        os.environ.pop("OPENAI_FALLBACK_MODEL", None)
+    context = Context(
+        generation=sql_generation, hedging=hedging, responses=ScriptedResponses(sql_generation.TOOL_NAME)
+    )
+    return await case.run(context)
+
+
+def main() -> int:
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    logging.getLogger("app").setLevel(logging.ERROR)
+    _configure_environment()
+    logger.info("Running %d evals against the scripted LLM stand-in", len(TEST_CASES))
+    passed = 0
+    for index, case in enumerate(TEST_CASES, start=1):
+        try:
+            problems = asyncio.run(_run_case(case))
+        except Exception as exc:
+            problems = [f"{type(exc).__name__}: {exc}"]
+        print(f"Eval {index}: {case.name} ... {'FAIL' if problems else 'PASS'}")
+        for problem in problems:
+            print(f"  {problem}")
+        passed += not problems
+    print(f"Results: {passed}/{len(TEST_CASES)} passed")
+    return 0 if passed == len(TEST_CASES) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,165 @@
+import argparse
+import csv
+import logging
+import math
+import sqlite3
+import sys
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, List
+
+logger = logging.getLogger("evals")
+
+# Differential evals for the embedded NumPy engine: each case runs in-process through local_engine and
+# through SQLite over the same CSV, and the rows must agree. No backend, OpenAI key or ClickHouse needed.
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+DEFAULT_CSV = Path(__file__).resolve().parent.parent / "bodyPerformance.csv"
+TABLE = "default.bodyPerformance"
+SQLITE_TABLE = "bodyPerformance"
+TOLERANCE = 1e-9
+# A generated table where GROUP BY over every numeric column but age has a key space of exactly 2**64
+# times age's cardinality: folded into one int64, the age code is multiplied away and groups merge.
+WIDE_KEY_ROWS = 512
+WIDE_KEY_CARDINALITY = 256
+WIDE_KEY_COLUMNS = (
+    "height_cm", "weight_kg", "body_fat_pct", "diastolic", "systolic", "grip_force", "sit_and_bend_forward_cm",
+    "broad_jump_cm",
+)
+
+
+@dataclass(frozen=True)
+class TestCase:
+    name: str
+    sql: str
+    # "csv" for --csv, "wide_keys" for the generated table.
+    dataset: str = "csv"
+
+
+TEST_CASES: tuple[TestCase, ...] = (
+    TestCase(
+        name="Average by gender",
+        sql=f"SELECT gender, AVG(grip_force) FROM {TABLE} GROUP BY gender ORDER BY gender",
+    ),
+    TestCase(
+        name="Min and max by class with a filter",
+        sql=f"SELECT fitness_class, MIN(age), MAX(body_fat_pct) FROM {TABLE} WHERE gender = 'F' "
+        "GROUP BY fitness_class ORDER BY fitness_class",
+    ),
+    TestCase(
+        name="Grouped MIN over no rows",
+        sql=f"SELECT gender, MIN(age) FROM {TABLE} WHERE age > 1000 GROUP BY gender",
+    ),
+    TestCase(
+        name="Grouped aggregates over no rows",
+        sql=f"SELECT gender, MAX(age), AVG(age), COUNT(age) FROM {TABLE} WHERE age > 1000 GROUP BY gender",
+    ),
+    TestCase(
+        name="Group key space beyond int64",
+        sql=f"SELECT age, {', '.join(WIDE_KEY_COLUMNS)}, COUNT(situps_count) FROM {TABLE} "
+        f"GROUP BY age, {', '.join(WIDE_KEY_COLUMNS)}",
+        dataset="wide_keys",
+    ),
+    TestCase(
+        name="Count in classes",
+        sql=f"SELECT COUNT(age) FROM {TABLE} WHERE fitness_class IN ('A', 'B')",
+    ),
+    TestCase(
+        name="Rows with a threshold",
+        sql=f"SELECT age, height_cm FROM {TABLE} WHERE age >= 60 AND gender = 'M' ORDER BY height_cm DESC, age LIMIT 5",
+    ),
+)
+
+
+def _load_sqlite(path: Path) -> sqlite3.Connection:
+    connection = sqlite3.connect(":memory:")
+    with path.open(newline="", encoding="utf-8") as handle:
+        reader = csv.reader(handle)
+        header = next(reader)
+        connection.execute(f"CREATE TABLE {SQLITE_TABLE} ({', '.join(header)})")
+        rows = ([float(value) if _is_number(value) else value for value in row] for row in reader)
+        connection.executemany(f"INSERT INTO {SQLITE_TABLE} VALUES ({', '.join('?' * len(header))})", rows)
+    return connection
+
+
+def _write_wide_keys(path: Path, columns: tuple[str, ...]) -> None:
+    with path.open("w", newline="", encoding="utf-8") as handle:
+        writer = csv.DictWriter(handle, fieldnames=columns)
+        writer.writeheader()
+        for row in range(WIDE_KEY_ROWS):
+            record = {"age": 20 + row // WIDE_KEY_CARDINALITY, "gender": "M", "situps_count": 0, "fitness_class": "A"}
+            record.update({name: row % WIDE_KEY_CARDINALITY for name in WIDE_KEY_COLUMNS})
+            writer.writerow(record)
+
+
+def _is_number(value: str) -> bool:
+    try:
+        float(value)
+    except ValueError:
+        return False
+    return True
+
+
+def _same(left: Any, right: Any) -> bool:
+    if isinstance(left, (int, float)) and isinstance(right, (int, float)):
+        return math.isclose(left, right, rel_tol=TOLERANCE, abs_tol=TOLERANCE)
+    return left == right
+
+
+def _differences(local: List[tuple], expected: List[tuple], ordered: bool) -> list[str]:
+    if not ordered:
+        local, expected = sorted(local, key=repr), sorted(expected, key=repr)
+    if len(local) != len(expected):
+        return [f"Row count {len(local)}, expected {len(expected)}"]
+    return [
+        f"Row {index}: {left} != {right}"
+        for index, (left, right) in enumerate(zip(local, expected))
+        if len(left) != len(right) or not all(_same(a, b) for a, b in zip(left, right))
+    ]
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--csv",
+        type=Path,
+        default=DEFAULT_CSV,
+    )
+    return parser.parse_args()
+
+
+def main() -> int:
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    args = _parse_args()
+    if str(BACKEND_DIR) not in sys.path:
+        sys.path.insert(0, str(BACKEND_DIR))
+    from app.local_engine import execute_statement, load_csv
+    from app.schema import COLUMNS
+    from app.sql_plan import parse_statement
+
+    with tempfile.TemporaryDirectory() as directory:
+        wide_keys = Path(directory) / "wide_keys.csv"
+        _write_wide_keys(wide_keys, tuple(COLUMNS))
+        datasets = {
+            name: (load_csv(path), _load_sqlite(path)) for name, path in (("csv", args.csv), ("wide_keys", wide_keys))
+        }
+    logger.info("Running %d evals against the local engine and SQLite", len(TEST_CASES))
+    passed = 0
+    for index, case in enumerate(TEST_CASES, start=1):
+        dataset, connection = datasets[case.dataset]
+        try:
+            local = execute_statement(parse_statement(case.sql), dataset).rows
+            expected = connection.execute(case.sql.replace(TABLE, SQLITE_TABLE)).fetchall()
+            problems = _differences(local, expected, ordered="ORDER BY" in case.sql)
+        except Exception as exc:
+            problems = [f"{type(exc).__name__}: {exc}"]
+        print(f"Eval {index}: {case.name} ... {'FAIL' if problems else 'PASS'}")
+        for problem in problems:
+            print(f"  {problem}")
+        passed += not problems
+    print(f"Results: {passed}/{len(TEST_CASES)} passed")
+    return 0 if passed == len(TEST_CASES) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
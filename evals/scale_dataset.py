@@ -0,0 +1,321 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Dict, Iterator, List
+from urllib import error, request
+
+import numpy as np
+
+logger = logging.getLogger("evals")
+
+# Synthetic scale-up of bodyPerformance.csv for benchmarking. Per (gender, fitness_class) stratum it fits
+# the stratum's share of rows and a multivariate normal over the numeric columns (so within-class
+# correlations such as height/weight survive), then draws chunks of any size from that model. Chunk i
+# only depends on --seed and i, which makes loads resumable: finished chunks are recorded and skipped.
+# Memory is bounded by --workers chunks in flight, whatever --rows is.
+ROOT_DIR = Path(__file__).resolve().parent.parent
+BACKEND_DIR = ROOT_DIR / "backend"
+DEFAULT_SOURCE = ROOT_DIR / "bodyPerformance.csv"
+PROGRESS_SUFFIX = ".progress.json"
+NOTIFY_TIMEOUT_SECONDS = 120.0
+
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+from app.local_engine import COLUMNAR_MANIFEST, COLUMNAR_VERSION, load_csv  # noqa: E402
+from app.schema import COLUMNS, DATABASE, NON_NUMERIC_COLUMNS, NUMERIC_COLUMNS, TABLE  # noqa: E402
+
+
+@dataclass(frozen=True)
+class Stratum:
+    gender: str
+    fitness_class: str
+    share: float
+    mean: np.ndarray
+    covariance: np.ndarray
+    low: np.ndarray
+    high: np.ndarray
+
+
+@dataclass(frozen=True)
+class Model:
+    strata: List[Stratum]
+    # Decimal places per numeric column in the source, so generated values look like the real ones.
+    decimals: np.ndarray
+    categories: Dict[str, List[str]]
+
+
+def _decimals(values: np.ndarray) -> int:
+    for places in range(4):
+        if np.allclose(values, np.round(values, places)):
+            return places
+    return 4
+
+
+def fit(source: Path) -> Model:
+    dataset = load_csv(source)
+    numeric = np.column_stack([dataset.columns[name] for name in NUMERIC_COLUMNS])
+    complete = ~np.isnan(numeric).any(axis=1)
+    genders = dataset.columns["gender"].astype(str)
+    classes = dataset.columns["fitness_class"].astype(str)
+    strata = []
+    for gender in sorted(set(genders)):
+        for fitness_class in sorted(set(classes)):
+            mask = (genders == gender) & (classes == fitness_class) & complete
+            if mask.sum() < len(NUMERIC_COLUMNS) + 1:
+                # Too few rows for a covariance estimate; such a stratum is dropped rather than invented.
+                continue
+            rows = numeric[mask]
+            strata.append(
+                Stratum(
+                    gender=gender,
+                    fitness_class=fitness_class,
+                    share=float(mask.sum()),
+                    mean=rows.mean(axis=0),
+                    covariance=np.cov(rows, rowvar=False),
+                    low=rows.min(axis=0),
+                    high=rows.max(axis=0),
+                )
+            )
+    total = sum(stratum.share for stratum in strata)
+    strata = [replace(stratum, share=stratum.share / total) for stratum in strata]
+    decimals = np.array([_decimals(numeric[complete][:, index]) for index in range(len(NUMERIC_COLUMNS))])
+    categories = {name: [str(value) for value in dataset.categories[name]] for name in NON_NUMERIC_COLUMNS}
+    logger.info("Fitted %d strata from %d rows of %s", len(strata), dataset.row_count, source)
+    return Model(strata=strata, decimals=decimals, categories=categories)
+
+
+def generate_chunk(model: Model, seed: int, chunk: int, rows: int) -> Dict[str, np.ndarray]:
+    rng = np.random.default_rng([seed, chunk])
+    counts = rng.multinomial(rows, [stratum.share for stratum in model.strata])
+    numeric = np.empty((rows, len(NUMERIC_COLUMNS)))
+    gender_codes = np.empty(rows, dtype=np.uint8)
+    class_codes = np.empty(rows, dtype=np.uint8)
+    start = 0
+    for stratum, count in zip(model.strata, counts):
+        end = start + count
+        draws = rng.multivariate_normal(stratum.mean, stratum.covariance, size=count, method="cholesky")
+        numeric[start:end] = np.clip(draws, stratum.low, stratum.high)
+        gender_codes[start:end] = model.categories["gender"].index(stratum.gender)
+        class_codes[start:end] = model.categories["fitness_class"].index(stratum.fitness_class)
+        start = end
+    # Strata were drawn in blocks; shuffle so row order carries no signal.
+    order = rng.permutation(rows)
+    columns: Dict[str, np.ndarray] = {}
+    for index, name in enumerate(NUMERIC_COLUMNS):
+        columns[name] = np.round(numeric[order, index], int(model.decimals[index]))
+    columns["gender"] = gender_codes[order]
+    columns["fitness_class"] = class_codes[order]
+    return columns
+
+
+def _chunk_sizes(total_rows: int, chunk_rows: int) -> List[int]:
+    full, rest = divmod(total_rows, chunk_rows)
+    return [chunk_rows] * full + ([rest] if rest else [])
+
+
+class Progress:
+    # Completed chunk numbers, rewritten atomically after each one.
+    def __init__(self, path: Path, settings: dict) -> None:
+        self.path = path
+        self.settings = settings
+        self.done: set[int] = set()
+        if path.exists():
+            saved = json.loads(path.read_text(encoding="utf-8"))
+            if saved.get("settings") != settings:
+                raise ValueError(f"{path} was written with different settings; remove it to start over")
+            self.done = set(saved.get("done", []))
+
+    def mark(self, chunk: int) -> None:
+        self.done.add(chunk)
+        staging = self.path.with_suffix(".tmp")
+        staging.write_text(json.dumps({"settings": self.settings, "done": sorted(self.done)}), encoding="utf-8")
+        staging.replace(self.path)
+
+
+class ClickHouseSink:
+    # Column-oriented inserts (Native format on the wire), one client per worker thread.
+    ordered = False
+
+    def __init__(self, table: str, create: bool) -> None:
+        import clickhouse_connect
+
+        from app.clickhouse_client import connection_settings
+
+        self._connect = lambda: clickhouse_connect.get_client(**connection_settings())
+        self._local = threading.local()
+        self.table = table
+        if create:
+            self._client().command(f"CREATE TABLE IF NOT EXISTS {table} AS {DATABASE}.{TABLE}")
+
+    def _client(self):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self._connect()
+        return client
+
+    def write(self, model: Model, chunk: int, columns: Dict[str, np.ndarray], token: str) -> None:
+        data = []
+        for name in COLUMNS:
+            values = columns[name]
+            if name in NON_NUMERIC_COLUMNS:
+                values = np.asarray(model.categories[name], dtype=object)[values]
+            data.append(values.tolist())
+        # The token makes a retried chunk a no-op instead of a duplicate when the first attempt landed.
+        self._client().insert(
+            self.table,
+            data,
+            column_names=list(COLUMNS),
+            column_oriented=True,
+            settings={"insert_deduplication_token": token},
+        )
+
+
+def _columnar_paths(directory: Path) -> Dict[str, Path]:
+    return {name: directory / f"{name}.bin" for name in COLUMNS}
+
+
+class ColumnarSink:
+    # Appends to the local engine's columnar layout from one thread, in chunk order. On resume the files
+    # are truncated to the chunks recorded as done, dropping whatever an interrupted run left after them.
+    ordered = True
+
+    def __init__(self, directory: Path, model: Model, resume_rows: int) -> None:
+        self.directory = directory
+        self.model = model
+        self.rows = resume_rows
+        directory.mkdir(parents=True, exist_ok=True)
+        for name, path in _columnar_paths(directory).items():
+            itemsize = 1 if name in NON_NUMERIC_COLUMNS else 8
+            with path.open("ab") as handle:
+                handle.truncate(resume_rows * itemsize)
+        self._write_manifest()
+
+    def write(self, model: Model, chunk: int, columns: Dict[str, np.ndarray], token: str) -> None:
+        for name, path in _columnar_paths(self.directory).items():
+            dtype = "<u1" if name in NON_NUMERIC_COLUMNS else "<f8"
+            with path.open("ab") as handle:
+                handle.write(columns[name].astype(dtype, copy=False).tobytes())
+        self.rows += len(columns["age"])
+        self._write_manifest()
+
+    def _write_manifest(self) -> None:
+        specs = {name: {"dtype": "float64"} for name in NUMERIC_COLUMNS}
+        specs.update({name: {"dtype": "uint8", "categories": self.model.categories[name]} for name in NON_NUMERIC_COLUMNS})
+        manifest = {"version": COLUMNAR_VERSION, "rows": self.rows, "columns": specs}
+        staging = self.directory / (COLUMNAR_MANIFEST + ".tmp")
+        staging.write_text(json.dumps(manifest), encoding="utf-8")
+        staging.replace(self.directory / COLUMNAR_MANIFEST)
+
+
+def _bounded(executor: ThreadPoolExecutor, jobs: Iterator, window: int) -> Iterator[Future]:
+    # Submits at most `window` jobs ahead of the consumer, which keeps memory flat.
+    pending: List[Future] = []
+    for job in jobs:
+        pending.append(executor.submit(*job))
+        if len(pending) >= window:
+            yield pending.pop(0)
+    yield from pending
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, required=True, help="Rows to generate")
+    parser.add_argument("--chunk-rows", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=4, help="Chunks generated (and inserted) in parallel")
+    parser.add_argument("--source", default=str(DEFAULT_SOURCE), help="CSV to fit the distributions on")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--columnar", help="Directory for the local engine's columnar format (LOCAL_DATASET_PATH)")
+    target.add_argument("--clickhouse-table", help="ClickHouse table to insert into, e.g. default.bodyPerformance_scaled")
+    parser.add_argument(
+        "--create-table",
+        action="store_true",
+        help="Create --clickhouse-table with the source table's schema if it does not exist",
+    )
+    parser.add_argument(
+        "--notify-url",
+        help="Backend to tell about the reload when done, e.g. http://localhost:8000 (sends ADMIN_TOKEN)",
+    )
+    args = parser.parse_args()
+    if args.rows < 1 or args.chunk_rows < 1 or args.workers < 1:
+        parser.error("--rows, --chunk-rows and --workers must be at least 1")
+    if args.clickhouse_table and args.clickhouse_table.split(".")[-1] == TABLE:
+        parser.error(f"refusing to load synthetic rows into {TABLE}; choose another table")
+    return args
+
+
+def _notify_reloaded(base_url: str) -> bool:
+    # The backend caches results and derived data per table; without this it keeps serving the old rows.
+    req = request.Request(
+        base_url.rstrip("/") + "/api/admin/table-reloaded",
+        data=b"",
+        headers={"X-Admin-Token": os.environ.get("ADMIN_TOKEN", "")},
+        method="POST",
+    )
+    try:
+        with request.urlopen(req, timeout=NOTIFY_TIMEOUT_SECONDS):
+            pass
+    except (error.URLError, OSError) as exc:
+        logger.error("Could not notify %s of the reload: %s", base_url, exc)
+        return False
+    logger.info("Notified %s of the reload", base_url)
+    return True
+
+
+def main() -> int:
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    args = _parse_args()
+    model = fit(Path(args.source))
+    sizes = _chunk_sizes(args.rows, args.chunk_rows)
+    settings = {"rows": args.rows, "chunk_rows": args.chunk_rows, "seed": args.seed, "source": args.source}
+    target = args.clickhouse_table or args.columnar
+    progress = Progress(Path(target.rstrip("/") + PROGRESS_SUFFIX), settings)
+
+    if args.clickhouse_table:
+        sink = ClickHouseSink(args.clickhouse_table, args.create_table)
+    else:
+        if progress.done != set(range(len(progress.done))):
+            raise ValueError(f"{progress.path} does not describe a contiguous prefix of chunks")
+        sink = ColumnarSink(Path(args.columnar), model, sum(sizes[chunk] for chunk in progress.done))
+
+    remaining = [chunk for chunk in range(len(sizes)) if chunk not in progress.done]
+    logger.info("Writing %d of %d chunks (%d rows each) to %s", len(remaining), len(sizes), args.chunk_rows, target)
+    started = time.perf_counter()
+    written = 0
+
+    def produce(chunk: int) -> tuple[int, Dict[str, np.ndarray] | None]:
+        columns = generate_chunk(model, args.seed, chunk, sizes[chunk])
+        if sink.ordered:
+            return chunk, columns
+        sink.write(model, chunk, columns, f"scale-{args.seed}-{args.chunk_rows}-{chunk}")
+        return chunk, None
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for future in _bounded(executor, ((produce, chunk) for chunk in remaining), args.workers):
+            chunk, columns = future.result()
+            if columns is not None:
+                # Ordered sinks write here, on one thread; only generation runs in parallel.
+                sink.write(model, chunk, columns, "")
+            progress.mark(chunk)
+            written += sizes[chunk]
+            elapsed = time.perf_counter() - started
+            logger.info(
+                "Chunk %d/%d done, %d rows in %.1fs (%.0f rows/s)",
+                len(progress.done), len(sizes), written, elapsed, written / elapsed if elapsed else 0,
+            )
+    logger.info("Done: %d rows", sum(sizes))
+    if args.notify_url and not _notify_reloaded(args.notify_url):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
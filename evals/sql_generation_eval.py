@@ -1,15 +1,26 @@
 import argparse
+import asyncio
+import hashlib
 import json
 import logging
 import re
 import sys
-from dataclasses import dataclass
-from typing import Iterable
-from urllib import error, parse, request
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable
+from urllib import parse
+
+import httpx
 
 logger = logging.getLogger("evals")
 
 # Property-based generation evals: hit /api/sql/generate and assert the SQL reflects the intent of the prompt.
+# With --intent the cases run in-process against the backend's deterministic intent parser instead.
+# Cases run concurrently over one pooled HTTP client. With --cache, generated SQL is kept per prompt,
+# model and grammar fingerprint, so re-runs only call the API for cases whose inputs changed.
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+REPORT_VERSION = 1
 
 @dataclass(frozen=True)
 class TestCase:
@@ -49,9 +60,43 @@ TEST_CASES: tuple[TestCase, ...] = (
         prompt="Compare average grip force between genders.",
         must_contain=("AVG(grip_force)", "GROUP BY gender"),
     ),
+    TestCase(
+        name="Count with a sit-up threshold",
+        prompt="How many people with over 50 situps",
+        must_contain=("COUNT(",),
+        must_contain_any=(("situps_count > 50", "situps_count >= 50"),),
+        must_not_contain=("age > 50", "age >= 50"),
+    ),
+    TestCase(
+        name="Maximum grip force for females under a body fat threshold",
+        prompt="Max grip for women under 30 body fat",
+        must_contain=("MAX(grip_force)", "gender = 'F'"),
+        must_contain_any=(("body_fat_pct < 30", "body_fat_pct <= 30"),),
+        must_not_contain=("age < 30", "age <= 30", "MAX(body_fat_pct)"),
+    ),
+    TestCase(
+        name="Average grip force for males with a sit-up threshold",
+        prompt="Average grip force for men with over 40 situps",
+        must_contain=("AVG(grip_force)", "gender = 'M'"),
+        must_contain_any=(("situps_count > 40", "situps_count >= 40"),),
+        must_not_contain=("age > 40", "age >= 40"),
+    ),
 )
 
 
+
+@dataclass
+class CaseResult:
+    name: str
+    prompt: str
+    status: str = "error"
+    sql: str = ""
+    latency_ms: float | None = None
+    tokens: Dict[str, int] = field(default_factory=dict)
+    cached: bool = False
+    problems: list[str] = field(default_factory=list)
+
+
 WHITESPACE_RE = re.compile(r"\s+")
 
 
@@ -69,42 +114,76 @@ def _validate_test_cases(cases: Iterable[TestCase]) -> None:
             raise ValueError(f"expected patterns are required for test case {case.name}")
 
 
-def _fetch_sql(base_url: str, prompt: str, timeout: float) -> str:
-    url = base_url.rstrip("/") + "/api/sql/generate"
-    payload = json.dumps({"prompt": prompt}).encode("utf-8")
-    req = request.Request(url, data=payload, headers={"Content-Type": "application/json"})
+async def _fetch_json(client: httpx.AsyncClient, method: str, path: str, **kwargs: Any) -> dict:
+    url = str(client.base_url).rstrip("/") + path
     try:
-        with request.urlopen(req, timeout=timeout) as response:
-            body = response.read().decode("utf-8")
-            status = response.status
-    except error.HTTPError as exc:
-        body = exc.read().decode("utf-8", errors="replace")
-        message = f"HTTP {exc.code} from {url}: {body}"
-        logger.error(message)
-        raise RuntimeError(message) from exc
-    except error.URLError as exc:
-        message = f"Request failed for {url}: {exc.reason}"
+        response = await client.request(method, path, **kwargs)
+    except httpx.HTTPError as exc:
+        message = f"Request failed for {url}: {exc}"
         logger.error(message)
         raise RuntimeError(message) from exc
 
-    if status < 200 or status >= 300:
-        message = f"HTTP {status} from {url}: {body}"
+    if response.status_code < 200 or response.status_code >= 300:
+        message = f"HTTP {response.status_code} from {url}: {response.text}"
         logger.error(message)
         raise RuntimeError(message)
 
     try:
-        payload = json.loads(body)
+        return response.json()
     except json.JSONDecodeError as exc:
-        message = f"Invalid JSON from {url}: {body}"
+        message = f"Invalid JSON from {url}: {response.text}"
         logger.error(message)
         raise RuntimeError(message) from exc
 
+
+async def _fetch_sql(client: httpx.AsyncClient, prompt: str) -> tuple[str, Dict[str, int]]:
+    payload = await _fetch_json(client, "POST", "/api/sql/generate", json={"prompt": prompt})
     sql = payload.get("sql")
     if not isinstance(sql, str) or not sql.strip():
-        message = f"Response missing sql from {url}: {payload}"
+        message = f"Response missing sql from /api/sql/generate: {payload}"
         logger.error(message)
         raise RuntimeError(message)
-    return sql
+    return sql, payload.get("tokens") or {}
+
+
+async def _fingerprint(client: httpx.AsyncClient) -> str:
+    # Identifies the server's grammar, instructions and model; cached SQL is only reused under the same one.
+    payload = await _fetch_json(client, "GET", "/api/sql/fingerprint")
+    return f"{payload['model']}:{payload['fingerprint']}"
+
+
+def _intent_sql(prompt: str) -> str:
+    if str(BACKEND_DIR) not in sys.path:
+        sys.path.insert(0, str(BACKEND_DIR))
+    from app.intent_parser import answer_without_llm
+
+    intent = answer_without_llm(prompt)
+    if intent is None:
+        raise RuntimeError("Intent parser declined the prompt")
+    return intent.sql
+
+
+def _intent_fingerprint() -> str:
+    # The parser's output depends on its source and the grammar, so hash both.
+    digest = hashlib.sha256()
+    for path in (BACKEND_DIR / "app" / "intent_parser.py", BACKEND_DIR / "app" / "sql_grammar.py"):
+        digest.update(path.read_bytes())
+    return "intent:" + digest.hexdigest()[:16]
+
+
+def _cache_key(prompt: str, fingerprint: str) -> str:
+    return hashlib.sha256(f"{fingerprint}\0{prompt}".encode("utf-8")).hexdigest()
+
+
+def _load_cache(path: Path | None) -> Dict[str, dict]:
+    if path is None or not path.exists():
+        return {}
+    try:
+        cache = json.loads(path.read_text(encoding="utf-8"))
+    except json.JSONDecodeError:
+        logger.warning("Ignoring unreadable eval cache %s", path)
+        return {}
+    return cache if isinstance(cache, dict) else {}
 
 
 def _missing_patterns(sql: str, case: TestCase) -> list[str]:
@@ -137,7 +216,29 @@ def _parse_args() -> argparse.Namespace:
         "--show-sql",
         action="store_true",
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--intent",
+        action="store_true",
+        help="Check the deterministic intent parser in-process instead of calling the API",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="Cases run at once",
+    )
+    parser.add_argument(
+        "--cache",
+        help="JSON file of SQL from earlier runs; cases whose prompt, model and grammar are unchanged are not re-sent",
+    )
+    parser.add_argument(
+        "--report",
+        help="Write a JSON report of every case (status, SQL, latency, tokens) to this file",
+    )
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    return args
 
 
 def _validate_base_url(base_url: str) -> str:
@@ -147,40 +248,116 @@ def _validate_base_url(base_url: str) -> str:
     return base_url
 
 
+async def _run_case(
+    case: TestCase,
+    args: argparse.Namespace,
+    client: httpx.AsyncClient,
+    semaphore: asyncio.Semaphore,
+    cache: Dict[str, dict],
+    fingerprint: str,
+) -> CaseResult:
+    result = CaseResult(name=case.name, prompt=case.prompt)
+    key = _cache_key(case.prompt, fingerprint)
+    cached = cache.get(key) if args.cache else None
+    if cached is not None:
+        result.sql, result.latency_ms, result.tokens, result.cached = cached["sql"], cached["latency_ms"], {}, True
+    else:
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                if args.intent:
+                    result.sql, result.tokens = _intent_sql(case.prompt), {}
+                else:
+                    result.sql, result.tokens = await _fetch_sql(client, case.prompt)
+            except Exception as exc:
+                logger.exception("Eval request failed: %s", case.name)
+                result.problems = [f"Error: {exc}"]
+                return result
+            result.latency_ms = round((time.perf_counter() - started) * 1000, 3)
+        cache[key] = {"prompt": case.prompt, "sql": result.sql, "latency_ms": result.latency_ms}
+    result.problems = _missing_patterns(result.sql, case)
+    result.status = "fail" if result.problems else "pass"
+    return result
+
+
+def _print_result(index: int, result: CaseResult, show_sql: bool) -> None:
+    if result.status == "pass":
+        suffix = " (cached)" if result.cached else ""
+        print(f"Eval {index}: {result.name} ... PASS{suffix}")
+        if show_sql:
+            print(f"  - SQL: {result.sql}")
+        return
+    print(f"Eval {index}: {result.name} ... FAIL")
+    for entry in result.problems:
+        print(f"  - {entry}")
+    if result.status == "fail":
+        print(f"  - Got: {result.sql}")
+
+
+def _percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+async def _run(args: argparse.Namespace, base_url: str) -> list[CaseResult]:
+    cache_path = Path(args.cache) if args.cache else None
+    cache = _load_cache(cache_path)
+    limits = httpx.Limits(max_connections=args.workers, max_keepalive_connections=args.workers)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        fingerprint = ""
+        if args.cache:
+            fingerprint = _intent_fingerprint() if args.intent else await _fingerprint(client)
+        semaphore = asyncio.Semaphore(args.workers)
+        results = await asyncio.gather(
+            *(_run_case(case, args, client, semaphore, cache, fingerprint) for case in TEST_CASES)
+        )
+    if cache_path is not None:
+        cache_path.write_text(json.dumps(cache, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+    return list(results)
+
+
 def main() -> int:
     logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
     args = _parse_args()
     base_url = _validate_base_url(args.base_url)
     _validate_test_cases(TEST_CASES)
-    logger.info("Running %d evals against %s", len(TEST_CASES), base_url)
-
-    passed = 0
-    failed = 0
-    for index, case in enumerate(TEST_CASES, start=1):
-        try:
-            sql = _fetch_sql(base_url, case.prompt, args.timeout)
-        except Exception as exc:
-            logger.exception("Eval request failed: %s", case.name)
-            print(f"Eval {index}: {case.name} ... FAIL")
-            print(f"  - Error: {exc}")
-            failed += 1
-            continue
-
-        missing = _missing_patterns(sql, case)
-        if missing:
-            print(f"Eval {index}: {case.name} ... FAIL")
-            for entry in missing:
-                print(f"  - {entry}")
-            print(f"  - Got: {sql}")
-            failed += 1
-        else:
-            print(f"Eval {index}: {case.name} ... PASS")
-            if args.show_sql:
-                print(f"  - SQL: {sql}")
-            passed += 1
-
-    print(f"Results: {passed}/{passed + failed} passed")
-    return 1 if failed else 0
+    target = "the intent parser" if args.intent else base_url
+    logger.info("Running %d evals against %s with %d workers", len(TEST_CASES), target, args.workers)
+
+    started = time.perf_counter()
+    results = asyncio.run(_run(args, base_url))
+    elapsed = time.perf_counter() - started
+    for index, result in enumerate(results, start=1):
+        _print_result(index, result, args.show_sql)
+
+    passed = sum(result.status == "pass" for result in results)
+    latencies = [result.latency_ms for result in results if result.latency_ms is not None and not result.cached]
+    print(f"Results: {passed}/{len(results)} passed in {elapsed:.2f}s")
+    if args.report:
+        report = {
+            "version": REPORT_VERSION,
+            "target": target,
+            "workers": args.workers,
+            "seconds": round(elapsed, 3),
+            "passed": passed,
+            "failed": len(results) - passed,
+            "cached": sum(result.cached for result in results),
+            "latency_ms": {
+                "p50": _percentile(latencies, 0.5),
+                "p95": _percentile(latencies, 0.95),
+                "max": max(latencies, default=None),
+            },
+            "tokens": {
+                kind: sum(result.tokens.get(kind, 0) for result in results) for kind in ("input", "output")
+            },
+            "cases": [asdict(result) for result in results],
+        }
+        Path(args.report).write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+        logger.info("Wrote report to %s", args.report)
+    return 0 if passed == len(results) else 1
 
 
 if __name__ == "__main__":
@@ -1,6 +1,6 @@
 import { useState } from 'react'
 import { ChevronDown, ChevronUp } from 'lucide-react'
-import { queryBackend } from '@/api/query'
+import { queryBackend, queryPage } from '@/api/query'
 import QueryCard from '@/components/QueryCard'
 import ResultsCard from '@/components/ResultsCard'
 import { Badge } from '@/components/ui/badge'
@@ -12,6 +12,7 @@ function App() {
   const [result, setResult] = useState<QueryResponse | null>(null)
   const [error, setError] = useState<string | null>(null)
   const [loading, setLoading] = useState(false)
+  const [loadingMore, setLoadingMore] = useState(false)
   const [schemaOpen, setSchemaOpen] = useState(false)
 
   const runQuery = async (queryPrompt: string) => {
@@ -45,6 +46,32 @@ function App() {
     }
   }
 
+  const loadMore = async () => {
+    if (!result?.next_cursor) {
+      return
+    }
+
+    setLoadingMore(true)
+    try {
+      const { ok, status, data } = await queryPage(result.next_cursor)
+      if (!ok) {
+        setError(data.error ?? `Request failed with status ${status}`)
+        return
+      }
+      const previous = result.data ?? []
+      setResult({
+        ...result,
+        data: (data.data ?? []).map((column, index) => [...(previous[index] ?? []), ...column]),
+        next_cursor: data.next_cursor,
+      })
+    } catch (err) {
+      console.error(err)
+      setError(err instanceof Error ? err.message : 'Request failed. Check backend logs for details.')
+    } finally {
+      setLoadingMore(false)
+    }
+  }
+
   const submitPrompt = () => runQuery(prompt)
 
   const handleExampleClick = (example: string) => {
@@ -96,7 +123,7 @@ function App() {
             loading={loading}
             error={error}
           />
-          <ResultsCard result={result} loading={loading} />
+          <ResultsCard result={result} loading={loading} loadingMore={loadingMore} onLoadMore={loadMore} />
         </div>
 
         <footer className="text-center text-xs text-muted-foreground/60 pt-4">
@@ -2,13 +2,13 @@ import type { QueryResponse } from "@/types/query"
 
 const API_BASE_URL = import.meta.env.VITE_API_URL || ""
 
-export async function queryBackend(prompt: string) {
-  const response = await fetch(`${API_BASE_URL}/api/query`, {
+async function postQuery(path: string, body: Record<string, unknown>) {
+  const response = await fetch(`${API_BASE_URL}${path}?format=columnar`, {
     method: "POST",
     headers: {
       "Content-Type": "application/json",
     },
-    body: JSON.stringify({ prompt }),
+    body: JSON.stringify(body),
   })
 
   let data: QueryResponse
@@ -20,3 +20,12 @@ export async function queryBackend(prompt: string) {
 
   return { ok: response.ok, status: response.status, data }
 }
+
+export function queryBackend(prompt: string) {
+  return postQuery("/api/query", { prompt })
+}
+
+// Fetches the page after a result that came back with a next_cursor.
+export function queryPage(cursor: string) {
+  return postQuery("/api/query/page", { cursor })
+}
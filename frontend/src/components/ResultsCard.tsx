@@ -9,18 +9,21 @@ import type { QueryResponse } from "@/types/query"
 type ResultsCardProps = {
   result: QueryResponse | null
   loading?: boolean
+  loadingMore?: boolean
+  onLoadMore?: () => void
 }
 
-function ResultsCard({ result, loading }: ResultsCardProps) {
+function ResultsCard({ result, loading, loadingMore, onLoadMore }: ResultsCardProps) {
   const [showSql, setShowSql] = useState(false)
 
-  const rows = result ? result.rows : []
+  const data = result?.data ?? []
+  const rowCount = data[0]?.length ?? 0
   const hasError = Boolean(result?.error)
   const hasSuccess = Boolean(result && !result.error)
-  const hasRows = rows.length > 0
+  const hasRows = rowCount > 0
 
   const description = hasSuccess
-    ? `${rows.length} ${rows.length === 1 ? "result" : "results"} found`
+    ? `${rowCount} ${rowCount === 1 ? "result" : "results"} found`
     : null
 
   return (
@@ -66,7 +69,20 @@ function ResultsCard({ result, loading }: ResultsCardProps) {
             {(hasRows || (!hasError && !hasRows)) && (
               <div className="max-h-72 overflow-auto rounded-lg border bg-muted/40 p-4">
                 {hasRows ? (
-                  <ResultsTable columns={result.columns} rows={rows} />
+                  <>
+                    <ResultsTable columns={result.columns} data={data} />
+                    {result.next_cursor && onLoadMore && (
+                      <button
+                        type="button"
+                        onClick={onLoadMore}
+                        disabled={loadingMore}
+                        className="mt-3 text-sm text-muted-foreground hover:text-foreground transition-colors flex items-center gap-1.5 disabled:opacity-50"
+                      >
+                        {loadingMore && <Loader2 className="h-4 w-4 animate-spin" />}
+                        Load more
+                      </button>
+                    )}
+                  </>
                 ) : (
                   <p className="text-base text-muted-foreground py-4 text-center">No matching results found.</p>
                 )}
@@ -1,12 +1,13 @@
-import type { QueryRow } from "@/types/query"
+import type { QueryColumn } from "@/types/query"
 
 type ResultsTableProps = {
   columns: string[]
-  rows: QueryRow[]
+  data: QueryColumn[]
 }
 
-function ResultsTable({ columns, rows }: ResultsTableProps) {
-  if (rows.length === 0 || columns.length === 0) {
+function ResultsTable({ columns, data }: ResultsTableProps) {
+  const rowCount = data[0]?.length ?? 0
+  if (rowCount === 0 || columns.length === 0) {
     return null
   }
 
@@ -22,11 +23,11 @@ function ResultsTable({ columns, rows }: ResultsTableProps) {
         </tr>
       </thead>
       <tbody>
-        {rows.map((row, index) => (
-          <tr key={index} className="border-b last:border-0">
-            {columns.map((column) => (
+        {Array.from({ length: rowCount }, (_, rowIndex) => (
+          <tr key={rowIndex} className="border-b last:border-0">
+            {columns.map((column, columnIndex) => (
               <td key={column} className="py-3 pr-6">
-                {String(row[column] ?? "")}
+                {String(data[columnIndex]?.[rowIndex] ?? "")}
               </td>
             ))}
           </tr>
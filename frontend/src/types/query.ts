@@ -1,8 +1,12 @@
-export type QueryRow = Record<string, unknown>
+// Columnar results: data[i] holds every value of columns[i].
+export type QueryColumn = unknown[]
 
 export type QueryResponse = {
   sql: string
   columns: string[]
-  rows: QueryRow[]
+  data?: QueryColumn[]
+  next_cursor?: string | null
+  total_rows?: number
+  backend?: string
   error?: string
 }